@@ -12,6 +12,10 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
+    # Keep uploaded files in memory so images are decoded without a temp file round trip
+    from utils.image_utils import UploadRequest
+    app.request_class = UploadRequest
+    
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
@@ -19,11 +23,50 @@ def create_app():
     login_manager.login_view = 'frontend.login'
     login_manager.login_message = 'Please log in to access this page.'
     
-    # User loader for Flask-Login
+    # Compact jsonify(), using orjson when installed
+    from utils.serializers import init_json
+    init_json(app)
+    
+    # Session data is kept server-side; the cookie only holds a signed id
+    from utils.sessions import init_sessions
+    init_sessions(app)
+    
+    # Shared payment gateway client
+    from utils.ecpay import init_ecpay_service
+    init_ecpay_service(app)
+    
+    # Buffered ad view/click counters
+    from utils.ad_tracking import init_ad_counters
+    init_ad_counters(app)
+    
+    # Password hashing policy and its thread pool
+    from utils.passwords import init_password_hasher
+    init_password_hasher(app)
+    
+    # Background rendition generation for uploads
+    from utils.image_jobs import init_image_jobs
+    init_image_jobs(app)
+    
+    # srcset/picture template helpers and caching for hashed renditions
+    from utils.image_utils import init_image_helpers
+    init_image_helpers(app)
+    
+    # Fingerprinted, precompressed CSS/JS built by `flask assets build`
+    from utils.assets import init_assets
+    init_assets(app)
+    
+    # Per-request SQL counts, Server-Timing and slow-query log (SQL_INSTRUMENTATION)
+    from utils.query_stats import init_query_instrumentation
+    init_query_instrumentation(app)
+    
+    # User loader for Flask-Login; serves a cached read-only snapshot, not an ORM row
     @login_manager.user_loader
     def load_user(user_id):
         from models import User
-        return User.query.get(int(user_id))
+        try:
+            return User.get_snapshot(int(user_id))
+        except ValueError:
+            return None
     
     # Create upload directories
     os.makedirs('static/uploads/products', exist_ok=True)
@@ -60,6 +103,211 @@ def register_cli_commands(app):
         else:
             click.echo(f'Synced {updated} pending orders.')
 
+    @app.cli.command('flush-ad-counters')
+    @with_appcontext
+    def flush_ad_counters_command():
+        from utils.ad_tracking import get_ad_counters
+
+        updated = get_ad_counters().flush()
+        click.echo(f'Flushed buffered counters for {updated} ads.')
+
+    @app.cli.command('backfill-order-stats')
+    @with_appcontext
+    def backfill_order_stats_command():
+        from tasks.order_stats import backfill_user_order_stats
+
+        updated = backfill_user_order_stats()
+        click.echo(f'Recomputed order stats for {updated} users.')
+
+    @app.cli.group('images')
+    def images_group():
+        """Maintenance of uploaded product and ad images."""
+
+    @images_group.command('rebuild')
+    @click.option('--workers', type=int, default=None, help='Worker processes (defaults to CPU count)')
+    @click.option('--batch-size', default=200, show_default=True, help='Rows per batch and checkpoint')
+    @click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+                  help='Checkpoint file (defaults to <instance>/images-rebuild.json)')
+    @click.option('--resume', is_flag=True, help='Continue after the last checkpointed batch')
+    @click.option('--force', is_flag=True, help='Rebuild images that are already up to date')
+    @click.option('--pending', is_flag=True,
+                  help='Only process uploads left pending by a crash or restart, from their originals')
+    @click.option('--min-age', default=900, show_default=True,
+                  help='With --pending, skip uploads pending for fewer than this many seconds')
+    @with_appcontext
+    def images_rebuild_command(workers, batch_size, checkpoint, resume, force, pending, min_age):
+        from tasks.images import rebuild_images, requeue_pending_images
+
+        if pending:
+            info = requeue_pending_images(min_age=min_age)
+            click.echo(f"Processed {info['requeued']} pending uploads again; "
+                       f"marked {info['failed']} without a stored original as failed.")
+            return
+
+        info = rebuild_images(
+            workers=workers,
+            batch_size=batch_size,
+            checkpoint_path=checkpoint,
+            resume=resume,
+            force=force,
+            progress=click.echo,
+        )
+        if resume and not info['resumed']:
+            click.echo('No checkpoint for the current image settings; started from the beginning.')
+        click.echo(
+            f"Rebuilt {info['rebuilt']} images, skipped {info['skipped']} up to date, "
+            f"{info['missing']} missing, {info['failed']} failed."
+        )
+        if info['limited']:
+            click.echo(
+                f"{info['limited']} images have no stored original and could not fully reach the current "
+                "settings (product ladders stop at the largest stored width; ads whose aspect ratio "
+                "changed were left as they are). Upload them again to fix."
+            )
+        click.echo(f"Processed {info['processed']} images in {info['seconds']:.1f}s ({info['per_second']:.1f} images/s).")
+
+    @images_group.command('gc')
+    @click.option('--min-age', default=3600, show_default=True,
+                  help='Keep unreferenced files younger than this many seconds')
+    @click.option('--dry-run', is_flag=True, help='Only report orphaned files')
+    @click.option('--quarantine', type=click.Path(file_okay=False), default=None,
+                  help='Move orphaned files here instead of deleting them')
+    @click.option('--batch-size', default=500, show_default=True, help='Files removed per batch')
+    @with_appcontext
+    def images_gc_command(min_age, dry_run, quarantine, batch_size):
+        from tasks.images import gc_uploads
+
+        info = gc_uploads(
+            min_age=min_age,
+            dry_run=dry_run,
+            quarantine_dir=quarantine,
+            batch_size=batch_size,
+            progress=click.echo,
+        )
+        action = 'Would remove' if dry_run else ('Quarantined' if quarantine else 'Removed')
+        click.echo(
+            f"Scanned {info['scanned']} files ({info['scanned_bytes'] / 1048576:.1f} MiB) against "
+            f"{info['referenced']} referenced paths in {info['seconds']:.2f}s."
+        )
+        click.echo(
+            f"{action} {info['orphans']} orphaned files ({info['orphan_bytes'] / 1048576:.1f} MiB); "
+            f"kept {info['recent']} recent unreferenced files."
+        )
+
+    @app.cli.group('ads')
+    def ads_group():
+        """Advertisement maintenance."""
+
+    @ads_group.command('normalize-positions')
+    @click.option('--dry-run', is_flag=True, help='Only report the positions that would change')
+    @with_appcontext
+    def ads_normalize_positions_command(dry_run):
+        from tasks.ads import normalize_ad_positions
+
+        changes, unknown = normalize_ad_positions(dry_run=dry_run)
+        for ad, old, new in changes:
+            click.echo(f'Ad {ad.id} ({ad.title}): {old!r} -> {new!r}')
+        for ad in unknown:
+            click.echo(f'Ad {ad.id} ({ad.title}): {ad.position!r} matches no slot and is not shown; edit it in the admin.')
+        click.echo(f"{'Would move' if dry_run else 'Moved'} {len(changes)} ads; {len(unknown)} left without a slot.")
+
+    @app.cli.group('sessions')
+    def sessions_group():
+        """Server-side session store maintenance."""
+
+    @sessions_group.command('gc')
+    @click.option('--batch-size', default=1000, show_default=True, help='Expired sessions deleted per transaction')
+    @with_appcontext
+    def sessions_gc_command(batch_size):
+        store = app.extensions.get('session_store')
+        if store is None:
+            click.echo('SESSION_STORE is cookie; nothing to collect.')
+            return
+        removed = store.gc(batch_size=batch_size)
+        click.echo(f'Removed {removed} expired sessions.')
+
+    @app.cli.group('assets')
+    def assets_group():
+        """Static asset pipeline."""
+
+    @assets_group.command('build')
+    def assets_build_command():
+        from tasks.assets import build_assets
+
+        manifest = app.extensions['assets']
+        info = build_assets(app.static_folder, manifest.output_dir, app.static_url_path)
+        click.echo(
+            f"Built {info['files']} assets: {info['source_bytes']} bytes source, "
+            f"{info['minified_bytes']} minified, {info['gzip_bytes']} gzip"
+            + (f", {info['brotli_bytes']} brotli" if info['brotli'] else ' (install brotli for .br variants)')
+            + '.'
+        )
+        click.echo(f"Manifest written to {info['manifest']}; removed {info['removed']} stale files.")
+        if info['unminified']:
+            click.echo(f"Copied {'/'.join(info['unminified'])} unminified; install rcssmin and rjsmin to minify.")
+
+    @app.cli.group('bench')
+    def bench_group():
+        """Micro-benchmarks for hot code paths."""
+
+    @bench_group.command('ecpay')
+    @click.option('--iterations', default=20000, show_default=True, help='CheckMacValue verifications to time')
+    @with_appcontext
+    def bench_ecpay_command(iterations):
+        from tasks.benchmarks import benchmark_check_mac_value
+        from utils.ecpay import get_ecpay_service
+
+        info = benchmark_check_mac_value(get_ecpay_service(), iterations=iterations)
+        click.echo(f"CheckMacValue verification over {info['iterations']} callbacks:")
+        click.echo(f"  legacy:  {info['legacy_us']:.2f} us/callback")
+        click.echo(f"  current: {info['current_us']:.2f} us/callback")
+        click.echo(f"  cached:  {info['cached_us']:.2f} us/callback (repeated notifications)")
+
+    @bench_group.command('images')
+    @click.option('--iterations', default=5, show_default=True, help='Uploads to process per pipeline')
+    @click.option('--width', default=4000, show_default=True, help='Width of the synthetic source photo')
+    @click.option('--height', default=3000, show_default=True, help='Height of the synthetic source photo')
+    def bench_images_command(iterations, width, height):
+        from tasks.benchmarks import benchmark_image_renditions
+
+        info = benchmark_image_renditions(iterations=iterations, width=width, height=height)
+        click.echo(f"Product image processing of a {info['source']} over {info['iterations']} uploads:")
+        click.echo(f"  legacy:  {info['legacy_ms']:.1f} ms/upload ({info['legacy_files']} files)")
+        click.echo(
+            f"  current: {info['current_ms']:.1f} ms/upload "
+            f"({info['current_files']} files, {'/'.join(info['formats'])})"
+        )
+
+    @bench_group.command('api')
+    @click.option('--per-page', default=100, show_default=True, help='Products per /api/products page')
+    @click.option('--iterations', default=20, show_default=True, help='Pages to build per variant')
+    @with_appcontext
+    def bench_api_command(per_page, iterations):
+        from tasks.benchmarks import benchmark_product_api
+
+        info = benchmark_product_api(per_page=per_page, iterations=iterations)
+        click.echo(f"/api/products page of {info['products']} products over {info['iterations']} iterations:")
+        click.echo(f"  legacy:  {info['legacy_ms']:.2f} ms/page, {info['legacy_bytes']} bytes")
+        click.echo(f"  current: {info['current_ms']:.2f} ms/page, {info['current_bytes']} bytes")
+
+    @bench_group.command('passwords')
+    @click.option('--method', 'methods', multiple=True,
+                  help='Werkzeug hash method to time (repeatable; defaults to PASSWORD_HASH_METHOD)')
+    @click.option('--iterations', default=20, show_default=True, help='Verifications per thread')
+    @click.option('--workers', type=int, default=None, help='Concurrent logins and pool size (defaults to CPU count)')
+    def bench_passwords_command(methods, iterations, workers):
+        from tasks.benchmarks import benchmark_password_hashing
+
+        info = benchmark_password_hashing(
+            methods or [app.config['PASSWORD_HASH_METHOD']], iterations=iterations, workers=workers
+        )
+        click.echo(f"Password verification, {info['workers']} concurrent logins x {info['iterations']}:")
+        for result in info['methods']:
+            click.echo(
+                f"  {result['method']}: {result['serial_ms']:.1f} ms/login, "
+                f"{result['per_second']:.1f} logins/s ({result['per_core']:.1f} per core)"
+            )
+
 
 if __name__ == '__main__':
     app = create_app()
@@ -21,3 +21,75 @@ class Config:
         'desktop': (1920, 1080),  # 16:9
         'mobile': (1080, 1920)    # 9:16
     }
+    
+    # Responsive product image ladder (longest edge in px), generated from a single decode of
+    # each upload and stored under content-hashed names; AVIF is skipped if Pillow cannot encode it
+    PRODUCT_IMAGE_WIDTHS = (160, 320, 640, 1280)
+    PRODUCT_IMAGE_FORMATS = ('avif', 'webp')
+    IMAGE_QUALITY = {'webp': 85, 'avif': 60}  # run `flask images rebuild` after changing image settings
+    
+    # Uploaded images are decoded from memory and converted by a local process pool after the request commits
+    IMAGE_PROCESSING_ASYNC = (os.environ.get('IMAGE_PROCESSING_ASYNC') or 'true').lower() in ('1', 'true', 'yes')
+    IMAGE_WORKERS = int(os.environ['IMAGE_WORKERS']) if os.environ.get('IMAGE_WORKERS') else None  # defaults to CPU count
+    IMAGE_MAX_PIXELS = 40_000_000  # uploads with more pixels are rejected from the header, before decoding
+    UPLOAD_MEMORY_LIMIT = MAX_CONTENT_LENGTH  # uploads up to this size never touch a temp file
+    
+    # Ad view/click counters are spooled and flushed every N seconds or N events
+    AD_COUNTER_SPOOL_DIR = os.environ.get('AD_COUNTER_SPOOL_DIR')  # defaults to <instance>/ad_counters
+    AD_COUNTER_FLUSH_INTERVAL = 10
+    AD_COUNTER_FLUSH_EVENTS = 500
+    # A client's repeated views/clicks of one ad within this many seconds count once
+    AD_VIEW_DEDUPE_SECONDS = 300
+    AD_CLICK_DEDUPE_SECONDS = 1800
+    AD_DEDUPE_SIZE = 100000
+    
+    # Ad slot index is rebuilt after admin writes, at the next schedule boundary, or after this many seconds
+    AD_SLOT_INDEX_TTL = 300
+    
+    # Compiled shipping rules are rebuilt after admin writes or after this many seconds
+    SHIPPING_RULES_TTL = 300
+    
+    # Where session data lives: sql (shared by all processes), memory (single process) or cookie;
+    # with sql/memory the cookie only carries a signed id. Run `flask sessions gc` periodically.
+    SESSION_STORE = os.environ.get('SESSION_STORE') or 'sql'
+    SESSION_MEMORY_MAX_ENTRIES = 10000
+    
+    # Werkzeug hash method for passwords, e.g. pbkdf2:sha256:600000 or scrypt:32768:8:1;
+    # stored hashes are migrated to it on the next successful login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_WORKERS = int(os.environ['PASSWORD_HASH_WORKERS']) if os.environ.get('PASSWORD_HASH_WORKERS') else None  # defaults to CPU count
+    
+    # Logged-in users are served from a snapshot cache refreshed after this many seconds
+    # (and right after profile/checkout updates)
+    USER_CACHE_TTL = 60
+    USER_CACHE_SIZE = 10000
+    
+    # Per-user wishlist product ids, reused while users.wishlist_version is unchanged
+    # (checked once per request) and reloaded after this many seconds regardless
+    WISHLIST_CACHE_TTL = 3600
+    WISHLIST_CACHE_SIZE = 10000
+    
+    # Most ids accepted by GET /api/products:batch
+    API_BATCH_MAX_IDS = 100
+    
+    # Rows fetched per keyset query by the streaming NDJSON/CSV exports
+    EXPORT_BATCH_SIZE = 500
+    
+    # Lifetime in seconds of bearer tokens from POST /api/auth/token
+    API_TOKEN_MAX_AGE = int(os.environ.get('API_TOKEN_MAX_AGE') or 30 * 24 * 3600)
+    
+    # Per-request SQL query count/time in a Server-Timing header, and a warning log line for
+    # statements slower than SQL_SLOW_QUERY_MS with the template or code line that issued them.
+    # Off by default; admins can switch it per process at /backend/tools/sql-instrumentation
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    SQL_SLOW_QUERY_MS = float(os.environ.get('SQL_SLOW_QUERY_MS') or 100)
+    SQL_SLOWEST_PER_REQUEST = 3
+    
+    # Part of every catalog ETag; bump it when a deploy changes templates or API payloads
+    HTTP_CACHE_VERSION = os.environ.get('HTTP_CACHE_VERSION') or '1'
+    
+    # ECPay settings
+    ECPAY_MODE = os.environ.get('ECPAY_MODE') or 'test'  # test, production
+    ECPAY_MERCHANT_ID = os.environ.get('ECPAY_MERCHANT_ID')
+    ECPAY_HASH_KEY = os.environ.get('ECPAY_HASH_KEY')
+    ECPAY_HASH_IV = os.environ.get('ECPAY_HASH_IV')
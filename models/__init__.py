@@ -2,12 +2,14 @@ from .user import User
 from .category import Category
 from .product import Product, ProductImage
 from .cart import Cart, CartItem
-from .ads import Ads
-from .coupon import Coupon
+from .ads import Ads, AdCounterBatch
+from .coupon import Coupon, CouponRedemption
 from .shipping_fee import ShippingFee
 from .wishlist import WishList
+from .session import ServerSession
 
 __all__ = [
     'User', 'Category', 'Product', 'ProductImage',
-    'Cart', 'CartItem', 'Ads', 'Coupon', 'ShippingFee', 'WishList'
+    'Cart', 'CartItem', 'Ads', 'AdCounterBatch', 'Coupon', 'CouponRedemption', 'ShippingFee', 'WishList',
+    'ServerSession'
 ]
@@ -1,6 +1,95 @@
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy.orm import validates
+
 from database import db
 
+HOMEPAGE_BANNER = 'homepage_banner'
+
+# Slots the storefront renders, with their admin labels
+AD_POSITIONS = (
+    (HOMEPAGE_BANNER, 'Homepage banner'),
+    ('sidebar', 'Sidebar'),
+    ('footer', 'Footer'),
+)
+
+# Legacy/free-text position names mapped to their canonical slot
+POSITION_ALIASES = {
+    'homepage_banner': HOMEPAGE_BANNER,
+    'homepage_hero': HOMEPAGE_BANNER,
+    'home_banner': HOMEPAGE_BANNER,
+    'homepage': HOMEPAGE_BANNER,
+    'home_hero': HOMEPAGE_BANNER,
+}
+
+
+def normalize_position(position):
+    """Normalize an ad position to its canonical slot name"""
+    if not position:
+        return position
+    key = position.strip().lower().replace('-', '_').replace(' ', '_')
+    # Only the listed aliases are merged; any other position keeps its own slot
+    return POSITION_ALIASES.get(key, key)
+
+
+def is_known_position(position):
+    """Whether the storefront renders ads with this position anywhere"""
+    return normalize_position(position) in {slot for slot, _ in AD_POSITIONS}
+
+
+@dataclass(frozen=True)
+class AdSlot:
+    """Detached snapshot of an ad as served from the slot index"""
+    id: int
+    title: str
+    description: Optional[str]
+    desktop_image: Optional[str]
+    mobile_image: Optional[str]
+    link_url: Optional[str]
+    link_target: Optional[str]
+    position: str
+    sort_order: int
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+
+    @classmethod
+    def from_ad(cls, ad):
+        return cls(
+            id=ad.id,
+            title=ad.title,
+            description=ad.description,
+            desktop_image=ad.desktop_image,
+            mobile_image=ad.mobile_image,
+            link_url=ad.link_url,
+            link_target=ad.link_target,
+            position=normalize_position(ad.position),
+            sort_order=ad.sort_order or 0,
+            start_date=ad.start_date,
+            end_date=ad.end_date,
+        )
+
+    @property
+    def has_image(self):
+        return bool(self.desktop_image or self.mobile_image)
+
+    def in_window(self, now):
+        if self.start_date and now < self.start_date:
+            return False
+        if self.end_date and now > self.end_date:
+            return False
+        return True
+
+
+# Slot index state: (built_at monotonic, expires_at datetime or None, slots by position, all active slots)
+_slot_index = {'state': None}
+_slot_index_lock = threading.Lock()
+
+
 class Ads(db.Model):
     __tablename__ = 'ads'
     
@@ -11,6 +100,12 @@ class Ads(db.Model):
     # Image paths for different device types
     desktop_image = db.Column(db.String(255), nullable=True)  # 16:9 aspect ratio
     mobile_image = db.Column(db.String(255), nullable=True)   # 9:16 aspect ratio
+    # Uploaded files the banners are rendered from (uploads/originals/<hash>.<ext>)
+    desktop_original = db.Column(db.String(255), nullable=True)
+    mobile_original = db.Column(db.String(255), nullable=True)
+    # Processing state of the latest upload per image type: pending, ready, failed (None before any upload)
+    desktop_image_status = db.Column(db.String(20), nullable=True)
+    mobile_image_status = db.Column(db.String(20), nullable=True)
     
     # Link and target
     link_url = db.Column(db.String(500), nullable=True)
@@ -37,6 +132,10 @@ class Ads(db.Model):
     def __repr__(self):
         return f'<Ads {self.title}>'
     
+    @validates('position')
+    def _normalize_position(self, key, position):
+        return normalize_position(position)
+    
     def is_currently_active(self):
         """Check if ad is currently active based on date range"""
         now = datetime.utcnow()
@@ -53,14 +152,14 @@ class Ads(db.Model):
         return True
     
     def increment_view_count(self):
-        """Increment view count"""
-        self.view_count += 1
-        db.session.commit()
+        """Increment view count (buffered, flushed to the database in batches)"""
+        from utils.ad_tracking import record_ad_view
+        record_ad_view(self.id)
     
     def increment_click_count(self):
-        """Increment click count"""
-        self.click_count += 1
-        db.session.commit()
+        """Increment click count (buffered, flushed to the database in batches)"""
+        from utils.ad_tracking import record_ad_click
+        record_ad_click(self.id)
     
     @staticmethod
     def _apply_active_filters(query):
@@ -79,6 +178,49 @@ class Ads(db.Model):
 
         return query
 
+    @staticmethod
+    def _build_slot_index(now):
+        """Load all active ads once and group the in-window ones by position"""
+        ads = Ads._apply_active_filters(Ads.query).order_by(Ads.sort_order, Ads.created_at.desc()).all()
+        active = tuple(AdSlot.from_ad(ad) for ad in ads)
+        
+        slots = {}
+        expires_at = None
+        for slot in active:
+            if slot.in_window(now):
+                slots.setdefault(slot.position, []).append(slot)
+            # The index is only valid until the next schedule boundary
+            for boundary in (slot.start_date, slot.end_date):
+                if boundary and boundary >= now and (expires_at is None or boundary < expires_at):
+                    expires_at = boundary
+        
+        slots = {position: tuple(items) for position, items in slots.items()}
+        return time.monotonic(), expires_at, slots, active
+    
+    @staticmethod
+    def _get_slot_index():
+        now = datetime.utcnow()
+        ttl = current_app.config.get('AD_SLOT_INDEX_TTL', 300) if has_app_context() else 300
+        state = _slot_index['state']
+        if state is not None and time.monotonic() - state[0] < ttl and (state[1] is None or now <= state[1]):
+            return state
+        
+        with _slot_index_lock:
+            if _slot_index['state'] is state:
+                _slot_index['state'] = Ads._build_slot_index(now)
+            return _slot_index['state']
+    
+    @staticmethod
+    def invalidate_slot_index():
+        """Drop the slot index so the next lookup rebuilds it"""
+        _slot_index['state'] = None
+    
+    @staticmethod
+    def get_active_ad_ids():
+        """Ids of every ad the slot index can serve; tracking ignores any other id"""
+        _, _, _, active = Ads._get_slot_index()
+        return frozenset(slot.id for slot in active)
+    
     @staticmethod
     def get_active_ads_by_position(position):
         """Get active ads by exact position"""
@@ -87,60 +229,56 @@ class Ads(db.Model):
     @staticmethod
     def get_active_ads_by_positions(positions=None):
         """Get active ads filtered by a collection of positions"""
-        now = datetime.utcnow()
-        query = Ads.query
-
+        _, _, slots, active = Ads._get_slot_index()
+        
         if positions:
-            query = query.filter(Ads.position.in_(positions))
-
-        query = Ads._apply_active_filters(query)
-
-        query = query.filter(
-            db.or_(Ads.start_date.is_(None), Ads.start_date <= now),
-            db.or_(Ads.end_date.is_(None), Ads.end_date >= now)
-        )
-
-        return query.order_by(Ads.sort_order, Ads.created_at.desc()).all()
+            wanted = {normalize_position(position) for position in positions}
+            if len(wanted) == 1:
+                return list(slots.get(wanted.pop(), ()))
+        else:
+            wanted = None
+        
+        # Keep the global sort order across several positions
+        now = datetime.utcnow()
+        return [
+            slot for slot in active
+            if (wanted is None or slot.position in wanted) and slot.in_window(now)
+        ]
 
     @staticmethod
     def get_homepage_banners():
-        """Get homepage banner ads across common position aliases"""
-        home_positions = ['homepage_banner', 'homepage-hero', 'home_banner', 'homepage', 'home-hero']
-        now = datetime.utcnow()
-
-        base_query = Ads.query.filter(
-            db.or_(
-                Ads.position.in_(home_positions),
-                Ads.position.ilike('home%'),
-                Ads.position.ilike('%banner%')
-            )
-        )
-
-        active_query = Ads._apply_active_filters(base_query)
-
-        image_query = active_query.filter(
-            db.or_(Ads.desktop_image.isnot(None), Ads.mobile_image.isnot(None))
-        )
-
-        time_filtered_query = image_query.filter(
-            db.or_(Ads.start_date.is_(None), Ads.start_date <= now),
-            db.or_(Ads.end_date.is_(None), Ads.end_date >= now)
-        )
-
-        banners = time_filtered_query.order_by(Ads.sort_order, Ads.created_at.desc()).all()
+        """Get homepage banner ads"""
+        _, _, slots, active = Ads._get_slot_index()
+        
+        banners = [slot for slot in slots.get(HOMEPAGE_BANNER, ()) if slot.has_image]
         if banners:
             return banners
-
+        
         # If all ads are outside the scheduled window, fall back to active ones
-        return image_query.order_by(Ads.sort_order, Ads.created_at.desc()).all()
+        return [slot for slot in active if slot.position == HOMEPAGE_BANNER and slot.has_image]
 
     @staticmethod
     def get_sidebar_ads():
         """Get sidebar ads"""
         return Ads.get_active_ads_by_position('sidebar')
-
+    
     @staticmethod
     def get_footer_ads():
         """Get footer ads"""
         return Ads.get_active_ads_by_position('footer')
 
+
+class AdCounterBatch(db.Model):
+    """A spooled batch of ad view/click events already added to the ads counters.
+
+    Written in the same transaction as the counter UPDATE, so a batch file
+    left behind by a crash after that commit is recognized and not counted
+    twice.
+    """
+    __tablename__ = 'ad_counter_batches'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<AdCounterBatch {self.id}>'
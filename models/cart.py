@@ -1,5 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
+from sqlalchemy.orm import joinedload
 from database import db
 
 class Cart(db.Model):
@@ -22,6 +23,13 @@ class Cart(db.Model):
         """Get total number of items in cart"""
         return sum(item.quantity for item in self.items)
     
+    @property
+    def total_weight(self):
+        """Calculate total cart weight (products without a weight count as 0)"""
+        return sum(
+            (item.product.weight or Decimal('0')) * item.quantity for item in self.items
+        ) or Decimal('0')
+    
     @property
     def subtotal(self):
         """Calculate cart subtotal"""
@@ -71,6 +79,21 @@ class Cart(db.Model):
             return True
         return False
     
+    def set_quantities(self, quantities):
+        """Set several line quantities ({product_id: quantity}) in one commit; 0 removes the line"""
+        lines = {item.product_id: item for item in self.items}
+        for product_id, quantity in quantities.items():
+            item = lines.get(product_id)
+            if quantity <= 0:
+                if item is not None:
+                    self.items.remove(item)
+            elif item is not None:
+                item.quantity = quantity
+            else:
+                self.items.append(CartItem(product_id=product_id, quantity=quantity))
+        self.updated_at = datetime.utcnow()
+        db.session.commit()
+    
     def clear(self):
         """Clear all items from cart"""
         for item in self.items:
@@ -93,6 +116,16 @@ class Cart(db.Model):
             db.session.commit()
         
         return cart
+    
+    @staticmethod
+    def load_for_user(user_id):
+        """The user's cart with its items and their products in one joined query (created if missing)"""
+        query = Cart.query.options(joinedload(Cart.items).joinedload(CartItem.product)).filter_by(user_id=user_id)
+        cart = query.first()
+        if cart is None:
+            Cart.get_or_create_cart(user_id=user_id)
+            cart = query.first()
+        return cart
 
 class CartItem(db.Model):
     __tablename__ = 'cart_items'
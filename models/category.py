@@ -51,6 +51,25 @@ class Category(db.Model):
             descendants.extend(child.get_descendants())
         return descendants
     
+    @staticmethod
+    def get_product_category_paths(product_ids):
+        """Map product ids to the ids of their category and all its ancestors"""
+        from models.product import Product
+        
+        rows = db.session.query(Product.id, Product.category_id).filter(Product.id.in_(product_ids)).all()
+        if not rows:
+            return {}
+        parents = dict(db.session.query(Category.id, Category.parent_id).all())
+        
+        paths = {}
+        for product_id, category_id in rows:
+            lineage = []
+            while category_id is not None and category_id not in lineage:
+                lineage.append(category_id)
+                category_id = parents.get(category_id)
+            paths[product_id] = frozenset(lineage)
+        return paths
+    
     @staticmethod
     def get_root_categories():
         """Get all root categories (is_parent = True)"""
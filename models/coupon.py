@@ -1,7 +1,95 @@
+import json
+from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
+from typing import FrozenSet, Optional
+
 from database import db
 
+
+def _parse_id_set(raw):
+    """Parse a JSON array column into a frozenset of ids (None means unrestricted)"""
+    if not raw:
+        return None
+    try:
+        values = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            continue
+    return frozenset(ids)
+
+
+@dataclass(frozen=True)
+class CouponRules:
+    """User/product/category restrictions of a coupon, compiled once from its JSON columns"""
+    applicable_users: Optional[FrozenSet[int]] = None
+    applicable_products: Optional[FrozenSet[int]] = None
+    excluded_products: Optional[FrozenSet[int]] = None
+    applicable_categories: Optional[FrozenSet[int]] = None
+    excluded_categories: Optional[FrozenSet[int]] = None
+
+    @classmethod
+    def compile(cls, coupon):
+        return cls(
+            applicable_users=_parse_id_set(coupon.applicable_users),
+            applicable_products=_parse_id_set(coupon.applicable_products),
+            excluded_products=_parse_id_set(coupon.excluded_products),
+            applicable_categories=_parse_id_set(coupon.applicable_categories),
+            excluded_categories=_parse_id_set(coupon.excluded_categories),
+        )
+
+    @property
+    def uses_categories(self):
+        return self.applicable_categories is not None or self.excluded_categories is not None
+
+    @property
+    def restricts_products(self):
+        return self.applicable_products is not None or self.applicable_categories is not None
+
+    def allows_user(self, user_id):
+        return self.applicable_users is None or user_id in self.applicable_users
+
+    def check_products(self, product_ids, category_paths=None):
+        """Check cart products; category_paths maps product id -> its category and ancestor ids"""
+        category_paths = category_paths or {}
+
+        if self.excluded_products and not self.excluded_products.isdisjoint(product_ids):
+            return False, "Coupon cannot be applied to some products in cart"
+
+        if self.excluded_categories:
+            for product_id in product_ids:
+                if not self.excluded_categories.isdisjoint(category_paths.get(product_id, ())):
+                    return False, "Coupon cannot be applied to some products in cart"
+
+        if self.restricts_products:
+            applicable = False
+            for product_id in product_ids:
+                if self.applicable_products and product_id in self.applicable_products:
+                    applicable = True
+                    break
+                if self.applicable_categories and not self.applicable_categories.isdisjoint(
+                    category_paths.get(product_id, ())
+                ):
+                    applicable = True
+                    break
+            if not applicable:
+                return False, "Coupon is not applicable to products in cart"
+
+        return True, None
+
+
+# coupon id -> (updated_at, CouponRules)
+_compiled_rules = {}
+
+
 class Coupon(db.Model):
     __tablename__ = 'coupons'
     
@@ -60,7 +148,7 @@ class Coupon(db.Model):
         if self.end_date and now > self.end_date:
             return False, "Coupon has expired"
         
-        # Check usage limit
+        # Check usage limit (advisory; redeem() enforces it atomically)
         if self.usage_limit and self.used_count >= self.usage_limit:
             return False, "Coupon usage limit exceeded"
         
@@ -68,46 +156,48 @@ class Coupon(db.Model):
         if order_amount < self.minimum_amount:
             return False, f"Minimum order amount of ${self.minimum_amount} required"
         
+        rules = self.get_rules()
+        
         # Check user restrictions
         if user_id:
             if self.new_customers_only:
-                from models.order import Order
-                if Order.query.filter_by(user_id=user_id).first():
+                from models.user import User
+                if User.has_placed_order(user_id):
                     return False, "Coupon is only valid for new customers"
             
-            if self.applicable_users:
-                import json
-                try:
-                    applicable_users = json.loads(self.applicable_users)
-                    if user_id not in applicable_users:
-                        return False, "Coupon is not applicable to this user"
-                except:
-                    pass
-        
-        # Check product restrictions
-        if product_ids:
-            import json
+            if not rules.allows_user(user_id):
+                return False, "Coupon is not applicable to this user"
             
-            # Check excluded products
-            if self.excluded_products:
-                try:
-                    excluded_products = json.loads(self.excluded_products)
-                    if any(pid in excluded_products for pid in product_ids):
-                        return False, "Coupon cannot be applied to some products in cart"
-                except:
-                    pass
+            if self.usage_limit_per_user and self.get_user_redemption_count(user_id) >= self.usage_limit_per_user:
+                return False, "Coupon usage limit reached for this user"
+        
+        # Check product and category restrictions
+        if product_ids:
+            product_ids = {int(pid) for pid in product_ids}
+            category_paths = None
+            if rules.uses_categories:
+                from models.category import Category
+                category_paths = Category.get_product_category_paths(product_ids)
             
-            # Check applicable products
-            if self.applicable_products:
-                try:
-                    applicable_products = json.loads(self.applicable_products)
-                    if not any(pid in applicable_products for pid in product_ids):
-                        return False, "Coupon is not applicable to products in cart"
-                except:
-                    pass
+            is_valid, message = rules.check_products(product_ids, category_paths)
+            if not is_valid:
+                return False, message
         
         return True, "Valid"
     
+    def get_rules(self):
+        """Return compiled restriction rules, recompiled whenever the coupon is updated"""
+        if self.id is None:
+            return CouponRules.compile(self)
+        
+        cached = _compiled_rules.get(self.id)
+        if cached and cached[0] == self.updated_at:
+            return cached[1]
+        
+        rules = CouponRules.compile(self)
+        _compiled_rules[self.id] = (self.updated_at, rules)
+        return rules
+    
     def calculate_discount(self, order_amount):
         """Calculate discount amount for given order amount"""
         if self.discount_type == 'percentage':
@@ -119,10 +209,54 @@ class Coupon(db.Model):
         
         return min(discount, order_amount)  # Don't discount more than order amount
     
-    def use_coupon(self):
+    def get_user_redemption_count(self, user_id):
+        """Count how many times a user has redeemed this coupon"""
+        return db.session.query(db.func.count(CouponRedemption.id)).filter(
+            CouponRedemption.coupon_id == self.id,
+            CouponRedemption.user_id == user_id,
+        ).scalar() or 0
+    
+    def redeem(self, user_id=None, order_id=None, discount_amount=0):
+        """Claim one use of the coupon inside the caller's transaction.
+        
+        The usage counter is incremented with a conditional UPDATE, so the
+        total limit holds under concurrency; the caller commits on success
+        and must roll back on failure.
+        """
+        result = db.session.execute(
+            db.update(Coupon)
+            .where(
+                Coupon.id == self.id,
+                db.or_(Coupon.usage_limit.is_(None), Coupon.used_count < Coupon.usage_limit),
+            )
+            .values(used_count=Coupon.used_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.expire(self, ['used_count'])
+        if result.rowcount != 1:
+            return False, "Coupon usage limit exceeded"
+        
+        # The UPDATE holds the coupon row lock, serialising redemptions of this coupon
+        if user_id and self.usage_limit_per_user:
+            if self.get_user_redemption_count(user_id) >= self.usage_limit_per_user:
+                return False, "Coupon usage limit reached for this user"
+        
+        db.session.add(CouponRedemption(
+            coupon_id=self.id,
+            user_id=user_id,
+            order_id=order_id,
+            discount_amount=discount_amount,
+        ))
+        return True, "Redeemed"
+    
+    def use_coupon(self, user_id=None, order_id=None):
         """Mark coupon as used (increment usage count)"""
-        self.used_count += 1
-        db.session.commit()
+        redeemed, _ = self.redeem(user_id=user_id, order_id=order_id)
+        if redeemed:
+            db.session.commit()
+        else:
+            db.session.rollback()
+        return redeemed
     
     @staticmethod
     def validate_coupon_code(code, user_id=None, order_amount=0, product_ids=None):
@@ -136,3 +270,21 @@ class Coupon(db.Model):
             return None, message
         
         return coupon, "Valid"
+
+
+class CouponRedemption(db.Model):
+    __tablename__ = 'coupon_redemptions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    coupon_id = db.Column(db.Integer, db.ForeignKey('coupons.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True)
+    discount_amount = db.Column(db.Numeric(10, 2), default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_coupon_redemptions_coupon_user', 'coupon_id', 'user_id'),
+    )
+    
+    def __repr__(self):
+        return f'<CouponRedemption coupon={self.coupon_id} user={self.user_id}>'
@@ -1,5 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
+from flask import g, has_app_context
 from database import db
 
 class Order(db.Model):
@@ -7,7 +8,7 @@ class Order(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     
     # Order status
     status = db.Column(db.String(20), default='pending')  # pending, processing, shipped, delivered, cancelled, refunded
@@ -122,6 +123,26 @@ class Order(db.Model):
             if not Order.query.filter_by(order_number=order_number).first():
                 return order_number
 
+@db.event.listens_for(Order, 'after_insert')
+def _record_user_order(mapper, connection, order):
+    """Keep users.order_count/first_order_at in step with inserted orders"""
+    from models.user import User
+    
+    placed_at = order.created_at or datetime.utcnow()
+    connection.execute(
+        User.__table__.update()
+        .where(User.__table__.c.id == order.user_id)
+        .values(
+            order_count=User.__table__.c.order_count + 1,
+            first_order_at=db.func.coalesce(User.__table__.c.first_order_at, placed_at),
+        )
+    )
+    
+    if has_app_context():
+        # Forget, don't assume: the order may still be rolled back. The next
+        # has_placed_order() call reads whatever was committed
+        g.get('_user_has_ordered', {}).pop(order.user_id, None)
+
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 from decimal import Decimal
 from database import db
@@ -76,14 +77,58 @@ class Product(db.Model):
     
     def get_primary_image(self):
         """Get the primary product image"""
-        primary_image = ProductImage.query.filter_by(product_id=self.id, is_primary=True).first()
+        if '_primary_image' in self.__dict__:
+            # Filled in by prefetch_primary_images
+            return self.__dict__['_primary_image']
+        ready = ProductImage.query.filter_by(product_id=self.id, processing_status='ready')
+        primary_image = ready.filter_by(is_primary=True).first()
         if not primary_image:
-            primary_image = ProductImage.query.filter_by(product_id=self.id).first()
+            primary_image = ready.order_by(ProductImage.sort_order).first()
         return primary_image
     
     def get_all_images(self):
-        """Get all product images ordered by sort_order"""
-        return ProductImage.query.filter_by(product_id=self.id).order_by(ProductImage.sort_order).all()
+        """Get all processed product images ordered by sort_order"""
+        if '_all_images' in self.__dict__:
+            # Filled in by prefetch_images
+            return self.__dict__['_all_images']
+        return ProductImage.query.filter_by(
+            product_id=self.id, processing_status='ready'
+        ).order_by(ProductImage.sort_order).all()
+    
+    @staticmethod
+    def prefetch_primary_images(products):
+        """Load the primary images of many products in one query and memoize them on each product"""
+        products = [product for product in products if product is not None]
+        if not products:
+            return
+        images = (ProductImage.query
+                  .filter(ProductImage.product_id.in_({product.id for product in products}),
+                          ProductImage.processing_status == 'ready')
+                  .order_by(ProductImage.product_id, ProductImage.is_primary.desc(),
+                            ProductImage.sort_order, ProductImage.id)
+                  .all())
+        primary = {}
+        for image in images:
+            primary.setdefault(image.product_id, image)
+        for product in products:
+            product._primary_image = primary.get(product.id)
+    
+    @staticmethod
+    def prefetch_images(products):
+        """Load the processed images of many products in one query and memoize them on each product"""
+        products = [product for product in products if product is not None]
+        if not products:
+            return
+        images = (ProductImage.query
+                  .filter(ProductImage.product_id.in_({product.id for product in products}),
+                          ProductImage.processing_status == 'ready')
+                  .order_by(ProductImage.product_id, ProductImage.sort_order, ProductImage.id)
+                  .all())
+        by_product = {}
+        for image in images:
+            by_product.setdefault(image.product_id, []).append(image)
+        for product in products:
+            product._all_images = by_product.get(product.id, [])
     
     @staticmethod
     def get_featured_products(limit=8):
@@ -123,7 +168,48 @@ class ProductImage(db.Model):
     alt_text = db.Column(db.String(200), nullable=True)
     is_primary = db.Column(db.Boolean, default=False)
     sort_order = db.Column(db.Integer, default=0)
+    # Rows that predate background processing are served as-is: 'ready', with no renditions
+    processing_status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')  # pending, ready, failed
+    renditions = db.Column(db.Text, nullable=True)  # JSON: {"width", "height", "webp": [[width, path], ...], "avif": [...]}
+    original_path = db.Column(db.String(255), nullable=True)  # uploads/originals/<hash>.<ext>; None for images uploaded before originals were kept
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
         return f'<ProductImage {self.image_path}>'
+    
+    @property
+    def is_ready(self):
+        """Check if the WebP image and thumbnail have been generated"""
+        return self.processing_status == 'ready'
+    
+    def get_renditions(self):
+        """Get parsed rendition metadata ({} for images uploaded before the rendition ladder)"""
+        cached = getattr(self, '_parsed_renditions', None)
+        if cached is not None and cached[0] == self.renditions:
+            return cached[1]
+        
+        try:
+            parsed = json.loads(self.renditions) if self.renditions else {}
+        except (TypeError, ValueError):
+            parsed = {}
+        self._parsed_renditions = (self.renditions, parsed)
+        return parsed
+    
+    def get_rendition_path(self, width=None, fmt='webp'):
+        """Get the smallest rendition at least width pixels wide (the largest if width is None)"""
+        steps = self.get_renditions().get(fmt)
+        if not steps:
+            return self.image_path
+        if width:
+            for step_width, path in steps:
+                if step_width >= width:
+                    return path
+        return steps[-1][1]
+    
+    def get_file_paths(self):
+        """Get every stored file of this image, relative to the static folder"""
+        paths = {self.image_path}
+        for steps in self.get_renditions().values():
+            if isinstance(steps, list):
+                paths.update(path for _, path in steps)
+        return sorted(paths)
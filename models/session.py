@@ -0,0 +1,14 @@
+from datetime import datetime
+from database import db
+
+class ServerSession(db.Model):
+    """Server-side session data; the cookie carries only the signed id"""
+    __tablename__ = 'server_sessions'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # Flask's tagged JSON
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ServerSession {self.id[:8]}>'
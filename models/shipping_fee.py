@@ -1,7 +1,131 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
+from typing import FrozenSet, Optional
+
+from flask import current_app, has_app_context
+
 from database import db
 
+
+def _parse_code_set(raw):
+    """Parse a JSON array column into a frozenset of codes (None means unrestricted)"""
+    if not raw:
+        return None
+    try:
+        values = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    return frozenset(str(value) for value in values)
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal('0')
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+@dataclass(frozen=True)
+class ShippingRule:
+    """Detached, precompiled form of an active shipping method"""
+    id: int
+    name: str
+    description: Optional[str]
+    method_type: str
+    cost: Decimal
+    free_shipping_threshold: Optional[Decimal]
+    min_weight: Optional[Decimal]
+    max_weight: Optional[Decimal]
+    weight_cost: Optional[Decimal]
+    min_order_amount: Optional[Decimal]
+    max_order_amount: Optional[Decimal]
+    applicable_countries: Optional[FrozenSet[str]]
+    applicable_states: Optional[FrozenSet[str]]
+    excluded_countries: Optional[FrozenSet[str]]
+    excluded_states: Optional[FrozenSet[str]]
+    estimated_delivery: str
+    sort_order: int
+    is_active: bool
+
+    @classmethod
+    def compile(cls, fee):
+        return cls(
+            id=fee.id,
+            name=fee.name,
+            description=fee.description,
+            method_type=fee.method_type,
+            cost=_to_decimal(fee.cost),
+            free_shipping_threshold=fee.free_shipping_threshold,
+            min_weight=fee.min_weight,
+            max_weight=fee.max_weight,
+            weight_cost=fee.weight_cost,
+            min_order_amount=fee.min_order_amount,
+            max_order_amount=fee.max_order_amount,
+            applicable_countries=_parse_code_set(fee.applicable_countries),
+            applicable_states=_parse_code_set(fee.applicable_states),
+            excluded_countries=_parse_code_set(fee.excluded_countries),
+            excluded_states=_parse_code_set(fee.excluded_states),
+            estimated_delivery=fee.get_estimated_delivery(),
+            sort_order=fee.sort_order or 0,
+            is_active=bool(fee.is_active),
+        )
+
+    def quote(self, order_amount=0, total_weight=0, country=None, state=None):
+        """Return the shipping cost for the given order, or None if the method does not apply"""
+        if not self.is_active:
+            return None
+
+        # Geographic restrictions
+        if country:
+            if self.excluded_countries is not None and country in self.excluded_countries:
+                return None
+            if self.applicable_countries is not None and country not in self.applicable_countries:
+                return None
+            if state and self.applicable_states is not None and state not in self.applicable_states:
+                return None
+            if state and self.excluded_states is not None and state in self.excluded_states:
+                return None
+
+        order_amount = _to_decimal(order_amount)
+        total_weight = _to_decimal(total_weight)
+
+        if self.method_type == 'free_shipping':
+            if self.free_shipping_threshold and order_amount >= self.free_shipping_threshold:
+                return Decimal('0')
+            return self.cost
+
+        if self.method_type == 'weight_based':
+            if self.min_weight and total_weight < self.min_weight:
+                return None
+            if self.max_weight and total_weight > self.max_weight:
+                return None
+            if self.weight_cost:
+                return total_weight * self.weight_cost
+            return self.cost
+
+        if self.method_type == 'price_based':
+            if self.min_order_amount and order_amount < self.min_order_amount:
+                return None
+            if self.max_order_amount and order_amount > self.max_order_amount:
+                return None
+            return self.cost
+
+        return self.cost
+
+
+# In-process table of compiled active methods, rebuilt after admin writes or TTL expiry.
+# Holds a (loaded_at, rules, rules_by_id) tuple so readers always see a consistent snapshot.
+_rule_table = {'state': None}
+_rule_table_lock = threading.Lock()
+
+
 class ShippingFee(db.Model):
     __tablename__ = 'shipping_fees'
     
@@ -48,76 +172,7 @@ class ShippingFee(db.Model):
     
     def calculate_shipping_cost(self, order_amount=0, total_weight=0, country=None, state=None):
         """Calculate shipping cost based on order details"""
-        
-        # Check if shipping method is active
-        if not self.is_active:
-            return None
-        
-        # Check geographic restrictions
-        if country:
-            import json
-            
-            # Check excluded countries
-            if self.excluded_countries:
-                try:
-                    excluded_countries = json.loads(self.excluded_countries)
-                    if country in excluded_countries:
-                        return None
-                except:
-                    pass
-            
-            # Check applicable countries
-            if self.applicable_countries:
-                try:
-                    applicable_countries = json.loads(self.applicable_countries)
-                    if country not in applicable_countries:
-                        return None
-                except:
-                    pass
-            
-            # Check state restrictions
-            if state and self.applicable_states:
-                try:
-                    applicable_states = json.loads(self.applicable_states)
-                    if state not in applicable_states:
-                        return None
-                except:
-                    pass
-            
-            if state and self.excluded_states:
-                try:
-                    excluded_states = json.loads(self.excluded_states)
-                    if state in excluded_states:
-                        return None
-                except:
-                    pass
-        
-        # Calculate cost based on method type
-        if self.method_type == 'flat_rate':
-            return self.cost
-        
-        elif self.method_type == 'free_shipping':
-            if self.free_shipping_threshold and order_amount >= self.free_shipping_threshold:
-                return 0
-            return self.cost
-        
-        elif self.method_type == 'weight_based':
-            if self.min_weight and total_weight < self.min_weight:
-                return None
-            if self.max_weight and total_weight > self.max_weight:
-                return None
-            if self.weight_cost:
-                return total_weight * self.weight_cost
-            return self.cost
-        
-        elif self.method_type == 'price_based':
-            if self.min_order_amount and order_amount < self.min_order_amount:
-                return None
-            if self.max_order_amount and order_amount > self.max_order_amount:
-                return None
-            return self.cost
-        
-        return self.cost
+        return ShippingRule.compile(self).quote(order_amount, total_weight, country, state)
     
     def get_estimated_delivery(self):
         """Get estimated delivery time as string"""
@@ -130,19 +185,47 @@ class ShippingFee(db.Model):
             return f"{self.estimated_days_min}+ days"
         return "Standard delivery"
     
+    @staticmethod
+    def _get_rule_state():
+        ttl = current_app.config.get('SHIPPING_RULES_TTL', 300) if has_app_context() else 300
+        state = _rule_table['state']
+        if state is not None and time.monotonic() - state[0] < ttl:
+            return state
+        
+        with _rule_table_lock:
+            if _rule_table['state'] is state:
+                methods = ShippingFee.query.filter_by(is_active=True).order_by(ShippingFee.sort_order).all()
+                rules = tuple(ShippingRule.compile(method) for method in methods)
+                _rule_table['state'] = (time.monotonic(), rules, {rule.id: rule for rule in rules})
+            return _rule_table['state']
+    
+    @staticmethod
+    def get_rule_table():
+        """Return compiled rules for all active methods, ordered by sort_order"""
+        return ShippingFee._get_rule_state()[1]
+    
+    @staticmethod
+    def get_shipping_rule(method_id):
+        """Get the compiled rule of an active shipping method"""
+        return ShippingFee._get_rule_state()[2].get(method_id)
+    
+    @staticmethod
+    def invalidate_rules():
+        """Drop the compiled rule table so the next lookup reloads it"""
+        _rule_table['state'] = None
+    
     @staticmethod
     def get_available_shipping_methods(order_amount=0, total_weight=0, country=None, state=None):
         """Get all available shipping methods for given order details"""
-        methods = ShippingFee.query.filter_by(is_active=True).order_by(ShippingFee.sort_order).all()
         available_methods = []
         
-        for method in methods:
-            cost = method.calculate_shipping_cost(order_amount, total_weight, country, state)
+        for rule in ShippingFee.get_rule_table():
+            cost = rule.quote(order_amount, total_weight, country, state)
             if cost is not None:
                 available_methods.append({
-                    'method': method,
+                    'method': rule,
                     'cost': cost,
-                    'estimated_delivery': method.get_estimated_delivery()
+                    'estimated_delivery': rule.estimated_delivery
                 })
         
         return available_methods
@@ -150,12 +233,8 @@ class ShippingFee(db.Model):
     @staticmethod
     def get_free_shipping_threshold():
         """Get the minimum order amount for free shipping"""
-        free_shipping = ShippingFee.query.filter_by(
-            method_type='free_shipping',
-            is_active=True
-        ).first()
-        
-        if free_shipping and free_shipping.free_shipping_threshold:
-            return free_shipping.free_shipping_threshold
+        for rule in ShippingFee.get_rule_table():
+            if rule.method_type == 'free_shipping' and rule.free_shipping_threshold:
+                return rule.free_shipping_threshold
         
         return None
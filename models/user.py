@@ -1,8 +1,69 @@
-﻿from flask_login import UserMixin
+﻿from flask import current_app, g, has_app_context
+from flask_login import UserMixin
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
-from werkzeug.security import check_password_hash
+from typing import Optional
+import threading
+import time
 from database import db
 
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, read-only identity of a logged-in user as served from the user cache.
+
+    Stands in for User as Flask-Login's current_user. Views that change
+    the user load the ORM row with load() and call
+    User.invalidate_snapshot() after committing.
+    """
+    id: int
+    username: str
+    email: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    is_admin: bool
+    is_active: bool
+    updated_at: Optional[datetime]
+    token_version: int
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            is_admin=bool(user.is_admin),
+            is_active=bool(user.is_active),
+            updated_at=user.updated_at,
+            token_version=user.token_version or 0,
+        )
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def get_full_name(self):
+        return f"{self.first_name} {self.last_name}" if self.first_name and self.last_name else self.username
+
+    def load(self):
+        """Load the attached User row, for views that modify it"""
+        return db.session.get(User, self.id)
+
+
+# user id -> (expires_at monotonic, UserSnapshot), least recently used first
+_user_snapshots = OrderedDict()
+_user_snapshots_lock = threading.Lock()
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -16,6 +77,18 @@ class User(UserMixin, db.Model):
     address = db.Column(db.Text, nullable=True)
     is_admin = db.Column(db.Boolean, default=False)
     is_active = db.Column(db.Boolean, default=True)
+    
+    # Order stats, maintained when orders are inserted (see models.order).
+    # Existing rows start at 0: run `flask backfill-order-stats` after adding the columns
+    order_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    first_order_at = db.Column(db.DateTime, nullable=True)
+    
+    # Bumped with every wishlist change; process-local wishlist caches compare against it
+    wishlist_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Signed into API tokens; bumping it revokes every token issued before
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -30,6 +103,81 @@ class User(UserMixin, db.Model):
     def get_full_name(self):
         return f"{self.first_name} {self.last_name}" if self.first_name and self.last_name else self.username
     
+    def set_password(self, password):
+        """Hash password under the configured policy; API tokens issued under the old one stop working"""
+        from utils.passwords import hash_password
+        self.password_hash = hash_password(password)
+        if self.id is not None:
+            self.revoke_api_tokens()
+    
+    def revoke_api_tokens(self):
+        """Invalidate every API token issued so far; the caller commits and calls invalidate_snapshot()"""
+        self.token_version = (self.token_version or 0) + 1
+    
     def check_password(self, password):
-        """Check if provided password matches the hash"""
-        return check_password_hash(self.password_hash, password)
+        """Check if provided password matches the hash.
+        
+        On a match, a hash made under another algorithm or cost is replaced
+        by one under the configured policy; the caller commits it.
+        """
+        from utils.passwords import get_password_hasher
+        hasher = get_password_hasher()
+        if not hasher.verify(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            self.password_hash = hasher.hash(password)
+        return True
+    
+    @staticmethod
+    def get_snapshot(user_id):
+        """Return the cached UserSnapshot for user_id, loading it at most once per USER_CACHE_TTL"""
+        ttl = current_app.config.get('USER_CACHE_TTL', 60) if has_app_context() else 60
+        now = time.monotonic()
+        with _user_snapshots_lock:
+            entry = _user_snapshots.get(user_id)
+            if entry is not None and entry[0] > now:
+                _user_snapshots.move_to_end(user_id)
+                return entry[1]
+        
+        user = db.session.get(User, user_id)
+        if user is None:
+            User.invalidate_snapshot(user_id)
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        
+        size = current_app.config.get('USER_CACHE_SIZE', 10000) if has_app_context() else 10000
+        with _user_snapshots_lock:
+            _user_snapshots[user_id] = (now + ttl, snapshot)
+            _user_snapshots.move_to_end(user_id)
+            while len(_user_snapshots) > size:
+                _user_snapshots.popitem(last=False)
+        return snapshot
+    
+    @staticmethod
+    def invalidate_snapshot(user_id=None):
+        """Drop a user's cached snapshot (or all of them) so the next request reloads it"""
+        with _user_snapshots_lock:
+            if user_id is None:
+                _user_snapshots.clear()
+            else:
+                _user_snapshots.pop(user_id, None)
+    
+    @staticmethod
+    def has_placed_order(user_id):
+        """Check whether the user has any order, memoized for the current request.
+        
+        A zero order_count is confirmed against the orders table, so
+        customers whose stats haven't been backfilled yet (see
+        `flask backfill-order-stats`) are never taken for new ones.
+        """
+        from models.order import Order
+        
+        memo = g.setdefault('_user_has_ordered', {}) if has_app_context() else {}
+        if user_id not in memo:
+            order_count = db.session.query(User.order_count).filter(User.id == user_id).scalar()
+            if not order_count:
+                order_count = db.session.query(
+                    db.select(Order.id).where(Order.user_id == user_id).exists()
+                ).scalar()
+            memo[user_id] = bool(order_count)
+        return memo[user_id]
@@ -1,7 +1,33 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
+from typing import FrozenSet
+
+from flask import current_app, g, has_app_context, has_request_context
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
 from database import db
 
 
+@dataclass(frozen=True)
+class WishlistState:
+    """Cached product ids on one user's wishlist as of users.wishlist_version == version"""
+    version: int
+    product_ids: FrozenSet[int]
+
+    @property
+    def count(self):
+        return len(self.product_ids)
+
+
+# user id -> (expires_at monotonic, WishlistState), least recently used first
+_wishlist_states = OrderedDict()
+_wishlist_states_lock = threading.Lock()
+
+
 class WishList(db.Model):
     __tablename__ = 'wish_lists'
 
@@ -21,6 +47,174 @@ class WishList(db.Model):
     def __repr__(self):
         return f'<WishList user={self.user_id} product={self.product_id}>'
 
+    @staticmethod
+    def _stored_version(user_id):
+        """users.wishlist_version, read at most once per request"""
+        from models.user import User
+
+        memo = g.setdefault('wishlist_versions', {}) if has_request_context() else {}
+        if user_id not in memo:
+            memo[user_id] = db.session.execute(
+                db.select(User.wishlist_version).where(User.id == user_id)
+            ).scalar() or 0
+        return memo[user_id]
+
+    @staticmethod
+    def _remember_version(user_id, version):
+        if has_request_context():
+            g.setdefault('wishlist_versions', {})[user_id] = version
+
+    @staticmethod
+    def get_state(user_id):
+        """Return the WishlistState for user_id, from the cache while users.wishlist_version matches.
+
+        Every toggle bumps the version in its own transaction, so a change
+        made through any process is seen on the next request here; the
+        check is a primary-key read of one column instead of the id set.
+        """
+        version = WishList._stored_version(user_id)
+        now = time.monotonic()
+        with _wishlist_states_lock:
+            entry = _wishlist_states.get(user_id)
+            if entry is not None and entry[0] > now and entry[1].version == version:
+                _wishlist_states.move_to_end(user_id)
+                return entry[1]
+
+        # Read after the version: a newer id set only makes the next check miss
+        product_ids = frozenset(
+            db.session.execute(db.select(WishList.product_id).where(WishList.user_id == user_id)).scalars()
+        )
+        ttl = current_app.config.get('WISHLIST_CACHE_TTL', 3600) if has_app_context() else 3600
+        size = current_app.config.get('WISHLIST_CACHE_SIZE', 10000) if has_app_context() else 10000
+        state = WishlistState(version, product_ids)
+        with _wishlist_states_lock:
+            _wishlist_states[user_id] = (now + ttl, state)
+            _wishlist_states.move_to_end(user_id)
+            while len(_wishlist_states) > size:
+                _wishlist_states.popitem(last=False)
+        return state
+
+    @staticmethod
+    def get_product_ids(user_id):
+        return WishList.get_state(user_id).product_ids
+
+    @staticmethod
+    def record_change(user_id, product_id, added, version):
+        """Apply a committed add/remove to the cached state; returns the new state (or None if not cached).
+
+        version is the cached version plus one. If another process changed
+        the list in between, the stored version is higher and the next
+        get_state reloads.
+        """
+        with _wishlist_states_lock:
+            entry = _wishlist_states.get(user_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            product_ids = state.product_ids | {product_id} if added else state.product_ids - {product_id}
+            state = WishlistState(version, product_ids)
+            _wishlist_states[user_id] = (expires_at, state)
+        WishList._remember_version(user_id, version)
+        return state
+
+    @staticmethod
+    def _insert_ignore_statement(user_id, product_id, quantity):
+        """INSERT ... SELECT FROM products that skips duplicates via uq_wish_lists_user_product"""
+        from models.product import Product
+
+        now = datetime.utcnow()
+        select = db.select(
+            db.literal(user_id), Product.id, db.literal(quantity), db.literal(now), db.literal(now)
+        ).where(Product.id == product_id)
+        columns = ['user_id', 'product_id', 'quantity', 'created_at', 'updated_at']
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            return postgresql.insert(WishList.__table__).from_select(columns, select).on_conflict_do_nothing(
+                constraint='uq_wish_lists_user_product'
+            )
+        statement = WishList.__table__.insert().from_select(columns, select)
+        if dialect == 'mysql':
+            return statement.prefix_with('IGNORE')
+        if dialect == 'sqlite':
+            return statement.prefix_with('OR IGNORE')
+        # Other databases raise on the duplicate; _execute_step treats that as "already there"
+        return statement
+
+    @staticmethod
+    def _execute_step(statement, ignore_duplicate=False):
+        """Run one toggle statement and return its rowcount; a duplicate insert counts as 0 rows"""
+        if not ignore_duplicate or db.session.get_bind().dialect.name in ('mysql', 'sqlite', 'postgresql'):
+            return db.session.execute(statement).rowcount
+        try:
+            # A savepoint keeps the rest of the transaction usable after the violation
+            with db.session.begin_nested():
+                return db.session.execute(statement).rowcount
+        except IntegrityError:
+            return 0
+
+    @staticmethod
+    def toggle(user_id, product_id, quantity=1):
+        """Add or remove a product in one transaction; returns (action, WishlistState), action None if no such product.
+
+        The cached id set picks the statement. A toggle costs, in one
+        commit: the users.wishlist_version read (a primary-key lookup,
+        shared with the rest of the request), one DELETE or INSERT ...
+        SELECT (which also checks the product exists), and the UPDATE that
+        bumps wishlist_version. A state made stale by a concurrent change
+        affects no rows and falls through to the other statement, one more
+        round trip. On databases without an insert-or-ignore (anything but
+        SQLite, MySQL and PostgreSQL) the INSERT also runs inside a SAVEPOINT.
+        """
+        from models.user import User
+
+        state = WishList.get_state(user_id)
+        delete = WishList.__table__.delete().where(
+            WishList.user_id == user_id, WishList.product_id == product_id
+        )
+        insert = WishList._insert_ignore_statement(user_id, product_id, quantity)
+
+        if product_id in state.product_ids:
+            steps = (('removed', delete), ('added', insert))
+        else:
+            steps = (('added', insert), ('removed', delete))
+
+        action = None
+        try:
+            for candidate, statement in steps:
+                if WishList._execute_step(statement, ignore_duplicate=candidate == 'added'):
+                    action = candidate
+                    break
+            if action is not None:
+                # Tells every process's cache that this user's list changed
+                users = User.__table__
+                db.session.execute(
+                    users.update()
+                    .where(users.c.id == user_id)
+                    # updated_at is kept: it describes the profile, and is part of page ETags
+                    .values(wishlist_version=users.c.wishlist_version + 1, updated_at=users.c.updated_at)
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        if action is None:
+            WishList.invalidate_cache(user_id)
+            return None, None
+        state = WishList.record_change(user_id, product_id, added=action == 'added', version=state.version + 1)
+        return action, state or WishList.get_state(user_id)
+
+    @staticmethod
+    def invalidate_cache(user_id=None):
+        """Drop a user's cached wishlist (or all of them) so the next lookup reloads it"""
+        with _wishlist_states_lock:
+            if user_id is None:
+                _wishlist_states.clear()
+            else:
+                _wishlist_states.pop(user_id, None)
+        if has_request_context():
+            g.pop('wishlist_versions', None)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -5,7 +5,9 @@ from flask import current_app, flash, redirect, render_template, request, url_fo
 
 from app import db
 from models import Ads
-from utils.image_utils import delete_image, process_ad_image
+from models.ads import AD_POSITIONS, is_known_position
+from utils.image_jobs import PENDING, get_image_jobs
+from utils.image_utils import allowed_file, delete_image
 
 from . import admin_bp, admin_required
 
@@ -15,7 +17,16 @@ from . import admin_bp, admin_required
 def ads():
     """Ads list."""
     ads_items = Ads.query.order_by(Ads.created_at.desc()).all()
-    return render_template('admin/ads/list.html', ads=ads_items)
+    unplaced = {ad.id for ad in ads_items if not is_known_position(ad.position)}
+    return render_template('admin/ads/list.html', ads=ads_items, unplaced=unplaced)
+
+
+def _posted_position(current=None):
+    """The submitted slot; an ad may keep its current (legacy) position unchanged"""
+    position = request.form['position']
+    if position != current and not is_known_position(position):
+        raise ValueError(f'Unknown ad position: {position}')
+    return position
 
 
 @admin_bp.route('/ads/<int:id>/edit', methods=['GET', 'POST'])
@@ -25,10 +36,16 @@ def edit_ad(id):
     ad = Ads.query.get_or_404(id)
 
     if request.method == 'POST':
+        try:
+            position = _posted_position(ad.position)
+        except ValueError as err:
+            flash(str(err), 'error')
+            return render_template('admin/ads/edit.html', ad=ad, positions=AD_POSITIONS)
+
         ad.title = request.form['title']
         ad.description = request.form.get('description', '')
         ad.link_url = request.form.get('link_url', '')
-        ad.position = request.form['position']
+        ad.position = position
         ad.sort_order = int(request.form.get('sort_order', 0))
         ad.is_active = bool(request.form.get('is_active'))
 
@@ -37,6 +54,8 @@ def edit_ad(id):
         except Exception:
             pass
 
+        image_jobs = get_image_jobs()
+        jobs = []
         try:
             desktop_file = request.files.get('desktop_image')
             mobile_file = request.files.get('mobile_image')
@@ -50,19 +69,14 @@ def edit_ad(id):
                     )
                 )
                 ad.desktop_image = None
+                ad.desktop_original = None
+                ad.desktop_image_status = None
             elif desktop_file and desktop_file.filename:
-                if ad.desktop_image:
-                    delete_image(
-                        os.path.join(
-                            current_app.root_path,
-                            'static',
-                            ad.desktop_image.replace('/', os.sep),
-                        )
-                    )
-                desktop_path, error = process_ad_image(desktop_file, ad.id, 'desktop')
-                if error or not desktop_path:
-                    raise ValueError(error or 'Failed to process desktop image')
-                ad.desktop_image = desktop_path
+                # The current image stays live until the new one has been processed
+                job = image_jobs.prepare_ad_image(desktop_file, ad.id, 'desktop')
+                ad.desktop_original = job.original_path
+                ad.desktop_image_status = PENDING
+                jobs.append(job)
 
             if request.form.get('remove_mobile_image') and ad.mobile_image:
                 delete_image(
@@ -73,21 +87,18 @@ def edit_ad(id):
                     )
                 )
                 ad.mobile_image = None
+                ad.mobile_original = None
+                ad.mobile_image_status = None
             elif mobile_file and mobile_file.filename:
-                if ad.mobile_image:
-                    delete_image(
-                        os.path.join(
-                            current_app.root_path,
-                            'static',
-                            ad.mobile_image.replace('/', os.sep),
-                        )
-                    )
-                mobile_path, error = process_ad_image(mobile_file, ad.id, 'mobile')
-                if error or not mobile_path:
-                    raise ValueError(error or 'Failed to process mobile image')
-                ad.mobile_image = mobile_path
+                # The current image stays live until the new one has been processed
+                job = image_jobs.prepare_ad_image(mobile_file, ad.id, 'mobile')
+                ad.mobile_original = job.original_path
+                ad.mobile_image_status = PENDING
+                jobs.append(job)
 
             db.session.commit()
+            Ads.invalidate_slot_index()
+            image_jobs.submit(jobs)
             flash('Advertisement updated successfully', 'success')
             return redirect(url_for('admin.ads'))
         except ValueError as err:
@@ -97,7 +108,7 @@ def edit_ad(id):
             db.session.rollback()
             flash(f'Error updating advertisement: {exc}', 'error')
 
-    return render_template('admin/ads/edit.html', ad=ad)
+    return render_template('admin/ads/edit.html', ad=ad, positions=AD_POSITIONS)
 
 
 @admin_bp.route('/ads/<int:id>/delete', methods=['POST'])
@@ -126,6 +137,7 @@ def delete_ad(id):
 
         db.session.delete(ad)
         db.session.commit()
+        Ads.invalidate_slot_index()
         flash('Advertisement deleted successfully', 'success')
     except Exception as exc:
         db.session.rollback()
@@ -139,12 +151,14 @@ def delete_ad(id):
 def create_ad():
     """Create new ad."""
     if request.method == 'POST':
+        image_jobs = get_image_jobs()
+        jobs = []
         try:
             ad = Ads(
                 title=request.form['title'],
                 description=request.form.get('description', ''),
                 link_url=request.form.get('link_url', ''),
-                position=request.form['position'],
+                position=_posted_position(),
                 sort_order=int(request.form.get('sort_order', 0)),
                 is_active=bool(request.form.get('is_active')),
             )
@@ -157,21 +171,17 @@ def create_ad():
             db.session.add(ad)
             db.session.flush()
 
-            if 'desktop_image' in request.files:
-                file = request.files['desktop_image']
-                if file and file.filename:
-                    image_path, error = process_ad_image(file, ad.id, 'desktop')
-                    if image_path:
-                        ad.desktop_image = image_path
-
-            if 'mobile_image' in request.files:
-                file = request.files['mobile_image']
-                if file and file.filename:
-                    image_path, error = process_ad_image(file, ad.id, 'mobile')
-                    if image_path:
-                        ad.mobile_image = image_path
+            for image_type in ('desktop', 'mobile'):
+                file = request.files.get(f'{image_type}_image')
+                if file and file.filename and allowed_file(file.filename):
+                    job = image_jobs.prepare_ad_image(file, ad.id, image_type)
+                    setattr(ad, f'{image_type}_original', job.original_path)
+                    setattr(ad, f'{image_type}_image_status', PENDING)
+                    jobs.append(job)
 
             db.session.commit()
+            Ads.invalidate_slot_index()
+            image_jobs.submit(jobs)
             flash('Advertisement created successfully', 'success')
             return redirect(url_for('admin.ads'))
 
@@ -179,4 +189,4 @@ def create_ad():
             db.session.rollback()
             flash(f'Error creating advertisement: {exc}', 'error')
 
-    return render_template('admin/ads/create.html')
+    return render_template('admin/ads/create.html', positions=AD_POSITIONS)
@@ -2,6 +2,7 @@
 from flask import flash, redirect, render_template, request, url_for
 from flask_login import login_required, login_user, logout_user
 
+from app import db
 from models import User
 
 from . import admin_bp
@@ -16,6 +17,8 @@ def login():
 
         user = User.query.filter_by(username=username).first()
         if user and user.check_password(password) and user.is_admin:
+            # Persists a rehashed password, if check_password upgraded it
+            db.session.commit()
             login_user(user)
             return redirect(url_for('admin.dashboard'))
         flash('Invalid credentials', 'error')
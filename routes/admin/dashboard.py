@@ -1,4 +1,5 @@
 
+import os
 from datetime import datetime, timedelta
 
 from flask import render_template, request, jsonify
@@ -7,6 +8,7 @@ from sqlalchemy import func
 from app import db
 from models import Category, Product, User
 from models.order import Order, OrderItem
+from utils.query_stats import get_query_instrumentation
 
 from . import admin_bp, admin_required
 
@@ -182,3 +184,29 @@ def chart_data():
             'success': False,
             'error': str(e)
         }), 400
+
+
+@admin_bp.route('/tools/sql-instrumentation', methods=['GET', 'POST'])
+@admin_required
+def sql_instrumentation():
+    """Show or switch per-request SQL stats ({"enabled": true|false}).
+
+    The switch is per process: under several workers it only affects the
+    one that handled the request, which is reported as pid.
+    """
+    instrumentation = get_query_instrumentation()
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('enabled'):
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    return jsonify({
+        'success': True,
+        'enabled': instrumentation.enabled,
+        'slow_query_ms': instrumentation.slow_threshold * 1000,
+        'pid': os.getpid(),
+        'scope': 'process',
+        'note': 'Only this worker process was switched; set SQL_INSTRUMENTATION to switch all workers.',
+    })
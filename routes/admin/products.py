@@ -7,7 +7,8 @@ from app import db
 from models import Category, Product
 from models.product import ProductImage
 from utils.helpers import generate_slug, paginate_query
-from utils.image_utils import delete_image, process_product_image
+from utils.image_jobs import PENDING, get_image_jobs
+from utils.image_utils import allowed_file, delete_image
 
 from . import admin_bp, admin_required
 
@@ -47,6 +48,8 @@ def products():
 def create_product():
     """Create new product."""
     if request.method == 'POST':
+        image_jobs = get_image_jobs()
+        jobs = []
         try:
             product = Product(
                 name=request.form['name'],
@@ -72,21 +75,22 @@ def create_product():
             if 'images' in request.files:
                 files = request.files.getlist('images')
                 for index, file in enumerate(files):
-                    if file and file.filename:
-                        image_path, error = process_product_image(
-                            file, product.id, index == 0, index
-                        )
-                        if image_path:
-                            db.session.add(
-                                ProductImage(
-                                    product_id=product.id,
-                                    image_path=image_path,
-                                    is_primary=(index == 0),
-                                    sort_order=index,
-                                )
+                    if file and file.filename and allowed_file(file.filename):
+                        job = image_jobs.prepare_product_image(file, product.id, index)
+                        jobs.append(job)
+                        db.session.add(
+                            ProductImage(
+                                product_id=product.id,
+                                image_path=job.relative_path,
+                                is_primary=(index == 0),
+                                sort_order=index,
+                                processing_status=PENDING,
+                                original_path=job.original_path,
                             )
+                        )
 
             db.session.commit()
+            image_jobs.submit(jobs)
             flash('Product created successfully', 'success')
             return redirect(url_for('admin.products'))
 
@@ -105,6 +109,8 @@ def edit_product(id):
     product = Product.query.get_or_404(id)
 
     if request.method == 'POST':
+        image_jobs = get_image_jobs()
+        jobs = []
         try:
             product.name = request.form['name']
             product.slug = generate_slug(request.form['name'])
@@ -126,25 +132,26 @@ def edit_product(id):
 
             if 'images' in request.files:
                 files = request.files.getlist('images')
+                first_sort_order = len(product.images)
                 for index, file in enumerate(files):
-                    if file and file.filename:
-                        image_path, error = process_product_image(
-                            file,
-                            product.id,
-                            False,
-                            len(product.images) + index,
+                    if file and file.filename and allowed_file(file.filename):
+                        job = image_jobs.prepare_product_image(
+                            file, product.id, first_sort_order + index
                         )
-                        if image_path:
-                            db.session.add(
-                                ProductImage(
-                                    product_id=product.id,
-                                    image_path=image_path,
-                                    is_primary=False,
-                                    sort_order=len(product.images) + index,
-                                )
+                        jobs.append(job)
+                        db.session.add(
+                            ProductImage(
+                                product_id=product.id,
+                                image_path=job.relative_path,
+                                is_primary=False,
+                                sort_order=first_sort_order + index,
+                                processing_status=PENDING,
+                                original_path=job.original_path,
                             )
+                        )
 
             db.session.commit()
+            image_jobs.submit(jobs)
             flash('Product updated successfully', 'success')
             return redirect(url_for('admin.products'))
 
@@ -168,12 +175,12 @@ def delete_product(id):
 
     try:
         for image in product.images:
-            if image.image_path:
+            for path in image.get_file_paths():
                 delete_image(
                     os.path.join(
                         current_app.root_path,
                         'static',
-                        image.image_path.replace('/', os.sep),
+                        path.replace('/', os.sep),
                     )
                 )
 
@@ -35,6 +35,7 @@ def create_shipping_fee():
 
             db.session.add(shipping_fee)
             db.session.commit()
+            ShippingFee.invalidate_rules()
             flash('Shipping fee created successfully', 'success')
             return redirect(url_for('admin.shipping_fees'))
 
@@ -1,7 +1,17 @@
-from flask import Blueprint, request, jsonify
-from models import Product, Category, Cart, CartItem
+from flask import Blueprint, current_app, g, request, jsonify
+from models import Product, Category, Cart, CartItem, User
 from models.order import Order, OrderItem
+from utils.api_auth import issue_api_token, token_required
+from utils.exports import iter_keyset, ndjson_response
 from utils.helpers import success_response, error_response
+from utils.serializers import ProductDetailSerializer, ProductListSerializer
+from utils.http_cache import (
+    build_validator,
+    categories_fingerprint,
+    conditional_response,
+    fingerprint,
+    product_images_fingerprint,
+)
 from app import db
 import json
 
@@ -16,6 +26,11 @@ def get_products():
     search = request.args.get('search', '')
     featured = request.args.get('featured', type=bool)
     
+    try:
+        serializer = ProductListSerializer.from_request()
+    except ValueError as exc:
+        return error_response(str(exc))
+    
     query = Product.query.filter_by(is_active=True, status='published')
     
     if category_id:
@@ -27,30 +42,8 @@ def get_products():
     if featured:
         query = query.filter_by(featured=True)
     
-    products = query.paginate(page=page, per_page=per_page, error_out=False)
-    
-    products_data = []
-    for product in products.items:
-        primary_image = product.get_primary_image()
-        products_data.append({
-            'id': product.id,
-            'name': product.name,
-            'slug': product.slug,
-            'description': product.short_description,
-            'price': float(product.current_price),
-            'regular_price': float(product.regular_price),
-            'sale_price': float(product.sale_price) if product.sale_price else None,
-            'discount_percentage': product.discount_percentage,
-            'is_on_sale': product.is_on_sale,
-            'is_in_stock': product.is_in_stock,
-            'stock_quantity': product.stock_quantity,
-            'image': f"/static/{primary_image.image_path}" if primary_image else None,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-                'slug': product.category.slug
-            } if product.category else None
-        })
+    products = query.options(*serializer.load_options()).paginate(page=page, per_page=per_page, error_out=False)
+    products_data = serializer.dump_many(products.items)
     
     return success_response('Products retrieved successfully', {
         'products': products_data,
@@ -67,53 +60,93 @@ def get_products():
 @api_bp.route('/products/<int:product_id>')
 def get_product(product_id):
     """Get single product API"""
-    product = Product.query.filter_by(id=product_id, is_active=True, status='published').first()
+    try:
+        serializer = ProductDetailSerializer.from_request()
+    except ValueError as exc:
+        return error_response(str(exc))
+    
+    row = db.session.execute(
+        db.select(Product.id, Product.updated_at, Product.category_id)
+        .filter_by(id=product_id, is_active=True, status='published')
+    ).first()
     
-    if not product:
+    if not row:
         return error_response('Product not found', 404)
     
-    images = []
-    for image in product.get_all_images():
-        images.append({
-            'id': image.id,
-            'url': f"/static/{image.image_path}",
-            'thumbnail': f"/static/uploads/products/{product.id}/thumb_{image.image_path.split('/')[-1]}",
-            'is_primary': image.is_primary,
-            'alt_text': image.alt_text
-        })
+    category_rows = db.session.execute(
+        db.select(Category.id, Category.updated_at).where(Category.id == row.category_id)
+    ).all()
+    validator = build_validator(
+        fingerprint([row]),
+        fingerprint(category_rows),
+        product_images_fingerprint([row.id]),
+    )
     
-    product_data = {
-        'id': product.id,
-        'name': product.name,
-        'slug': product.slug,
-        'description': product.description,
-        'short_description': product.short_description,
-        'sku': product.sku,
-        'price': float(product.current_price),
-        'regular_price': float(product.regular_price),
-        'sale_price': float(product.sale_price) if product.sale_price else None,
-        'discount_percentage': product.discount_percentage,
-        'is_on_sale': product.is_on_sale,
-        'is_in_stock': product.is_in_stock,
-        'stock_quantity': product.stock_quantity,
-        'weight': float(product.weight) if product.weight else None,
-        'dimensions': product.dimensions,
-        'color': product.color,
-        'size': product.size,
-        'material': product.material,
-        'images': images,
-        'category': {
-            'id': product.category.id,
-            'name': product.category.name,
-            'slug': product.category.slug
-        } if product.category else None
-    }
+    def render():
+        product = Product.query.options(*serializer.load_options()).filter_by(id=row.id).one()
+        return success_response('Product retrieved successfully', serializer.dump(product))
     
-    return success_response('Product retrieved successfully', product_data)
+    return conditional_response(validator, render)
+
+@api_bp.route('/products:batch')
+def get_products_batch():
+    """Get several products by id (?ids=1,2,3) in one request"""
+    try:
+        serializer = ProductDetailSerializer.from_request()
+    except ValueError as exc:
+        return error_response(str(exc))
+    
+    try:
+        product_ids = list(dict.fromkeys(
+            int(value) for value in request.args.get('ids', '').split(',') if value.strip()
+        ))
+    except ValueError:
+        return error_response('ids must be a comma-separated list of integers')
+    
+    if not product_ids:
+        return error_response('ids is required')
+    limit = current_app.config.get('API_BATCH_MAX_IDS', 100)
+    if len(product_ids) > limit:
+        return error_response(f'At most {limit} ids per request')
+    
+    # One query each for products, their categories and their images
+    products = (Product.query
+                .options(*serializer.load_options())
+                .filter(Product.id.in_(product_ids), Product.is_active == True, Product.status == 'published')
+                .all())
+    found = {product.id: data for product, data in zip(products, serializer.dump_many(products))}
+    
+    return success_response('Products retrieved successfully', {
+        'products': {
+            str(product_id): found.get(product_id, {'error': 'Product not found'})
+            for product_id in product_ids
+        }
+    })
+
+@api_bp.route('/export/products.ndjson')
+def export_products():
+    """Stream every published product as NDJSON (optionally ?category_id= and ?fields=)"""
+    try:
+        serializer = ProductDetailSerializer.from_request()
+    except ValueError as exc:
+        return error_response(str(exc))
+    
+    statement = (db.select(Product)
+                 .options(*serializer.load_options())
+                 .where(Product.is_active == True, Product.status == 'published'))
+    category_id = request.args.get('category_id', type=int)
+    if category_id:
+        statement = statement.where(Product.category_id == category_id)
+    
+    batches = iter_keyset(statement, Product.id, current_app.config.get('EXPORT_BATCH_SIZE', 500), scalars=True)
+    return ndjson_response(batches, serializer.dump_many, filename='products.ndjson')
 
 @api_bp.route('/categories')
 def get_categories():
     """Get categories API"""
+    return conditional_response(build_validator(categories_fingerprint()), _categories_response)
+
+def _categories_response():
     categories = Category.get_three_level_categories()
     
     categories_data = []
@@ -154,38 +187,148 @@ def get_categories():
     
     return success_response('Categories retrieved successfully', categories_data)
 
+@api_bp.route('/auth/token', methods=['POST'])
+def issue_token():
+    """Exchange email and password for a bearer token"""
+    data = request.get_json(silent=True) or {}
+    email = data.get('email')
+    password = data.get('password')
+    
+    if not email or not password:
+        return error_response('Email and password required')
+    
+    user = User.query.filter_by(email=email).first()
+    if not (user and user.check_password(password) and user.is_active):
+        return error_response('Invalid email or password', 401)
+    
+    # Persists a rehashed password, if check_password upgraded it
+    db.session.commit()
+    return success_response('Token issued successfully', {
+        'token': issue_api_token(user),
+        'token_type': 'Bearer',
+        'expires_in': current_app.config.get('API_TOKEN_MAX_AGE', 2592000)
+    })
+
+@api_bp.route('/auth/revoke', methods=['POST'])
+@token_required
+def revoke_tokens():
+    """Revoke every token of the token holder, including the one used for this request"""
+    user = g.api_user.load()
+    user.revoke_api_tokens()
+    db.session.commit()
+    User.invalidate_snapshot(user.id)
+    return success_response('Tokens revoked successfully')
+
+def _cart_payload(cart):
+    items_data = []
+    for item in cart.items:
+        product = item.product
+        items_data.append({
+            'product_id': product.id,
+            'name': product.name,
+            'slug': product.slug,
+            'unit_price': float(item.unit_price),
+            'quantity': item.quantity,
+            'total_price': float(item.total_price),
+            'is_in_stock': product.is_in_stock
+        })
+    
+    return {
+        'items': items_data,
+        'subtotal': float(cart.subtotal),
+        'total': float(cart.total),
+        'item_count': cart.total_items
+    }
+
+def _parse_cart_lines(lines):
+    """Validate [{"product_id", "quantity"}, ...] into {product_id: quantity}; raises ValueError"""
+    if not isinstance(lines, list) or not lines:
+        raise ValueError('items must be a non-empty list')
+    limit = current_app.config.get('API_BATCH_MAX_IDS', 100)
+    if len(lines) > limit:
+        raise ValueError(f'At most {limit} items per request')
+    
+    quantities = {}
+    for line in lines:
+        if not isinstance(line, dict):
+            raise ValueError('Each item needs product_id and quantity')
+        product_id = line.get('product_id')
+        quantity = line.get('quantity')
+        if isinstance(product_id, bool) or not isinstance(product_id, int):
+            raise ValueError('product_id must be an integer')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 0:
+            raise ValueError(f'Invalid quantity for product {product_id}')
+        if product_id in quantities:
+            raise ValueError(f'Product {product_id} is listed more than once')
+        quantities[product_id] = quantity
+    return quantities
+
+def _check_stock(quantities):
+    """Check every line being set to a positive quantity with one query; raises ValueError"""
+    wanted = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not wanted:
+        return
+    products = {
+        product.id: product
+        for product in Product.query.filter(
+            Product.id.in_(list(wanted)), Product.is_active == True, Product.status == 'published'
+        )
+    }
+    for product_id, quantity in wanted.items():
+        product = products.get(product_id)
+        if product is None:
+            raise ValueError(f'Product {product_id} not found')
+        if not product.is_in_stock:
+            raise ValueError(f'Product {product_id} out of stock')
+        if product.manage_stock and quantity > product.stock_quantity:
+            raise ValueError(f'Only {product.stock_quantity} of product {product_id} in stock')
+
+def _update_cart(cart, quantities):
+    try:
+        _check_stock(quantities)
+    except ValueError as exc:
+        return error_response(str(exc))
+    
+    cart.set_quantities(quantities)
+    # Committing expires the cart; reload it eagerly rather than lazily per line
+    cart = Cart.load_for_user(g.api_user.id)
+    return success_response('Cart updated successfully', _cart_payload(cart))
+
 @api_bp.route('/cart', methods=['GET'])
+@token_required
 def get_cart():
     """Get cart API"""
-    # This would need session management
-    # For now, return empty cart
-    return success_response('Cart retrieved successfully', {
-        'items': [],
-        'subtotal': 0,
-        'total': 0,
-        'item_count': 0
-    })
+    cart = Cart.load_for_user(g.api_user.id)
+    return success_response('Cart retrieved successfully', _cart_payload(cart))
 
-@api_bp.route('/cart/add', methods=['POST'])
-def add_to_cart():
-    """Add item to cart API"""
-    data = request.get_json()
+@api_bp.route('/cart/items', methods=['POST'])
+@token_required
+def add_cart_item():
+    """Add a quantity of one product to the cart"""
+    data = request.get_json(silent=True) or {}
     product_id = data.get('product_id')
     quantity = data.get('quantity', 1)
     
-    if not product_id:
+    if isinstance(product_id, bool) or not isinstance(product_id, int):
         return error_response('Product ID required')
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+        return error_response('quantity must be a positive integer')
     
-    product = Product.query.get(product_id)
-    if not product:
-        return error_response('Product not found', 404)
-    
-    if not product.is_in_stock:
-        return error_response('Product out of stock')
+    cart = Cart.load_for_user(g.api_user.id)
+    current = next((item.quantity for item in cart.items if item.product_id == product_id), 0)
+    return _update_cart(cart, {product_id: current + quantity})
+
+@api_bp.route('/cart/items', methods=['PUT'])
+@token_required
+def set_cart_items():
+    """Set the quantities of many cart lines at once (0 removes a line); all or nothing"""
+    data = request.get_json(silent=True) or {}
+    try:
+        quantities = _parse_cart_lines(data.get('items'))
+    except ValueError as exc:
+        return error_response(str(exc))
     
-    # This would need proper cart management
-    # For now, just return success
-    return success_response('Item added to cart successfully')
+    return _update_cart(Cart.load_for_user(g.api_user.id), quantities)
 
 @api_bp.route('/orders', methods=['POST'])
 def create_order():
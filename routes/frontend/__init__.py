@@ -4,5 +4,12 @@ frontend_bp = Blueprint('frontend', __name__)
 
 # Import route modules so they register with the blueprint
 from . import auth, catalog, wishlist, cart, account, api  # noqa: F401
+from .helpers import get_wishlist_count
+
+
+@frontend_bp.context_processor
+def inject_wishlist_count():
+    # Navbar badge, served from the cached wishlist ids
+    return {'wishlist_count': get_wishlist_count()}
 
 __all__ = ['frontend_bp']
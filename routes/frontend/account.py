@@ -3,6 +3,7 @@ from flask import flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
 
 from app import db
+from models import User
 from models.order import Order
 
 from . import frontend_bp
@@ -12,7 +13,7 @@ from . import frontend_bp
 @login_required
 def profile():
     """User profile page with order history."""
-    user = current_user
+    user = current_user.load()
 
     if request.method == 'POST':
         first_name = request.form.get('first_name', '').strip()
@@ -26,6 +27,7 @@ def profile():
         user.address = address or None
 
         db.session.commit()
+        User.invalidate_snapshot(user.id)
         flash('Profile updated successfully', 'success')
         return redirect(url_for('frontend.profile'))
 
@@ -1,9 +1,12 @@
 
+from decimal import Decimal
+
 from flask import jsonify, request
 from flask_login import current_user, login_required
 
-from app import db
-from models import Coupon, Product, WishList
+from models import Ads, Coupon, Product, WishList
+from utils.ad_tracking import CLICK, VIEW, is_repeat_event, record_ad_click, record_ad_view
+from utils.helpers import get_client_ip
 
 from . import frontend_bp
 from .helpers import get_or_create_cart, get_wishlist_count
@@ -57,8 +60,9 @@ def api_toggle_wishlist():
     if not product_id:
         return jsonify({'success': False, 'message': 'Product ID required'}), 400
 
-    product = Product.query.get(product_id)
-    if not product:
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
         return jsonify({'success': False, 'message': 'Product not found'}), 404
 
     try:
@@ -66,22 +70,11 @@ def api_toggle_wishlist():
     except (TypeError, ValueError):
         quantity = 1
 
-    wishlist_item = WishList.query.filter_by(
-        user_id=current_user.id, product_id=product_id
-    ).first()
-
-    if wishlist_item:
-        db.session.delete(wishlist_item)
-        db.session.commit()
-        return jsonify({'success': True, 'action': 'removed', 'count': get_wishlist_count()})
-
-    wishlist_item = WishList(
-        user_id=current_user.id, product_id=product_id, quantity=quantity
-    )
-    db.session.add(wishlist_item)
-    db.session.commit()
+    action, state = WishList.toggle(current_user.id, product_id, quantity)
+    if action is None:
+        return jsonify({'success': False, 'message': 'Product not found'}), 404
 
-    return jsonify({'success': True, 'action': 'added', 'count': get_wishlist_count()})
+    return jsonify({'success': True, 'action': action, 'count': state.count})
 
 
 @frontend_bp.route('/api/wishlist/count')
@@ -152,15 +145,17 @@ def api_validate_coupon():
 
     cart = get_or_create_cart()
     product_ids = [item.product_id for item in cart.items]
+    subtotal = Decimal(str(cart.subtotal))
 
     coupon, message = Coupon.validate_coupon_code(
         code=code,
-        order_amount=float(cart.subtotal),
+        user_id=current_user.id if current_user.is_authenticated else None,
+        order_amount=subtotal,
         product_ids=product_ids,
     )
 
     if coupon:
-        discount = coupon.calculate_discount(float(cart.subtotal))
+        discount = coupon.calculate_discount(subtotal)
         return jsonify(
             {
                 'success': True,
@@ -171,3 +166,34 @@ def api_validate_coupon():
         )
 
     return jsonify({'success': False, 'message': message})
+
+
+@frontend_bp.route('/api/ads/track', methods=['POST'])
+def api_track_ads():
+    """Record ad impressions/clicks; buffered, so this never touches the database."""
+    data = request.get_json(silent=True) or {}
+    active_ids = Ads.get_active_ad_ids()
+    # Keyed by IP, not the session: dropping the cookie must not reset it
+    client = get_client_ip(request)
+
+    tracked = 0
+    for key, kind, record in (('views', VIEW, record_ad_view), ('clicks', CLICK, record_ad_click)):
+        ad_ids = data.get(key) or []
+        if not isinstance(ad_ids, list):
+            continue
+        seen = set()
+        for ad_id in ad_ids[:50]:
+            try:
+                ad_id = int(ad_id)
+            except (TypeError, ValueError):
+                continue
+            # Only ads that are being served, each counted once per beacon
+            if ad_id not in active_ids or ad_id in seen:
+                continue
+            seen.add(ad_id)
+            if is_repeat_event(kind, client, ad_id):
+                continue
+            record(ad_id)
+            tracked += 1
+
+    return jsonify({'success': True, 'tracked': tracked})
@@ -1,7 +1,6 @@
 
 from flask import render_template, request, redirect, url_for, flash
 from flask_login import current_user, login_required, login_user, logout_user
-from werkzeug.security import generate_password_hash
 
 from app import db
 from models import User
@@ -22,6 +21,8 @@ def login():
 
         user = User.query.filter_by(email=email).first()
         if user and user.check_password(password) and user.is_active:
+            # Persists a rehashed password, if check_password upgraded it
+            db.session.commit()
             login_user(user, remember=remember)
             next_page = request.args.get('next')
             if next_page:
@@ -58,12 +59,12 @@ def register():
             user = User(
                 username=username,
                 email=email,
-                password_hash=generate_password_hash(password),
                 first_name=first_name,
                 last_name=last_name,
                 is_active=True,
                 is_admin=False
             )
+            user.set_password(password)
             db.session.add(user)
             db.session.commit()
 
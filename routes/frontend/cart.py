@@ -5,9 +5,9 @@ from flask import flash, redirect, render_template, request, session, url_for
 from flask_login import current_user, login_required
 
 from app import db
-from models import ShippingFee
+from models import Coupon, ShippingFee, User
 from models.order import Order, OrderItem
-from utils.ecpay import ECPayService, ECPAY_TEST_CONFIG
+from utils.ecpay import get_ecpay_service
 from utils.helpers import generate_order_number
 
 from . import frontend_bp
@@ -31,13 +31,15 @@ def checkout():
         return redirect(url_for('frontend.cart'))
 
     shipping_methods = ShippingFee.get_available_shipping_methods(
-        order_amount=float(cart_obj.subtotal)
+        order_amount=cart_obj.subtotal,
+        total_weight=cart_obj.total_weight,
     )
 
     return render_template(
         'frontend/checkout.html',
         cart=cart_obj,
         shipping_methods=shipping_methods,
+        user=current_user.load(),
     )
 
 
@@ -58,23 +60,23 @@ def process_checkout():
     address = request.form.get('address', '').strip()
     shipping_method_id = request.form.get('shipping_method')
     notes = request.form.get('notes', '')
-
-    if current_user.is_authenticated:
-        dirty = False
-        if current_user.first_name != first_name:
-            current_user.first_name = first_name
-            dirty = True
-        if current_user.last_name != last_name:
-            current_user.last_name = last_name
-            dirty = True
-        if getattr(current_user, 'phone', None) != phone:
-            current_user.phone = phone
-            dirty = True
-        if getattr(current_user, 'address', None) != address:
-            current_user.address = address
-            dirty = True
-        if dirty:
-            db.session.add(current_user)
+    coupon_code = request.form.get('coupon_code', '').strip()
+
+    # current_user is a cached snapshot; changes go through the attached row
+    user = current_user.load()
+    profile_changed = False
+    if user.first_name != first_name:
+        user.first_name = first_name
+        profile_changed = True
+    if user.last_name != last_name:
+        user.last_name = last_name
+        profile_changed = True
+    if user.phone != phone:
+        user.phone = phone
+        profile_changed = True
+    if user.address != address:
+        user.address = address
+        profile_changed = True
 
     if not all([first_name, last_name, email, phone, address, shipping_method_id]):
         flash('Please fill in all required fields', 'error')
@@ -86,13 +88,14 @@ def process_checkout():
         flash('Invalid shipping method', 'error')
         return redirect(url_for('frontend.checkout'))
 
-    shipping_method = ShippingFee.query.get(shipping_method_id)
+    shipping_method = ShippingFee.get_shipping_rule(shipping_method_id)
     if not shipping_method:
         flash('Invalid shipping method', 'error')
         return redirect(url_for('frontend.checkout'))
 
-    shipping_cost = shipping_method.calculate_shipping_cost(
-        order_amount=float(cart_obj.subtotal)
+    shipping_cost = shipping_method.quote(
+        order_amount=cart_obj.subtotal,
+        total_weight=cart_obj.total_weight,
     )
     if shipping_cost is None:
         flash('Invalid shipping method for this order', 'error')
@@ -100,7 +103,22 @@ def process_checkout():
 
     order_subtotal = Decimal(str(cart_obj.subtotal))
     shipping_cost_decimal = Decimal(str(shipping_cost))
-    order_total = order_subtotal + shipping_cost_decimal
+
+    coupon = None
+    discount_amount = Decimal('0')
+    if coupon_code:
+        coupon, message = Coupon.validate_coupon_code(
+            code=coupon_code,
+            user_id=current_user.id,
+            order_amount=order_subtotal,
+            product_ids=[item.product_id for item in cart_items],
+        )
+        if not coupon:
+            flash(message, 'error')
+            return redirect(url_for('frontend.checkout'))
+        discount_amount = Decimal(str(coupon.calculate_discount(order_subtotal))).quantize(Decimal('0.01'))
+
+    order_total = order_subtotal + shipping_cost_decimal - discount_amount
 
     order = Order(
         user_id=current_user.id,
@@ -126,6 +144,7 @@ def process_checkout():
         payment_method='ecpay',
         subtotal=order_subtotal,
         shipping_fee=shipping_cost_decimal,
+        discount_amount=discount_amount,
         total_amount=order_total,
         customer_notes=notes,
         payment_status='pending',
@@ -133,6 +152,18 @@ def process_checkout():
     db.session.add(order)
     db.session.flush()
 
+    # Claimed in the same transaction as the order; a lost race rolls both back
+    if coupon:
+        redeemed, message = coupon.redeem(
+            user_id=current_user.id,
+            order_id=order.id,
+            discount_amount=discount_amount,
+        )
+        if not redeemed:
+            db.session.rollback()
+            flash(message, 'error')
+            return redirect(url_for('frontend.checkout'))
+
     for item in cart_items:
         product = item.product
         if not product:
@@ -155,11 +186,13 @@ def process_checkout():
             )
         )
 
-    ecpay_service = ECPayService(**ECPAY_TEST_CONFIG)
+    ecpay_service = get_ecpay_service()
     merchant_trade_no = ecpay_service.generate_merchant_trade_no(order.id)
     order.transaction_id = merchant_trade_no
 
     db.session.commit()
+    if profile_changed:
+        User.invalidate_snapshot(user.id)
 
     item_names = [
         f"{item.product.name} x {item.quantity}" for item in cart_items if item.product
@@ -180,7 +213,6 @@ def process_checkout():
     }
 
     ecpay_params = ecpay_service.create_order(order_data)
-    session['ecpay_params'] = ecpay_params
     session['order_id'] = order.id
 
     cart_obj.clear()
@@ -195,10 +227,10 @@ def process_checkout():
 @frontend_bp.route('/ecpay/return', methods=['POST'])
 def ecpay_return():
     """ECPay payment result notification (server-to-server)."""
-    ecpay_service = ECPayService(**ECPAY_TEST_CONFIG)
+    ecpay_service = get_ecpay_service()
     form_data = request.form.to_dict()
 
-    if not ecpay_service.verify_check_mac_value(form_data.copy()):
+    if not ecpay_service.verify_check_mac_value(form_data):
         return '0|CheckMacValue verification failed'
 
     merchant_trade_no = form_data.get('MerchantTradeNo')
@@ -242,8 +274,8 @@ def order_result(order_id):
 
     if request.method == 'POST':
         form_data = request.form.to_dict()
-        ecpay_service = ECPayService(**ECPAY_TEST_CONFIG)
-        if ecpay_service.verify_check_mac_value(form_data.copy()):
+        ecpay_service = get_ecpay_service()
+        if ecpay_service.verify_check_mac_value(form_data):
             merchant_trade_no = form_data.get('MerchantTradeNo')
             rtn_code = form_data.get('RtnCode')
             trade_no = form_data.get('TradeNo')
@@ -1,13 +1,20 @@
 
 from datetime import datetime, timedelta
 
-from flask import redirect, render_template, request, url_for
+from flask import abort, redirect, render_template, request, url_for
 from sqlalchemy import func
 
 from app import db
 from models import Ads, Category, Product
 from models.order import Order, OrderItem
 from utils.helpers import paginate_query
+from utils.http_cache import (
+    build_validator,
+    categories_fingerprint,
+    conditional_response,
+    fingerprint,
+    product_images_fingerprint,
+)
 
 from . import frontend_bp
 from .helpers import get_user_wishlist_product_ids
@@ -154,33 +161,55 @@ def shop():
 @frontend_bp.route('/product/<slug>')
 def product_detail(slug):
     """Product detail page."""
-    product = Product.query.filter_by(
-        slug=slug,
-        is_active=True,
-        status='published',
-    ).first_or_404()
-
-    related_products = (
-        Product.query.filter(
-            Product.category_id == product.category_id,
-            Product.id != product.id,
+    row = db.session.execute(
+        db.select(Product.id, Product.updated_at, Product.category_id).where(
+            Product.slug == slug,
+            Product.is_active == True,  # noqa: E712
+            Product.status == 'published',
+        )
+    ).first()
+    if row is None:
+        abort(404)
+
+    related_rows = db.session.execute(
+        db.select(Product.id, Product.updated_at).where(
+            Product.category_id == row.category_id,
+            Product.id != row.id,
             Product.is_active == True,  # noqa: E712
             Product.status == 'published',
         )
+        .order_by(Product.id)
         .limit(4)
-        .all()
+    ).all()
+    related_ids = [related.id for related in related_rows]
+
+    validator = build_validator(
+        fingerprint([row]),
+        fingerprint(related_rows),
+        product_images_fingerprint([row.id] + related_ids),
+        categories_fingerprint(),
+        user_scoped=True,
     )
 
-    wishlist_product_ids = get_user_wishlist_product_ids()
-    product_in_wishlist = product.id in wishlist_product_ids
+    def render():
+        product = db.session.get(Product, row.id)
+        related_products = (
+            Product.query.filter(Product.id.in_(related_ids)).order_by(Product.id).all()
+            if related_ids else []
+        )
 
-    return render_template(
-        'frontend/product_detail.html',
-        product=product,
-        related_products=related_products,
-        product_in_wishlist=product_in_wishlist,
-        wishlist_product_ids=wishlist_product_ids,
-    )
+        wishlist_product_ids = get_user_wishlist_product_ids()
+        product_in_wishlist = product.id in wishlist_product_ids
+
+        return render_template(
+            'frontend/product_detail.html',
+            product=product,
+            related_products=related_products,
+            product_in_wishlist=product_in_wishlist,
+            wishlist_product_ids=wishlist_product_ids,
+        )
+
+    return conditional_response(validator, render)
 
 
 @frontend_bp.route('/category/<slug>')
@@ -201,16 +230,36 @@ def category(slug):
         .order_by(Product.created_at.desc())
     )
 
-    products = paginate_query(query, page, 12)
-    wishlist_product_ids = get_user_wishlist_product_ids()
-
-    return render_template(
-        'frontend/category.html',
-        category=category_obj,
-        products=products,
-        wishlist_product_ids=wishlist_product_ids,
+    # The page's rows plus the total (pagination links) decide what is rendered
+    page_rows = db.session.execute(
+        query.with_entities(Product.id, Product.updated_at)
+        .limit(12)
+        .offset((max(page, 1) - 1) * 12)
+        .statement
+    ).all()
+    total = query.order_by(None).count()
+
+    validator = build_validator(
+        fingerprint(page_rows),
+        total,
+        product_images_fingerprint(row.id for row in page_rows),
+        categories_fingerprint(),
+        user_scoped=True,
     )
 
+    def render():
+        products = paginate_query(query, page, 12)
+        wishlist_product_ids = get_user_wishlist_product_ids()
+
+        return render_template(
+            'frontend/category.html',
+            category=category_obj,
+            products=products,
+            wishlist_product_ids=wishlist_product_ids,
+        )
+
+    return conditional_response(validator, render)
+
 
 @frontend_bp.route('/search')
 def search():
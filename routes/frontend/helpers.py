@@ -21,14 +21,14 @@ def get_or_create_cart():
 
 
 def get_user_wishlist_product_ids():
-    '''Return a set of product ids that belong to the active user's wishlist.'''
+    '''Return the (cached) set of product ids on the active user's wishlist.'''
     if current_user.is_authenticated:
-        return {item.product_id for item in WishList.query.filter_by(user_id=current_user.id)}
-    return set()
+        return WishList.get_product_ids(current_user.id)
+    return frozenset()
 
 
 def get_wishlist_count():
     '''Return the wishlist item count for the active user.'''
     if current_user.is_authenticated:
-        return WishList.query.filter_by(user_id=current_user.id).count()
+        return WishList.get_state(current_user.id).count
     return 0
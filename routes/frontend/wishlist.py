@@ -2,7 +2,9 @@
 from flask import render_template
 from flask_login import login_required, current_user
 
-from models import WishList
+from sqlalchemy.orm import joinedload
+
+from models import Product, WishList
 
 from . import frontend_bp
 
@@ -13,7 +15,9 @@ def wishlist():
     """Display the current user's wishlist."""
     items = (
         WishList.query.filter_by(user_id=current_user.id)
+        .options(joinedload(WishList.product))
         .order_by(WishList.created_at.desc())
         .all()
     )
+    Product.prefetch_primary_images(item.product for item in items)
     return render_template('frontend/wishlist.html', items=items)
@@ -16,7 +16,7 @@ from app import create_app
 from database import db
 from models import User, Category, Product, ProductImage, Cart, CartItem, Ads, Coupon, ShippingFee
 from models.order import Order, OrderItem
-from werkzeug.security import generate_password_hash
+from utils.passwords import hash_password
 
 def create_database():
     """Create the database and tables"""
@@ -40,7 +40,7 @@ def create_sample_data():
     admin_user = User(
         username='admin',
         email='admin@mvcshopping.com',
-        password_hash=generate_password_hash('admin123'),
+        password_hash=hash_password('admin123'),
         first_name='Admin',
         last_name='User',
         is_admin=True,
@@ -52,7 +52,7 @@ def create_sample_data():
     regular_user = User(
         username='customer',
         email='customer@mvcshopping.com',
-        password_hash=generate_password_hash('customer123'),
+        password_hash=hash_password('customer123'),
         first_name='John',
         last_name='Doe',
         phone='123-456-7890',
@@ -94,7 +94,10 @@ $(document).ready(function() {
     $('.thumbnail-image').click(function() {
         var mainImageSrc = $(this).data('main-src');
         if (mainImageSrc) {
-            $('#main-product-image').attr('src', mainImageSrc);
+            var mainImage = $('#main-product-image');
+            mainImage.attr('src', mainImageSrc);
+            mainImage.attr('srcset', $(this).data('main-srcset') || null);
+            mainImage.siblings('source[type="image/avif"]').attr('srcset', $(this).data('main-avif-srcset') || null);
             $('.thumbnail-image').removeClass('active');
             $(this).addClass('active');
         }
@@ -0,0 +1,46 @@
+from app import db
+from models import Ads
+from models.ads import HOMEPAGE_BANNER, is_known_position, normalize_position
+
+
+def _legacy_slot(position):
+    """Slot a free-text position was shown in before positions were canonical.
+
+    The homepage used to pick up any position starting with 'home' or
+    containing 'banner'; those ads are moved to the homepage banner slot
+    so they keep appearing where they did.
+    """
+    key = normalize_position(position)
+    if is_known_position(key):
+        return key
+    if key.startswith('home') or 'banner' in key:
+        return HOMEPAGE_BANNER
+    return None
+
+
+def normalize_ad_positions(dry_run=False):
+    """Rewrite ads.position to canonical slot names.
+
+    Returns (changes, unknown): (ad, old, new) for every ad that was (or
+    would be) moved, and the ads whose position matches no slot; those
+    are left as they are and are not shown anywhere.
+    """
+    changes = []
+    unknown = []
+    for ad in Ads.query.order_by(Ads.id).all():
+        # Loaded values skip the validator, so this is the stored text
+        old = ad.position
+        new = _legacy_slot(old)
+        if new is None:
+            unknown.append(ad)
+        elif new != old:
+            changes.append((ad, old, new))
+
+    if dry_run or not changes:
+        return changes, unknown
+
+    for ad, _, new in changes:
+        ad.position = new
+    db.session.commit()
+    Ads.invalidate_slot_index()
+    return changes, unknown
@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: brotli variants are skipped without it
+    brotli = None
+
+try:
+    import rcssmin
+except ImportError:  # optional: CSS is copied unminified without it
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:  # optional: JS is copied unminified without it
+    rjsmin = None
+
+ASSET_DIRS = ('css', 'js')
+ASSET_EXTENSIONS = ('.css', '.js')
+MANIFEST_NAME = 'manifest.json'
+
+_CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)(?![a-z]+:|/|#)([^\'")]+)\1\s*\)', re.I)
+
+
+# A regex "minifier" cannot tell strings, regex literals or template literals
+# from code, so without a real minifier the source is shipped as written
+def _minify_css(source: str) -> str:
+    return rcssmin.cssmin(source) if rcssmin is not None else source
+
+
+def _minify_js(source: str) -> str:
+    return rjsmin.jsmin(source) if rjsmin is not None else source
+
+
+def _absolutize_css_urls(source: str, logical_path: str, static_url_path: str) -> str:
+    """Point relative url() references at the original static files, since fingerprinted CSS lives elsewhere."""
+    base = posixpath.dirname(logical_path)
+
+    def replace(match):
+        quote, target = match.groups()
+        resolved = posixpath.normpath(posixpath.join(base, target))
+        return f'url({quote}{static_url_path}/{resolved}{quote})'
+
+    return _CSS_URL_RE.sub(replace, source)
+
+
+def _write(path: str, data: bytes):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+
+
+def _iter_sources(static_folder: str):
+    for directory in ASSET_DIRS:
+        root = os.path.join(static_folder, directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.endswith(ASSET_EXTENSIONS) and '.min.' not in filename:
+                    path = os.path.join(dirpath, filename)
+                    yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def build_assets(static_folder: str, output_dir: str, static_url_path: str = '/static'):
+    """Minify, fingerprint and precompress the CSS/JS under static/css and static/js.
+
+    Files are only minified when rcssmin/rjsmin are installed. Writes ``<name>.<hash>.<ext>`` plus ``.gz`` (and ``.br`` when brotli is
+    installed) variants to output_dir, and a manifest mapping each
+    logical path (e.g. ``css/style.css``) to its fingerprinted file and
+    available encodings. Files from builds other than this and the
+    previous one are removed.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path, encoding='utf-8') as handle:
+            previous = json.load(handle).get('assets', {})
+    except (OSError, ValueError):
+        previous = {}
+
+    assets = {}
+    stats = {'files': 0, 'source_bytes': 0, 'minified_bytes': 0, 'gzip_bytes': 0, 'brotli_bytes': 0}
+    for logical_path, source_path in _iter_sources(static_folder):
+        with open(source_path, encoding='utf-8-sig') as handle:
+            source = handle.read()
+
+        if logical_path.endswith('.css'):
+            minified = _minify_css(_absolutize_css_urls(source, logical_path, static_url_path))
+        else:
+            minified = _minify_js(source)
+        data = minified.encode('utf-8')
+
+        stem, ext = posixpath.splitext(logical_path)
+        fingerprinted = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        target = os.path.join(output_dir, fingerprinted.replace('/', os.sep))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        _write(target, data)
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        _write(f'{target}.gz', compressed)
+        encodings = ['gzip']
+        stats['gzip_bytes'] += len(compressed)
+        if brotli is not None:
+            compressed = brotli.compress(data, quality=11)
+            _write(f'{target}.br', compressed)
+            encodings.insert(0, 'br')
+            stats['brotli_bytes'] += len(compressed)
+
+        assets[logical_path] = {'path': fingerprinted, 'encodings': encodings}
+        stats['files'] += 1
+        stats['source_bytes'] += len(source.encode('utf-8'))
+        stats['minified_bytes'] += len(data)
+
+    _write(manifest_path, json.dumps({'assets': assets}, indent=2, sort_keys=True).encode('utf-8'))
+
+    # Keep the previous build for pages rendered before the deploy
+    keep = {MANIFEST_NAME}
+    for entry in list(assets.values()) + list(previous.values()):
+        keep.update(f"{entry['path']}{suffix}" for suffix in ('', '.gz', '.br'))
+    removed = 0
+    for dirpath, _, filenames in os.walk(output_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.relpath(path, output_dir).replace(os.sep, '/') not in keep:
+                os.remove(path)
+                removed += 1
+
+    return dict(
+        stats,
+        removed=removed,
+        brotli=brotli is not None,
+        unminified=[kind for kind, module in (('CSS', rcssmin), ('JS', rjsmin)) if module is None],
+        manifest=manifest_path,
+    )
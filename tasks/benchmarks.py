@@ -0,0 +1,255 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from utils.ecpay import ECPayService, _encode_component
+from utils.image_utils import available_image_formats, convert_to_webp, generate_thumbnail, render_rendition_ladder
+from utils.passwords import PasswordHasher
+
+
+def _legacy_check_mac_value(service: ECPayService, params: dict) -> str:
+    """CheckMacValue as computed before the service pre-encoded HashKey/HashIV."""
+    params = params.copy()
+    params.pop('CheckMacValue', None)
+    query_string = '&'.join([f"{key}={value}" for key, value in sorted(params.items())])
+    query_string = f"HashKey={service.hash_key}&{query_string}&HashIV={service.hash_iv}"
+    query_string = urllib.parse.quote_plus(query_string).lower()
+    return hashlib.sha256(query_string.encode('utf-8')).hexdigest().upper()
+
+
+def _sample_callback(service: ECPayService, index: int = 0) -> dict:
+    """Build a payload shaped like an ECPay ReturnURL notification."""
+    payload = {
+        'CustomField1': str(1000 + index),
+        'CustomField2': 'Jane Doe',
+        'CustomField3': 'jane@example.com',
+        'CustomField4': '0912345678',
+        'MerchantID': service.merchant_id,
+        'MerchantTradeNo': f"EC{index:06d}{1700000000 + index}",
+        'PaymentDate': '2024/01/01 12:00:00',
+        'PaymentType': 'Credit_CreditCard',
+        'PaymentTypeChargeFee': '1',
+        'RtnCode': '1',
+        'RtnMsg': '交易成功',
+        'SimulatePaid': '0',
+        'StoreID': '',
+        'TradeAmt': '1280',
+        'TradeDate': '2024/01/01 11:58:42',
+        'TradeNo': f"2401011158{index:08d}",
+    }
+    payload['CheckMacValue'] = _legacy_check_mac_value(service, payload)
+    return payload
+
+
+def _time_per_call(func, payloads, iterations):
+    count = len(payloads)
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(payloads[i % count])
+    return (time.perf_counter() - started) / iterations
+
+
+def benchmark_check_mac_value(service: ECPayService, iterations: int = 20000):
+    """Measure per-callback CheckMacValue verification cost.
+
+    Returns microseconds per call for the legacy routine, the current
+    routine on distinct payloads, and repeated notifications whose
+    components are all served from the encoding memo.
+    """
+    payloads = [_sample_callback(service, i) for i in range(iterations)]
+
+    for payload in payloads[:100]:
+        if _legacy_check_mac_value(service, payload) != service.generate_check_mac_value(payload):
+            raise AssertionError('CheckMacValue mismatch between legacy and current routine')
+
+    legacy = _time_per_call(
+        lambda payload: _legacy_check_mac_value(service, payload) == payload['CheckMacValue'],
+        payloads,
+        iterations,
+    )
+    _encode_component.cache_clear()
+    uncached = _time_per_call(service.verify_check_mac_value, payloads, iterations)
+    repeated = _time_per_call(service.verify_check_mac_value, payloads[:16], iterations)
+
+    return {
+        'iterations': iterations,
+        'legacy_us': legacy * 1e6,
+        'current_us': uncached * 1e6,
+        'cached_us': repeated * 1e6,
+    }
+
+
+def _legacy_render_product_image(source_path, upload_dir, webp_filename):
+    """Product image pipeline as it was before renditions: decode, encode, then re-decode the WebP for the thumbnail."""
+    webp_path = os.path.join(upload_dir, webp_filename)
+    convert_to_webp(source_path, webp_path)
+    generate_thumbnail(webp_path, os.path.join(upload_dir, f"thumb_{webp_filename}"))
+
+
+def _sample_photo(path: str, width: int, height: int):
+    """Write a photo-like JPEG (gradients plus sensor noise) to path."""
+    size = (width, height)
+    red = Image.linear_gradient('L').resize(size)
+    green = Image.radial_gradient('L').resize(size)
+    blue = Image.effect_noise(size, 48)
+    Image.merge('RGB', (red, green, blue)).save(path, 'JPEG', quality=90)
+
+
+def _time_render(render, source_path, upload_dir, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        render(source_path, upload_dir, f"bench_{i}.webp")
+    return (time.perf_counter() - started) / iterations
+
+
+def benchmark_image_renditions(iterations: int = 5, width: int = 4000, height: int = 3000):
+    """Measure per-upload product image processing cost.
+
+    Returns milliseconds per upload for the legacy convert-then-thumbnail
+    path and for the single-decode rendition ladder in every available
+    format.
+    """
+    workdir = tempfile.mkdtemp(prefix='bench-images-')
+    try:
+        source_path = os.path.join(workdir, 'source.jpg')
+        _sample_photo(source_path, width, height)
+
+        legacy_dir = os.path.join(workdir, 'legacy')
+        current_dir = os.path.join(workdir, 'current')
+        os.makedirs(legacy_dir)
+
+        legacy = _time_render(_legacy_render_product_image, source_path, legacy_dir, iterations)
+
+        formats = available_image_formats()
+        renditions = {}
+
+        def render(source, upload_dir, filename):
+            # Identical uploads hash to the same files, so clear them to time real writes
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            renditions.update(render_rendition_ladder(source, upload_dir, 'bench'))
+
+        current = _time_render(render, source_path, current_dir, iterations)
+
+        return {
+            'iterations': iterations,
+            'source': f"{width}x{height} JPEG, {os.path.getsize(source_path) // 1024} KiB",
+            'legacy_ms': legacy * 1e3,
+            'legacy_files': len(os.listdir(legacy_dir)) // iterations,
+            'current_ms': current * 1e3,
+            'current_files': sum(len(renditions[fmt]) for fmt in formats),
+            'formats': formats,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def benchmark_password_hashing(methods, iterations: int = 20, workers: int = None):
+    """Measure login (password verification) throughput for each hash method.
+
+    Returns, per method, milliseconds per verification on one thread and
+    the throughput of `workers` concurrent logins through the hashing
+    pool, plus that throughput divided by the cores it used.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = []
+    for method in methods:
+        hasher = PasswordHasher(method=method, workers=workers)
+        try:
+            stored = generate_password_hash('correct horse battery staple', method)
+
+            started = time.perf_counter()
+            for _ in range(iterations):
+                check_password_hash(stored, 'correct horse battery staple')
+            serial = (time.perf_counter() - started) / iterations
+
+            logins = iterations * workers
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as clients:
+                list(clients.map(lambda _: hasher.verify(stored, 'correct horse battery staple'), range(logins)))
+            per_second = logins / (time.perf_counter() - started)
+        finally:
+            hasher.shutdown()
+
+        results.append({
+            'method': stored.split('$', 1)[0],
+            'serial_ms': serial * 1e3,
+            'per_second': per_second,
+            'per_core': per_second / min(workers, os.cpu_count() or 1),
+        })
+    return {'iterations': iterations, 'workers': workers, 'methods': results}
+
+
+def _legacy_products_payload(products):
+    """/api/products items as built before the serializers: full rows, one image query per product."""
+    products_data = []
+    for product in products:
+        primary_image = product.get_primary_image()
+        products_data.append({
+            'id': product.id,
+            'name': product.name,
+            'slug': product.slug,
+            'description': product.short_description,
+            'price': float(product.current_price),
+            'regular_price': float(product.regular_price),
+            'sale_price': float(product.sale_price) if product.sale_price else None,
+            'discount_percentage': product.discount_percentage,
+            'is_on_sale': product.is_on_sale,
+            'is_in_stock': product.is_in_stock,
+            'stock_quantity': product.stock_quantity,
+            'image': f"/static/{primary_image.image_path}" if primary_image else None,
+            'category': {
+                'id': product.category.id,
+                'name': product.category.name,
+                'slug': product.category.slug
+            } if product.category else None
+        })
+    return products_data
+
+
+def benchmark_product_api(per_page: int = 100, iterations: int = 20):
+    """Measure building and encoding one /api/products page.
+
+    Returns milliseconds and bytes per page for the hand-built dicts
+    encoded by Flask's default provider and for ProductListSerializer
+    encoded by the compact provider, with the session reset between
+    iterations so both load their rows from the database.
+    """
+    from flask import current_app
+    from flask.json.provider import DefaultJSONProvider
+
+    from app import db
+    from models import Product
+    from utils.serializers import CompactJSONProvider, ProductListSerializer
+
+    app = current_app._get_current_object()
+    default_json = DefaultJSONProvider(app)
+    compact_json = CompactJSONProvider(app)
+    query = Product.query.filter_by(is_active=True, status='published')
+
+    def legacy():
+        products = query.limit(per_page).all()
+        return default_json.dumps({'data': _legacy_products_payload(products)}, separators=(',', ':'))
+
+    def current():
+        serializer = ProductListSerializer()
+        products = query.options(*serializer.load_options()).limit(per_page).all()
+        return compact_json.dumps({'data': serializer.dump_many(products)})
+
+    results = {}
+    for name, build in (('legacy', legacy), ('current', current)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            body = build()
+            db.session.expunge_all()
+        results[f'{name}_ms'] = (time.perf_counter() - started) / iterations * 1e3
+        results[f'{name}_bytes'] = len(body.encode('utf-8'))
+    results['products'] = min(per_page, query.count())
+    results['iterations'] = iterations
+    return results
@@ -0,0 +1,441 @@
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app import db
+from config import Config
+from models import Ads
+from models.product import ProductImage
+from utils.image_jobs import FAILED, PENDING, READY, get_image_jobs
+from utils.image_utils import (
+    LEGACY_RENDITION_PREFIXES,
+    ad_rendition_spec,
+    check_image_header,
+    render_rendition_ladder,
+    render_renditions,
+    rendition_spec,
+)
+
+AD_IMAGE_TYPES = ('desktop', 'mobile')
+UPLOADS_PREFIX = 'uploads/'
+
+# Rebuild result for images that cannot reach the current settings without their original
+LIMITED = 'limited'
+
+
+def _read_static(static_root: str, path: str) -> bytes:
+    with open(os.path.join(static_root, path.replace('/', os.sep)), 'rb') as handle:
+        return handle.read()
+
+
+def _rebuild_product_image(static_root: str, source_path: str, url_dir: str, is_original: bool):
+    """Worker: regenerate the rendition ladder; returns (metadata, whether wider steps were left out).
+
+    Images uploaded before originals were kept are rebuilt from their
+    largest stored rendition instead. Their ladder stops at that width,
+    since wider steps would only be upscaled copies of it.
+    """
+    data = _read_static(static_root, source_path)
+    widths = None
+    limited = False
+    if not is_original:
+        longest = max(check_image_header(data))
+        widths = [width for width in Config.PRODUCT_IMAGE_WIDTHS if width <= longest] or [longest]
+        limited = longest < max(Config.PRODUCT_IMAGE_WIDTHS)
+    metadata = render_rendition_ladder(data, os.path.join(static_root, url_dir.replace('/', os.sep)), url_dir, widths)
+    return metadata, limited
+
+
+def _rebuild_ad_image(static_root: str, image_path: str, original_path, image_type: str, force: bool):
+    """Worker: re-render an ad banner in place from its original.
+
+    Returns False if the banner already has the configured size, and
+    LIMITED for a banner without an original whose configured aspect
+    ratio changed: re-rendering the padded banner would keep its old
+    padding inside the new one, so it is left for a new upload. Ads keep
+    no record of the quality they were encoded with, so callers pass
+    force=True whenever the ad spec changed since the last full run.
+    """
+    data = _read_static(static_root, image_path)
+    size = tuple(Config.AD_IMAGE_SIZE.get(image_type, Config.PRODUCT_IMAGE_SIZE))
+    current = check_image_header(data)
+    if not force and current == size:
+        return False
+
+    if original_path:
+        data = _read_static(static_root, original_path)
+    elif current[0] * size[1] != current[1] * size[0]:
+        return LIMITED
+    path = os.path.join(static_root, image_path.replace('/', os.sep))
+    render_renditions(data, os.path.dirname(path), os.path.basename(path), {image_type: {'size': size, 'pad': True}})
+    return True
+
+
+def _is_current(image: ProductImage, static_root: str, spec: str) -> bool:
+    renditions = image.get_renditions()
+    if renditions.get('spec') != spec:
+        return False
+    return all(
+        os.path.exists(os.path.join(static_root, path.replace('/', os.sep)))
+        for path in image.get_file_paths()
+    )
+
+
+def _load_checkpoint(path: str, spec: str, ad_spec: str):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    # Progress recorded under other image settings does not count
+    return state if state.get('spec') == spec and state.get('ad_spec') == ad_spec else None
+
+
+def _read_ad_spec(path: str):
+    try:
+        with open(path, encoding='utf-8') as handle:
+            return handle.read().strip()
+    except OSError:
+        return None
+
+
+def _write_checkpoint(path: str, state: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as handle:
+        json.dump(state, handle)
+    os.replace(temp_path, path)
+
+
+def rebuild_images(workers=None, batch_size=200, checkpoint_path=None, resume=False, force=False, progress=None):
+    """Regenerate product image renditions and ad banners for the current image settings.
+
+    Rows are walked in id order in batches across a process pool. After
+    each batch is committed the last processed ids are written to the
+    checkpoint file, so an interrupted run continues with resume=True.
+    Product images whose renditions were built with the current spec and
+    whose files all exist are skipped without decoding. Replaced
+    renditions are left in place for `flask images gc`.
+
+    Everything is rendered from the stored originals. Images uploaded
+    before originals were kept are re-encoded from their largest stored
+    rendition: product ladders stop at its width and ad banners whose
+    aspect ratio changed are left alone. Both are counted as limited and
+    need a new upload to reach the current settings.
+    """
+    static_root = current_app.static_folder
+    spec = rendition_spec()
+    ad_spec = ad_rendition_spec()
+    checkpoint_path = checkpoint_path or os.path.join(current_app.instance_path, 'images-rebuild.json')
+    # Spec of the last run that re-rendered every ad; a size or quality change re-renders them all
+    ad_spec_path = os.path.join(current_app.instance_path, 'images-ads.spec')
+    force_ads = force or _read_ad_spec(ad_spec_path) != ad_spec
+
+    state = _load_checkpoint(checkpoint_path, spec, ad_spec) if resume else None
+    resumed = state is not None
+    if state is None:
+        state = {
+            'spec': spec,
+            'ad_spec': ad_spec,
+            'product_image_id': 0,
+            'ad_id': 0,
+            'stats': {'rebuilt': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'limited': 0},
+        }
+    stats = state['stats']
+    stats.setdefault('limited', 0)
+
+    started = time.perf_counter()
+    processed = 0
+
+    def report(label):
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(
+                f"{label}: rebuilt {stats['rebuilt']}, skipped {stats['skipped']}, "
+                f"missing {stats['missing']}, failed {stats['failed']}, limited {stats['limited']} "
+                f"({processed / elapsed if elapsed else 0:.1f} images/s)"
+            )
+
+    def collect(future, label):
+        try:
+            return future.result()
+        except FileNotFoundError:
+            stats['missing'] += 1
+        except Exception as exc:
+            stats['failed'] += 1
+            current_app.logger.warning('Image rebuild failed for %s: %s', label, exc)
+        return None
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context) as executor:
+        while True:
+            images = (ProductImage.query
+                      .filter(ProductImage.id > state['product_image_id'],
+                              ProductImage.processing_status == READY)
+                      .order_by(ProductImage.id)
+                      .limit(batch_size)
+                      .all())
+            if not images:
+                break
+
+            pending = []
+            for image in images:
+                if not image.image_path.startswith(UPLOADS_PREFIX) or \
+                        (not force and _is_current(image, static_root, spec)):
+                    stats['skipped'] += 1
+                    continue
+                if image.original_path:
+                    source_path = image.original_path
+                else:
+                    renditions = image.get_renditions()
+                    source_path = renditions['webp'][-1][1] if renditions.get('webp') else image.image_path
+                future = executor.submit(
+                    _rebuild_product_image, static_root, source_path,
+                    os.path.dirname(image.image_path), bool(image.original_path),
+                )
+                pending.append((image, future))
+
+            for image, future in pending:
+                metadata, limited = collect(future, image.image_path) or (None, False)
+                if not metadata or not metadata.get('webp'):
+                    continue
+                # A shortened ladder is as good as this image gets; don't rebuild it on every run
+                metadata['spec'] = spec
+                image.renditions = json.dumps(metadata)
+                image.image_path = metadata['webp'][-1][1]
+                stats['rebuilt'] += 1
+                if limited:
+                    stats['limited'] += 1
+
+            db.session.commit()
+            processed += len(images)
+            state['product_image_id'] = images[-1].id
+            _write_checkpoint(checkpoint_path, state)
+            db.session.expunge_all()
+            report(f'product images up to #{state["product_image_id"]}')
+
+        while True:
+            ads = (Ads.query
+                   .filter(Ads.id > state['ad_id'])
+                   .order_by(Ads.id)
+                   .limit(batch_size)
+                   .all())
+            if not ads:
+                break
+
+            pending = []
+            for ad in ads:
+                for image_type in AD_IMAGE_TYPES:
+                    image_path = getattr(ad, f'{image_type}_image')
+                    # Only files written by the upload pipeline are ours to re-render, and
+                    # a pending or failed upload's original is not what the banner shows
+                    if image_path and image_path.startswith(UPLOADS_PREFIX) and \
+                            getattr(ad, f'{image_type}_image_status') in (None, READY):
+                        future = executor.submit(
+                            _rebuild_ad_image, static_root, image_path,
+                            getattr(ad, f'{image_type}_original'), image_type, force_ads,
+                        )
+                        pending.append((image_path, future))
+
+            for image_path, future in pending:
+                rebuilt = collect(future, image_path)
+                if rebuilt == LIMITED:
+                    stats['limited'] += 1
+                elif rebuilt:
+                    stats['rebuilt'] += 1
+                elif rebuilt is False:
+                    stats['skipped'] += 1
+
+            processed += len(pending)
+            state['ad_id'] = ads[-1].id
+            _write_checkpoint(checkpoint_path, state)
+            db.session.expunge_all()
+            report(f'ads up to #{state["ad_id"]}')
+
+    if force_ads and not stats['failed']:
+        with open(ad_spec_path, 'w', encoding='utf-8') as handle:
+            handle.write(ad_spec)
+
+    # A finished run leaves nothing to resume
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed = time.perf_counter() - started
+    return dict(
+        stats,
+        resumed=resumed,
+        processed=processed,
+        seconds=elapsed,
+        per_second=processed / elapsed if elapsed else 0.0,
+    )
+
+
+def requeue_pending_images(min_age=900):
+    """Process uploads left pending by a stopped worker pool again, from their stored originals.
+
+    Jobs live only in the pool of the process that accepted the upload,
+    so a crash or restart leaves their product images and ad banners
+    pending. Those pending for longer than min_age seconds are submitted
+    again and this waits for them to finish; rows without an original
+    on disk are marked failed. Returns the number of each.
+    """
+    static_root = current_app.static_folder
+    queue = get_image_jobs()
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+
+    def stored(original_path):
+        return original_path and os.path.exists(os.path.join(static_root, original_path.replace('/', os.sep)))
+
+    jobs = []
+    failed = 0
+    images = ProductImage.query.filter(
+        ProductImage.processing_status == PENDING,
+        ProductImage.created_at <= cutoff,
+    ).all()
+    for image in images:
+        if stored(image.original_path):
+            jobs.append(queue.product_image_job(image))
+        else:
+            image.processing_status = FAILED
+            failed += 1
+
+    for image_type in AD_IMAGE_TYPES:
+        status = getattr(Ads, f'{image_type}_image_status')
+        for ad in Ads.query.filter(status == PENDING, Ads.updated_at <= cutoff).all():
+            if stored(getattr(ad, f'{image_type}_original')):
+                jobs.append(queue.ad_image_job(ad, image_type))
+            else:
+                setattr(ad, f'{image_type}_image_status', FAILED)
+                failed += 1
+
+    db.session.commit()
+    queue.submit(jobs)
+    queue.shutdown(wait=True)
+    return {'requeued': len(jobs), 'failed': failed}
+
+
+def _iter_upload_files(root: str):
+    """Yield (relative path, DirEntry) for every file below root, one directory at a time."""
+    stack = [(root, '')]
+    while stack:
+        directory, prefix = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative = f'{prefix}{entry.name}'
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, f'{relative}/'))
+                    elif entry.is_file(follow_symlinks=False):
+                        yield relative, entry
+        except FileNotFoundError:
+            continue
+
+
+def _referenced_upload_paths():
+    """Paths relative to the static folder referenced by product_images and ads, originals included (one query each)."""
+    referenced = set()
+
+    rows = db.session.execute(
+        db.select(ProductImage.image_path, ProductImage.renditions, ProductImage.original_path)
+        .execution_options(yield_per=2000)
+    )
+    for image_path, renditions, original_path in rows:
+        image = ProductImage(image_path=image_path, renditions=renditions)
+        referenced.update(image.get_file_paths())
+        if original_path:
+            referenced.add(original_path)
+        if not renditions:
+            # Uploads from before the rendition ladder keep prefixed siblings
+            directory, _, name = image_path.rpartition('/')
+            referenced.update(f'{directory}/{prefix}{name}' for prefix in LEGACY_RENDITION_PREFIXES)
+
+    rows = db.session.execute(
+        db.select(Ads.desktop_image, Ads.mobile_image, Ads.desktop_original, Ads.mobile_original)
+        .execution_options(yield_per=2000)
+    )
+    for paths in rows:
+        referenced.update(path for path in paths if path)
+
+    return {path.replace('\\', '/') for path in referenced}
+
+
+def _remove_empty_dirs(root: str, directories):
+    for directory in sorted(directories, key=len, reverse=True):
+        while os.path.normpath(directory) != os.path.normpath(root) and \
+                os.path.dirname(os.path.normpath(directory)) != os.path.normpath(root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                # Not empty (or already gone)
+                break
+            directory = os.path.dirname(directory)
+
+
+def gc_uploads(min_age=3600, dry_run=False, quarantine_dir=None, batch_size=500, progress=None):
+    """Delete or quarantine upload files that no product image or ad references.
+
+    The upload tree is streamed with os.scandir and diffed against the
+    paths referenced in product_images and ads. Files younger than
+    min_age seconds are kept, because in-flight image jobs write
+    renditions before their row points at them. Orphans are removed, or
+    moved under quarantine_dir with their relative path, in batches of
+    batch_size.
+    """
+    static_root = current_app.static_folder
+    uploads_root = os.path.join(static_root, UPLOADS_PREFIX.rstrip('/'))
+
+    started = time.perf_counter()
+    referenced = _referenced_upload_paths()
+    cutoff = time.time() - min_age
+
+    stats = {'scanned': 0, 'scanned_bytes': 0, 'orphans': 0, 'orphan_bytes': 0, 'recent': 0}
+    touched_dirs = set()
+    batch = []
+
+    def flush():
+        for relative, absolute in batch:
+            try:
+                if quarantine_dir:
+                    target = os.path.join(quarantine_dir, relative.replace('/', os.sep))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(absolute, target)
+                else:
+                    os.remove(absolute)
+            except FileNotFoundError:
+                continue
+            touched_dirs.add(os.path.dirname(absolute))
+        batch.clear()
+        if progress:
+            progress(f"{stats['orphans']} orphaned files ({stats['orphan_bytes'] / 1048576:.1f} MiB) "
+                     f"{'found' if dry_run else 'removed'} of {stats['scanned']} scanned")
+
+    for relative, entry in _iter_upload_files(uploads_root):
+        info = entry.stat(follow_symlinks=False)
+        stats['scanned'] += 1
+        stats['scanned_bytes'] += info.st_size
+
+        path = f'{UPLOADS_PREFIX}{relative}'
+        if path in referenced:
+            continue
+        if info.st_mtime > cutoff:
+            stats['recent'] += 1
+            continue
+
+        stats['orphans'] += 1
+        stats['orphan_bytes'] += info.st_size
+        if not dry_run:
+            batch.append((path, entry.path))
+            if len(batch) >= batch_size:
+                flush()
+
+    if batch or (progress and dry_run):
+        flush()
+    if not dry_run and touched_dirs:
+        _remove_empty_dirs(uploads_root, touched_dirs)
+
+    return dict(stats, referenced=len(referenced), seconds=time.perf_counter() - started)
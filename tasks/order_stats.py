@@ -0,0 +1,21 @@
+from app import db
+from models import User
+from models.order import Order
+
+
+def backfill_user_order_stats():
+    """Recompute users.order_count/first_order_at from the orders table."""
+    order_count = (db.select(db.func.count(Order.id))
+                   .where(Order.user_id == User.id)
+                   .scalar_subquery())
+    first_order_at = (db.select(db.func.min(Order.created_at))
+                      .where(Order.user_id == User.id)
+                      .scalar_subquery())
+
+    result = db.session.execute(
+        db.update(User)
+        .values(order_count=order_count, first_order_at=first_order_at)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
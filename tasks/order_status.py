@@ -3,7 +3,7 @@ from flask import current_app
 
 from app import db
 from models.order import Order
-from utils.ecpay import ECPayService, ECPAY_TEST_CONFIG
+from utils.ecpay import ECPayService, get_ecpay_service
 
 SUCCESS_CODES = {'1'}
 
@@ -30,7 +30,7 @@ def _query_gateway(order: Order, service: ECPayService):
 
 
 def sync_pending_orders(limit: int = 50):
-    service = ECPayService(**ECPAY_TEST_CONFIG)
+    service = get_ecpay_service()
     now = datetime.utcnow()
 
     pending = (Order.query
@@ -1,9 +1,9 @@
 from .image_utils import convert_to_webp, resize_image, generate_thumbnail, process_product_image, process_ad_image, allowed_file
 from .helpers import generate_slug, format_price, paginate_query, generate_order_number
-from .ecpay import ECPayService, ECPAY_TEST_CONFIG, ECPAY_PROD_CONFIG, ECPAY_TEST_CARDS, ECPAY_3D_VERIFICATION
+from .ecpay import ECPayService, init_ecpay_service, get_ecpay_service, ECPAY_TEST_CONFIG, ECPAY_PROD_CONFIG, ECPAY_TEST_CARDS, ECPAY_3D_VERIFICATION
 
 __all__ = [
     'convert_to_webp', 'resize_image', 'generate_thumbnail', 'process_product_image', 'process_ad_image', 'allowed_file',
     'generate_slug', 'format_price', 'paginate_query', 'generate_order_number',
-    'ECPayService', 'ECPAY_TEST_CONFIG', 'ECPAY_PROD_CONFIG', 'ECPAY_TEST_CARDS', 'ECPAY_3D_VERIFICATION'
+    'ECPayService', 'init_ecpay_service', 'get_ecpay_service', 'ECPAY_TEST_CONFIG', 'ECPAY_PROD_CONFIG', 'ECPAY_TEST_CARDS', 'ECPAY_3D_VERIFICATION'
 ]
@@ -0,0 +1,257 @@
+import atexit
+import glob
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam
+
+from database import db
+
+VIEW = 'v'
+CLICK = 'c'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class AdCounterBuffer:
+    """Buffer ad view/click counts in process and flush them to the ads table in batches.
+
+    Every event is appended to a per-process spool file before it is
+    counted, so counts survive a crash: spools left behind by dead
+    processes are claimed and flushed on the next start. Each batch file
+    has an id that survives being claimed. The id is recorded in
+    ad_counter_batches in the same transaction as the counter UPDATE, so
+    a batch whose file outlived its commit is dropped instead of being
+    counted again.
+    """
+
+    def __init__(self, app, spool_dir, flush_interval=10.0, flush_events=500):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.pid = os.getpid()
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._spool = None
+        self._pending_events = 0
+        self._worker = None
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._claim_orphaned_spools()
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f'ads-{self.pid}.spool')
+
+    def _batch_path(self, batch_id=None):
+        """ads-<pid>-<batch id>.batch; a new batch gets a random, globally unique id"""
+        return os.path.join(self.spool_dir, f'ads-{self.pid}-{batch_id or uuid.uuid4().hex}.batch')
+
+    @staticmethod
+    def _batch_id(path):
+        return os.path.basename(path)[:-len('.batch')].split('-', 2)[2]
+
+    def _claim_orphaned_spools(self):
+        """Take over spool/batch files written by processes that are no longer running"""
+        for path in glob.glob(os.path.join(self.spool_dir, 'ads-*')):
+            owner = os.path.basename(path)[4:].split('.')[0].split('-')[0]
+            if not owner.isdigit() or int(owner) == self.pid or _pid_alive(int(owner)):
+                continue
+            # A batch keeps its id, so one that was already applied is still recognized
+            # (files named before batch ids existed were never recorded and get a fresh one)
+            batch_id = self._batch_id(path) if path.endswith('.batch') else None
+            if batch_id is not None and len(batch_id) != 32:
+                batch_id = None
+            try:
+                os.replace(path, self._batch_path(batch_id))
+            except FileNotFoundError:
+                # Another process claimed it first
+                continue
+
+    def record(self, ad_id, kind):
+        """Record one view or click; never touches the database"""
+        self._ensure_worker()
+        with self._lock:
+            if self._spool is None:
+                self._spool = open(self._spool_path(), 'a', encoding='ascii')
+            self._spool.write(f'{kind} {int(ad_id)}\n')
+            self._spool.flush()
+            self._pending_events += 1
+            due = self._pending_events >= self.flush_events
+
+        if due:
+            self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive() and self.pid == os.getpid():
+            return
+        with self._lock:
+            if self.pid != os.getpid():
+                # Forked after the buffer was created; start a fresh spool for this process
+                self.pid = os.getpid()
+                self._spool = None
+                self._pending_events = 0
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='ad-counter-flush', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                self.app.logger.warning('Ad counter flush failed, will retry: %s', exc)
+
+    def _rotate(self):
+        with self._lock:
+            if self._spool is None:
+                return
+            self._spool.close()
+            self._spool = None
+            self._pending_events = 0
+            os.replace(self._spool_path(), self._batch_path())
+
+    def flush(self):
+        """Apply all spooled events with one batched UPDATE; returns the number of ads updated"""
+        with self._flush_lock:
+            self._rotate()
+
+            batches = sorted(glob.glob(os.path.join(self.spool_dir, f'ads-{self.pid}-*.batch')))
+            if not batches:
+                return 0
+
+            from models import Ads, AdCounterBatch
+
+            batch_ids = {path: self._batch_id(path) for path in batches}
+            with self.app.app_context():
+                applied = set(db.session.execute(
+                    db.select(AdCounterBatch.id).where(AdCounterBatch.id.in_(list(batch_ids.values())))
+                ).scalars())
+
+                deltas = {}
+                for path in batches:
+                    if batch_ids[path] in applied:
+                        # Committed before a crash removed the file
+                        continue
+                    with open(path, encoding='ascii') as handle:
+                        for line in handle:
+                            parts = line.split()
+                            if len(parts) != 2 or not parts[1].isdigit():
+                                continue
+                            counts = deltas.setdefault(int(parts[1]), [0, 0])
+                            counts[0 if parts[0] == VIEW else 1] += 1
+
+                new_ids = [batch_id for batch_id in batch_ids.values() if batch_id not in applied]
+                if new_ids:
+                    ads = Ads.__table__
+                    statement = (
+                        ads.update()
+                        .where(ads.c.id == bindparam('ad_id'))
+                        .values(
+                            view_count=db.func.coalesce(ads.c.view_count, 0) + bindparam('views'),
+                            click_count=db.func.coalesce(ads.c.click_count, 0) + bindparam('clicks'),
+                        )
+                    )
+                    rows = [
+                        {'ad_id': ad_id, 'views': views, 'clicks': clicks}
+                        for ad_id, (views, clicks) in deltas.items()
+                    ]
+                    now = datetime.utcnow()
+                    try:
+                        if rows:
+                            db.session.execute(statement, rows)
+                        db.session.execute(
+                            AdCounterBatch.__table__.insert(),
+                            [{'id': batch_id, 'applied_at': now} for batch_id in new_ids],
+                        )
+                        # Leftover files are claimed on the next start, long before this
+                        db.session.execute(
+                            AdCounterBatch.__table__.delete().where(
+                                AdCounterBatch.applied_at < now - timedelta(days=7)
+                            )
+                        )
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        raise
+
+            for path in batches:
+                os.remove(path)
+            return len(deltas)
+
+
+def init_ad_counters(app):
+    """Create the ad counter buffer for this app"""
+    spool_dir = app.config.get('AD_COUNTER_SPOOL_DIR') or os.path.join(app.instance_path, 'ad_counters')
+    buffer = AdCounterBuffer(
+        app,
+        spool_dir,
+        flush_interval=app.config.get('AD_COUNTER_FLUSH_INTERVAL', 10),
+        flush_events=app.config.get('AD_COUNTER_FLUSH_EVENTS', 500),
+    )
+    app.extensions['ad_counters'] = buffer
+
+    def _flush_on_exit():
+        try:
+            buffer.flush()
+        except Exception:
+            # Events stay spooled and are replayed on next start
+            pass
+
+    atexit.register(_flush_on_exit)
+    return buffer
+
+
+def get_ad_counters():
+    return current_app.extensions['ad_counters']
+
+
+def record_ad_view(ad_id):
+    get_ad_counters().record(ad_id, VIEW)
+
+
+def record_ad_click(ad_id):
+    get_ad_counters().record(ad_id, CLICK)
+
+
+# (kind, client, ad id) -> monotonic time of the last counted event
+_recent_events = OrderedDict()
+_recent_events_lock = threading.Lock()
+
+
+def is_repeat_event(kind, client, ad_id):
+    """True if this client's view/click of ad_id was already counted within the dedupe window.
+
+    Views use AD_VIEW_DEDUPE_SECONDS and clicks AD_CLICK_DEDUPE_SECONDS.
+    """
+    setting = 'AD_VIEW_DEDUPE_SECONDS' if kind == VIEW else 'AD_CLICK_DEDUPE_SECONDS'
+    window = current_app.config.get(setting, 300 if kind == VIEW else 1800)
+    max_entries = current_app.config.get('AD_DEDUPE_SIZE', 100000)
+    now = time.monotonic()
+    key = (kind, client, ad_id)
+    with _recent_events_lock:
+        last = _recent_events.get(key)
+        if last is not None and now - last < window:
+            return True
+        _recent_events[key] = now
+        _recent_events.move_to_end(key)
+        while len(_recent_events) > max_entries:
+            _recent_events.popitem(last=False)
+    return False
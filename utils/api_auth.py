@@ -0,0 +1,50 @@
+from functools import wraps
+
+from flask import current_app, g, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+from utils.helpers import error_response
+
+TOKEN_SALT = 'api-token'
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt=TOKEN_SALT)
+
+
+def issue_api_token(user):
+    """Signed bearer token for the JSON API; valid for API_TOKEN_MAX_AGE seconds or until revoked.
+
+    It carries the user's token_version, so User.revoke_api_tokens() (also
+    run by set_password) invalidates it.
+    """
+    return _serializer().dumps({'uid': user.id, 'tv': user.token_version or 0})
+
+
+def _user_from_token(token):
+    from models import User
+
+    try:
+        payload = _serializer().loads(token, max_age=current_app.config.get('API_TOKEN_MAX_AGE', 2592000))
+    except (SignatureExpired, BadSignature):
+        return None
+    if not isinstance(payload, dict):
+        return None
+    user = User.get_snapshot(payload.get('uid'))
+    if user is None or not user.is_active or payload.get('tv', 0) != user.token_version:
+        return None
+    return user
+
+
+def token_required(func):
+    """Decorator to require an `Authorization: Bearer <token>` header; the user is g.api_user"""
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        user = _user_from_token(token.strip()) if scheme.lower() == 'bearer' and token else None
+        if user is None:
+            return error_response('Valid API token required', 401)
+        g.api_user = user
+        return func(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import threading
+
+from flask import abort, current_app, request, send_from_directory, url_for
+
+# Seconds a fingerprinted asset may be cached; its URL changes whenever its content does
+ASSET_MAX_AGE = 31536000
+
+_ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+class AssetManifest:
+    """Fingerprinted asset lookups backed by the manifest written by `flask assets build`."""
+
+    def __init__(self, output_dir, auto_reload=False):
+        self.output_dir = output_dir
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.version = None
+        self._assets = {}
+        self._by_path = {}
+        self._load()
+
+    def _manifest_path(self):
+        return os.path.join(self.output_dir, 'manifest.json')
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self._manifest_path())
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            assets = {}
+            if mtime is not None:
+                try:
+                    with open(self._manifest_path(), encoding='utf-8') as handle:
+                        assets = json.load(handle).get('assets', {})
+                except (OSError, ValueError):
+                    assets = {}
+            self._assets = assets
+            self.version = hashlib.sha256(json.dumps(assets, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+            self._by_path = {entry['path']: entry for entry in assets.values()}
+            self._mtime = mtime
+
+    def lookup(self, logical_path):
+        if self.auto_reload:
+            self._load()
+        return self._assets.get(logical_path)
+
+    def entry_for_file(self, path):
+        if self.auto_reload:
+            self._load()
+        return self._by_path.get(path)
+
+
+def asset_url(filename):
+    """URL of the fingerprinted build of a static asset, or the plain static URL if it has not been built"""
+    entry = current_app.extensions['assets'].lookup(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=entry['path'])
+
+
+def serve_asset(filename):
+    """Serve a fingerprinted asset, preferring a precompressed variant the client accepts"""
+    manifest = current_app.extensions['assets']
+    entry = manifest.entry_for_file(filename)
+    if entry is None:
+        abort(404)
+
+    offered = [encoding for encoding in entry.get('encodings', ()) if encoding in _ENCODING_SUFFIXES]
+    encoding = request.accept_encodings.best_match(offered + ['identity'], default='identity')
+
+    mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+    if encoding in _ENCODING_SUFFIXES:
+        response = send_from_directory(manifest.output_dir, filename + _ENCODING_SUFFIXES[encoding], mimetype=mimetype)
+        response.content_encoding = encoding
+    else:
+        response = send_from_directory(manifest.output_dir, filename, mimetype=mimetype)
+
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = ASSET_MAX_AGE
+    response.cache_control.immutable = True
+    response.cache_control.no_cache = None
+    return response
+
+
+def init_assets(app):
+    """Register the fingerprinted asset route and the asset_url template helper"""
+    output_dir = app.config.get('ASSETS_OUTPUT_DIR') or os.path.join(app.static_folder, 'dist')
+    app.extensions['assets'] = AssetManifest(output_dir, auto_reload=app.debug)
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.add_template_global(asset_url)
@@ -1,10 +1,20 @@
 import hashlib
+import hmac
 import urllib.parse
+from functools import lru_cache
 from urllib.parse import parse_qsl
 import time
 from datetime import datetime
 import json
 import requests
+from flask import current_app
+
+CHECK_MAC_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=CHECK_MAC_CACHE_SIZE)
+def _encode_component(value):
+    """URL encode 並轉小寫; 參數名稱與常見參數值會重複出現, 結果直接快取"""
+    return urllib.parse.quote_plus(value).lower()
 
 class ECPayService:
     """綠界電子金流服務"""
@@ -22,29 +32,25 @@ class ECPayService:
         else:
             self.api_url = "https://payment.ecpay.com.tw/Cashier/AioCheckOut/V5"
             self.query_url = "https://payment.ecpay.com.tw/Cashier/QueryTradeInfo/V5"
+        
+        # HashKey/HashIV 前後綴固定, 預先 URL encode (quote_plus 逐字元編碼, 可分段串接)
+        self._mac_prefix = _encode_component(f"HashKey={hash_key}&")
+        self._mac_suffix = _encode_component(f"&HashIV={hash_iv}")
     
     def generate_check_mac_value(self, params):
         """產生檢查碼"""
-        # 移除 CheckMacValue 參數
-        if 'CheckMacValue' in params:
-            del params['CheckMacValue']
-        
-        # 參數排序
-        sorted_params = sorted(params.items())
-        
-        # 組合參數字串
-        query_string = '&'.join([f"{key}={value}" for key, value in sorted_params])
+        # 參數排序 (略過 CheckMacValue, 不修改傳入的 dict)
+        # 逐一編碼參數名稱與值再組合, '=' 與 '&' 編碼後為 %3d 與 %26
+        query_string = '%26'.join([
+            f"{_encode_component(key)}%3d{_encode_component(str(value))}"
+            for key, value in sorted(params.items()) if key != 'CheckMacValue'
+        ])
         
         # 加上 HashKey 和 HashIV
-        query_string = f"HashKey={self.hash_key}&{query_string}&HashIV={self.hash_iv}"
-        
-        # URL encode
-        query_string = urllib.parse.quote_plus(query_string).lower()
+        query_string = self._mac_prefix + query_string + self._mac_suffix
         
         # 產生 SHA256 雜湊
-        check_mac_value = hashlib.sha256(query_string.encode('utf-8')).hexdigest().upper()
-        
-        return check_mac_value
+        return hashlib.sha256(query_string.encode('utf-8')).hexdigest().upper()
     
     def create_order(self, order_data):
         """建立訂單"""
@@ -86,7 +92,7 @@ class ECPayService:
             "MerchantTradeNo": merchant_trade_no,
             "TimeStamp": int(time.time()),
         }
-        payload["CheckMacValue"] = self.generate_check_mac_value(payload.copy())
+        payload["CheckMacValue"] = self.generate_check_mac_value(payload)
 
         response = requests.post(self.query_url, data=payload, timeout=30)
         response.raise_for_status()
@@ -97,9 +103,9 @@ class ECPayService:
     def verify_check_mac_value(self, params):
         """驗證檢查碼"""
         received_check_mac = params.get('CheckMacValue', '')
-        calculated_check_mac = self.generate_check_mac_value(params.copy())
+        calculated_check_mac = self.generate_check_mac_value(params)
         
-        return received_check_mac == calculated_check_mac
+        return hmac.compare_digest(received_check_mac.encode('utf-8'), calculated_check_mac.encode('utf-8'))
     
     def format_trade_date(self, date_obj=None):
         """格式化交易日期"""
@@ -128,6 +134,29 @@ ECPAY_PROD_CONFIG = {
     'is_test': False
 }
 
+def init_ecpay_service(app):
+    """依 app 設定建立共用的 ECPayService"""
+    mode = (app.config.get('ECPAY_MODE') or 'test').lower()
+    settings = dict(ECPAY_PROD_CONFIG if mode in ('prod', 'production') else ECPAY_TEST_CONFIG)
+    
+    overrides = {
+        'merchant_id': app.config.get('ECPAY_MERCHANT_ID'),
+        'hash_key': app.config.get('ECPAY_HASH_KEY'),
+        'hash_iv': app.config.get('ECPAY_HASH_IV'),
+    }
+    settings.update({key: value for key, value in overrides.items() if value})
+    
+    if not all([settings['merchant_id'], settings['hash_key'], settings['hash_iv']]):
+        raise RuntimeError(f'ECPay {mode} mode requires ECPAY_MERCHANT_ID, ECPAY_HASH_KEY and ECPAY_HASH_IV')
+    
+    service = ECPayService(**settings)
+    app.extensions['ecpay'] = service
+    return service
+
+def get_ecpay_service():
+    """取得目前 app 的 ECPayService"""
+    return current_app.extensions['ecpay']
+
 # 測試信用卡資料 (根據綠界官方測試資料)
 ECPAY_TEST_CARDS = {
     'domestic': {
@@ -0,0 +1,83 @@
+import csv
+import io
+
+from flask import current_app, stream_with_context
+
+from database import db
+
+
+def iter_keyset(statement, key_column, batch_size=500, scalars=False):
+    """Yield the rows of statement in lists of batch_size, ordered by key_column.
+
+    Each batch seeks past the last key (WHERE key > :last ORDER BY key
+    LIMIT n) instead of using OFFSET, so every batch costs the same
+    index range scan however deep the export is, and only one batch is
+    held in memory at a time. key_column must be unique.
+    """
+    last_key = None
+    while True:
+        page = statement.order_by(key_column).limit(batch_size)
+        if last_key is not None:
+            page = page.where(key_column > last_key)
+        result = db.session.execute(page.execution_options(yield_per=batch_size))
+        batch = result.scalars().all() if scalars else result.all()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last_key = getattr(batch[-1], key_column.key)
+
+
+def _stream(chunks, mimetype, filename=None):
+    response = current_app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    if filename:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # Exports are built per request and can be large; don't let proxies buffer or keep them
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.cache_control.no_store = True
+    return response
+
+
+def ndjson_response(batches, dump_many, filename=None):
+    """Stream one JSON document per line; dump_many turns a batch into a list of dicts"""
+    def generate():
+        dumps = current_app.json.dumps
+        for batch in batches:
+            yield ''.join(dumps(item) + '\n' for item in dump_many(batch))
+
+    return _stream(generate(), 'application/x-ndjson', filename)
+
+
+# Cells starting with these are run as formulas by spreadsheet apps
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_safe(value):
+    """Quote a text cell that a spreadsheet would treat as a formula (e.g. =HYPERLINK(...))"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def csv_response(header, batches, to_row, filename=None):
+    """Stream a CSV file: the header row, then to_row(row) for every row of every batch.
+
+    The file starts with a UTF-8 BOM so Excel reads non-ASCII names correctly.
+    to_row should pass customer-entered text through csv_safe().
+    """
+    def generate():
+        buffer = io.StringIO()
+        buffer.write('\ufeff')
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for batch in batches:
+            writer.writerows(to_row(row) for row in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # Header only, when nothing matched
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return _stream(generate(), 'text/csv', filename)
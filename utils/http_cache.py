@@ -0,0 +1,154 @@
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+from flask import current_app, make_response, request
+from flask_login import current_user
+
+from database import db
+
+
+@dataclass(frozen=True)
+class RowsFingerprint:
+    """(max(updated_at), count, id set) of the rows a response is built from"""
+    last_modified: Optional[datetime]
+    count: int
+    digest: str
+
+
+@dataclass(frozen=True)
+class Validator:
+    """ETag/Last-Modified pair for one response; private responses vary per user"""
+    etag: str
+    last_modified: Optional[datetime] = None
+    private: bool = False
+
+
+def fingerprint(rows):
+    """Fingerprint (id, updated_at, *extra) rows that have already been fetched"""
+    digest = hashlib.blake2b(digest_size=12)
+    last_modified = None
+    count = 0
+    for row in rows:
+        count += 1
+        updated_at = row[1]
+        if updated_at is not None and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+        digest.update(repr((row[0],) + tuple(row[2:])).encode('utf-8'))
+    return RowsFingerprint(last_modified, count, digest.hexdigest())
+
+
+def fingerprint_rows(statement):
+    """Fingerprint a select returning (id, updated_at, *extra) rows.
+
+    Only the id and timestamp columns (plus any extra columns that change
+    without touching updated_at) are fetched, never full entities, so
+    this stays far cheaper than rendering the rows.
+    """
+    return fingerprint(db.session.execute(statement))
+
+
+def categories_fingerprint():
+    """All categories; the tree is small and shapes navigation, breadcrumbs and listings"""
+    from models import Category
+
+    return fingerprint_rows(
+        db.select(Category.id, Category.updated_at, Category.parent_id, Category.is_active, Category.sort_order)
+        .order_by(Category.id)
+    )
+
+
+def product_images_fingerprint(product_ids):
+    """Images of the given products; rows have no updated_at, so their mutable columns are hashed"""
+    from models.product import ProductImage
+
+    return fingerprint_rows(
+        db.select(
+            ProductImage.id,
+            ProductImage.created_at,
+            ProductImage.product_id,
+            ProductImage.image_path,
+            ProductImage.processing_status,
+            ProductImage.is_primary,
+            ProductImage.sort_order,
+            ProductImage.alt_text,
+        )
+        .where(ProductImage.product_id.in_(list(product_ids)))
+        .order_by(ProductImage.id)
+    )
+
+
+def _user_parts():
+    from models import WishList
+
+    if not current_user.is_authenticated:
+        return ('anonymous',)
+    # The cached id set, not its version: versions are per process
+    wishlist = tuple(sorted(WishList.get_product_ids(current_user.id)))
+    return ('user', current_user.id, current_user.updated_at, wishlist)
+
+
+def build_validator(*parts, user_scoped=False):
+    """Combine fingerprints and other values into a Validator.
+
+    user_scoped responses also depend on who is logged in and on their
+    wishlist (pages with the navbar and wishlist buttons), so their ETag
+    includes both and they are never given a Last-Modified date.
+    """
+    fingerprints = [part for part in parts if isinstance(part, RowsFingerprint)]
+    dates = [fingerprint.last_modified for fingerprint in fingerprints if fingerprint.last_modified]
+    last_modified = max(dates) if dates else None
+
+    key = [current_app.config.get('HTTP_CACHE_VERSION'), request.full_path, parts]
+    assets = current_app.extensions.get('assets')
+    if assets is not None:
+        # Rendered pages embed the fingerprinted asset URLs
+        key.append(assets.version)
+    if user_scoped:
+        key.append(_user_parts())
+
+    etag = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+    return Validator(etag, None if user_scoped else last_modified, private=user_scoped)
+
+
+def _as_http_date(value):
+    # Columns hold naive UTC; HTTP dates have one-second resolution
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+def _is_fresh(validator):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    # If-Modified-Since alone is not trusted: removing a row from a listing
+    # changes the ETag's count and id set but not max(updated_at)
+    return bool(request.if_none_match) and request.if_none_match.contains_weak(validator.etag)
+
+
+def _apply_validator(response, validator):
+    response.set_etag(validator.etag, weak=True)
+    if validator.last_modified:
+        response.last_modified = _as_http_date(validator.last_modified)
+    # Caches may keep the body but must revalidate it on every use
+    response.cache_control.no_cache = True
+    if validator.private:
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+    else:
+        response.cache_control.public = True
+
+
+def conditional_response(validator, build):
+    """Answer 304 Not Modified when the client's copy matches, otherwise build the response.
+
+    build is only called on a miss, so templates are not rendered and
+    JSON is not serialized for a revalidation.
+    """
+    if _is_fresh(validator):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    _apply_validator(response, validator)
+    return response
@@ -0,0 +1,255 @@
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from flask import current_app
+
+from database import db
+from utils.image_utils import (
+    ad_image_target,
+    allowed_file,
+    delete_image,
+    product_image_target,
+    read_upload,
+    render_ad_image,
+    render_product_image,
+    save_original,
+)
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+
+@dataclass(frozen=True)
+class ImageJob:
+    """A stored original waiting to be turned into its renditions"""
+    kind: str  # product, ad
+    original_path: str  # relative to the static folder
+    source: str  # absolute path of the original
+    upload_dir: str
+    filename: str
+    relative_path: str
+    owner_id: int  # product id or ad id
+    image_type: Optional[str] = None  # desktop, mobile (ads only)
+
+
+class ImageJobQueue:
+    """Hand uploaded images to a local process pool and record the outcome in the database.
+
+    Uploads are read into memory, header-checked and stored as originals
+    (see save_original) inside the request, and the rows that reference
+    them are committed before any job is submitted. Workers read the
+    original from disk, so an upload outlives a crash or restart of the
+    pool and can be rendered again later.
+    """
+
+    def __init__(self, app, workers=None, run_async=True):
+        self.app = app
+        self.workers = workers or os.cpu_count() or 1
+        self.run_async = run_async
+
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers do not inherit the parent's DB connections or threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _store(self, file):
+        """Check an upload and keep it as an original; returns (relative path, absolute path)"""
+        if not allowed_file(file.filename):
+            raise ValueError('Invalid file type')
+        data = read_upload(file, self.app.config.get('IMAGE_MAX_PIXELS'))
+        source, original_path = save_original(data, file.filename)
+        return original_path, source
+
+    def prepare_product_image(self, file, product_id, sort_order=0):
+        """Check and store an uploaded product image and return its job"""
+        original_path, source = self._store(file)
+        upload_dir, filename = product_image_target(file.filename, product_id, sort_order)
+        return ImageJob(
+            kind='product',
+            original_path=original_path,
+            source=source,
+            upload_dir=os.path.abspath(upload_dir),
+            filename=filename,
+            relative_path='/'.join(['uploads', 'products', str(product_id), filename]),
+            owner_id=product_id,
+        )
+
+    def prepare_ad_image(self, file, ad_id, image_type='desktop'):
+        """Check and store an uploaded ad image and return its job"""
+        original_path, source = self._store(file)
+        upload_dir, filename = ad_image_target(file.filename, ad_id, image_type)
+        return ImageJob(
+            kind='ad',
+            original_path=original_path,
+            source=source,
+            upload_dir=os.path.abspath(upload_dir),
+            filename=filename,
+            relative_path='/'.join(['uploads', 'ads', str(ad_id), filename]),
+            owner_id=ad_id,
+            image_type=image_type,
+        )
+
+    def _stored_job(self, kind, original_path, upload_dir, filename, relative_path, owner_id, image_type=None):
+        return ImageJob(
+            kind=kind,
+            original_path=original_path,
+            source=os.path.join(self.app.static_folder, original_path.replace('/', os.sep)),
+            upload_dir=os.path.abspath(upload_dir),
+            filename=filename,
+            relative_path=relative_path,
+            owner_id=owner_id,
+            image_type=image_type,
+        )
+
+    def product_image_job(self, image):
+        """Job that renders a pending product image again from its stored original"""
+        directory, _, filename = image.image_path.rpartition('/')
+        return self._stored_job(
+            'product', image.original_path,
+            os.path.join(self.app.static_folder, directory.replace('/', os.sep)),
+            filename, image.image_path, image.product_id,
+        )
+
+    def ad_image_job(self, ad, image_type):
+        """Job that renders an ad banner again from its stored original"""
+        original_path = getattr(ad, f'{image_type}_original')
+        upload_dir, filename = ad_image_target(os.path.basename(original_path), ad.id, image_type)
+        return self._stored_job(
+            'ad', original_path, upload_dir, filename,
+            '/'.join(['uploads', 'ads', str(ad.id), filename]), ad.id, image_type,
+        )
+
+    def submit(self, jobs):
+        """Start processing prepared uploads; call only after the referencing rows are committed"""
+        for job in jobs:
+            if job.kind == 'product':
+                args = (render_product_image, job.source, job.upload_dir, os.path.dirname(job.relative_path))
+            else:
+                args = (render_ad_image, job.source, job.upload_dir, job.filename, job.image_type)
+
+            if not self.run_async:
+                try:
+                    result = args[0](*args[1:])
+                except Exception as exc:
+                    self.app.logger.warning('Image processing failed for %s: %s', job.relative_path, exc)
+                    result = None
+                self._complete(job, result)
+                continue
+
+            future = self._get_executor().submit(*args)
+            future.add_done_callback(lambda future, job=job: self._on_done(job, future))
+
+    def _on_done(self, job, future):
+        try:
+            result = future.result()
+        except Exception as exc:
+            self.app.logger.warning('Image processing failed for %s: %s', job.relative_path, exc)
+            result = None
+        try:
+            self._complete(job, result)
+        except Exception as exc:
+            self.app.logger.error('Could not record image result for %s: %s', job.relative_path, exc)
+
+    def _complete(self, job, result):
+        """Record a finished job; result is the rendition metadata (products) or a success flag (ads)"""
+        applied = False
+        with self.app.app_context():
+            try:
+                if job.kind == 'product':
+                    self._complete_product_image(job, result)
+                else:
+                    applied = self._complete_ad_image(job, result)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        if applied:
+            from models import Ads
+            Ads.invalidate_slot_index()
+
+    def _complete_product_image(self, job, renditions):
+        from models import ProductImage
+
+        if renditions and renditions.get('webp'):
+            # The pending placeholder path becomes the largest WebP rendition
+            values = {
+                'image_path': renditions['webp'][-1][1],
+                'renditions': json.dumps(renditions),
+                'processing_status': READY,
+            }
+        else:
+            values = {'processing_status': FAILED}
+
+        images = ProductImage.__table__
+        db.session.execute(
+            images.update()
+            .where(
+                images.c.product_id == job.owner_id,
+                images.c.image_path == job.relative_path,
+            )
+            .values(**values)
+        )
+
+    def _complete_ad_image(self, job, rendered):
+        """Point the ad at its new banner, or mark the upload failed; returns whether the ad changed"""
+        from models import Ads
+
+        column = f'{job.image_type}_image'
+        ad = db.session.get(Ads, job.owner_id)
+        # The ad records the original of its latest upload; any other job was superseded
+        # (or the ad deleted) while it ran, and its result must not replace the newer one
+        if ad is None or getattr(ad, f'{job.image_type}_original') != job.original_path:
+            if rendered:
+                delete_image(os.path.join(job.upload_dir, job.filename))
+            return False
+
+        if not rendered:
+            setattr(ad, f'{job.image_type}_image_status', FAILED)
+            return False
+
+        previous = getattr(ad, column)
+        setattr(ad, column, job.relative_path)
+        setattr(ad, f'{job.image_type}_image_status', READY)
+        if previous and previous != job.relative_path:
+            delete_image(os.path.join(self.app.root_path, 'static', previous.replace('/', os.sep)))
+        return True
+
+
+def init_image_jobs(app):
+    """Create the image processing queue for this app"""
+    queue = ImageJobQueue(
+        app,
+        workers=app.config.get('IMAGE_WORKERS'),
+        run_async=app.config.get('IMAGE_PROCESSING_ASYNC', True),
+    )
+    app.extensions['image_jobs'] = queue
+
+    # Let queued conversions finish before the process exits
+    atexit.register(queue.shutdown)
+    return queue
+
+
+def get_image_jobs():
+    return current_app.extensions['image_jobs']
@@ -1,8 +1,29 @@
+import hashlib
+import io
 import os
-from PIL import Image
+import re
+import tempfile
+from flask import Request, abort, current_app, has_app_context, request, url_for
+from markupsafe import Markup
+from PIL import Image, UnidentifiedImageError, features
 from werkzeug.utils import secure_filename
 from config import Config
 
+# Pillow save options per rendition format; quality comes from Config.IMAGE_QUALITY
+IMAGE_FORMAT_OPTIONS = {
+    'avif': {'format': 'AVIF', 'mime': 'image/avif', 'params': {'speed': 6}},
+    'webp': {'format': 'WEBP', 'mime': 'image/webp', 'params': {}},
+}
+
+# Content-hashed rendition file names, e.g. 3f2a9c0d1e4b5a6c7d8e.webp
+HASHED_RENDITION_RE = re.compile(r'^[0-9a-f]{20}\.(?:avif|webp)$')
+
+# Derivatives written next to images uploaded before the rendition ladder
+LEGACY_RENDITION_PREFIXES = ('thumb_', 'medium_')
+
+# Uploaded files as received, kept under the uploads folder; never served
+ORIGINALS_DIR = 'originals'
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
@@ -60,45 +81,243 @@ def generate_thumbnail(image_path, output_path, size=Config.THUMBNAIL_SIZE, qual
     """Generate thumbnail from image"""
     return resize_image(image_path, output_path, size, quality)
 
-def process_product_image(file, product_id, is_primary=False, sort_order=0):
-    """Process and save product image"""
-    if not allowed_file(file.filename):
-        return None, "Invalid file type"
+def product_image_target(filename, product_id, sort_order=0):
+    """Return (upload_dir, webp_filename) for a product image upload"""
+    upload_dir = os.path.join(Config.UPLOAD_FOLDER, 'products', str(product_id))
+    name = os.path.splitext(secure_filename(filename))[0]
+    return upload_dir, f"{name}_{sort_order}_{int(time.time())}.webp"
+
+def ad_image_target(filename, ad_id, image_type='desktop'):
+    """Return (upload_dir, webp_filename) for an advertisement image upload"""
+    upload_dir = os.path.join(Config.UPLOAD_FOLDER, 'ads', str(ad_id))
+    name = os.path.splitext(secure_filename(filename))[0]
+    return upload_dir, f"{image_type}_{name}_{int(time.time())}.webp"
+
+def _to_rgb(img):
+    """Flatten transparency onto white and convert to RGB"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def _open(source):
+    """Open an image from a path or from in-memory bytes"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+def _max_pixels():
+    if has_app_context():
+        return current_app.config.get('IMAGE_MAX_PIXELS', Config.IMAGE_MAX_PIXELS)
+    return Config.IMAGE_MAX_PIXELS
+
+def check_image_header(source, max_pixels=None):
+    """Read only the image header and reject non-images and oversize pixel dimensions.
     
+    Raises ValueError; no pixel data is decoded.
+    """
+    max_pixels = max_pixels or _max_pixels()
     try:
-        # Create directory if it doesn't exist
-        upload_dir = os.path.join(Config.UPLOAD_FOLDER, 'products', str(product_id))
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{name}_{sort_order}_{int(time.time())}{ext}"
-        
-        # Save original file
-        original_path = os.path.join(upload_dir, unique_filename)
-        file.save(original_path)
+        with _open(source) as img:
+            width, height = img.size
+    except (UnidentifiedImageError, OSError):
+        raise ValueError('Invalid image file')
+    if width * height > max_pixels:
+        raise ValueError(f'Image is too large ({width}x{height} pixels)')
+    return width, height
+
+def read_upload(file, max_pixels=None):
+    """Read an uploaded image into memory after checking its header"""
+    data = file.stream.read()
+    check_image_header(data, max_pixels)
+    return data
+
+def save_original(data, filename):
+    """Store uploaded bytes as ``uploads/originals/<content hash>.<ext>``.
+    
+    Returns (absolute path, path relative to the static folder).
+    Renditions are made from this file, both by the upload job and by
+    `flask images rebuild`, so re-rendering never starts from an earlier
+    lossy output.
+    """
+    ext = filename.rsplit('.', 1)[1].lower()
+    name = f"{hashlib.sha256(data).hexdigest()[:20]}.{ext}"
+    upload_dir = os.path.join(Config.UPLOAD_FOLDER, ORIGINALS_DIR)
+    path = os.path.join(upload_dir, name)
+    os.makedirs(upload_dir, exist_ok=True)
+    # Same name means same bytes; refresh the mtime so `images gc` treats it as new
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        _write_atomic(path, data)
+    return os.path.abspath(path), f"uploads/{ORIGINALS_DIR}/{name}"
+
+def _decode(source, largest, max_pixels=None):
+    """Decode an image once, letting JPEG skip DCT detail that the largest output would discard"""
+    with _open(source) as img:
+        # Guard again in the worker: the header is all that has been read so far
+        if img.width * img.height > (max_pixels or _max_pixels()):
+            raise ValueError(f'Image is too large ({img.width}x{img.height} pixels)')
+        img.draft('RGB', largest)
+        bitmap = _to_rgb(img)
+        bitmap.load()
+    return bitmap
+
+def _cascade(bitmap, sizes):
+    """Yield the bitmap fitted inside each bounding box, resizing each from the previous one.
+    
+    ``sizes`` must be ordered largest first; images are never upscaled.
+    """
+    previous = bitmap
+    for size in sizes:
+        # Resize from the previous rendition when it is at least as large as this one will be
+        scale = min(1.0, size[0] / bitmap.width, size[1] / bitmap.height)
+        resized = previous if previous.width >= round(bitmap.width * scale) else bitmap
+        if resized.width > size[0] or resized.height > size[1]:
+            resized = resized.copy()
+            resized.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        previous = resized
+        yield size, resized
+
+def _write_atomic(path, data):
+    """Write bytes under a temporary name and rename, so readers never see a partial file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+
+def render_renditions(source, upload_dir, webp_filename, renditions, quality=None):
+    """Decode an image (path or bytes) once and write every rendition as WebP.
+    
+    ``renditions`` maps a name to ``{'prefix', 'size', 'pad'}``: each output
+    is ``<prefix><webp_filename>`` fitted inside ``size``, padded onto a
+    white canvas of exactly that size when ``pad`` is set.
+    """
+    quality = quality or Config.IMAGE_QUALITY['webp']
+    specs = sorted(renditions.values(), key=lambda spec: spec['size'][0] * spec['size'][1], reverse=True)
+    bitmap = _decode(source, specs[0]['size'])
+    
+    encoded = []
+    for spec, (size, resized) in zip(specs, _cascade(bitmap, [tuple(spec['size']) for spec in specs])):
+        output = resized
+        if spec.get('pad'):
+            output = Image.new('RGB', size, (255, 255, 255))
+            output.paste(resized, ((size[0] - resized.width) // 2, (size[1] - resized.height) // 2))
         
-        # Convert to WebP
-        webp_filename = f"{name}_{sort_order}_{int(time.time())}.webp"
-        webp_path = os.path.join(upload_dir, webp_filename)
+        buffer = io.BytesIO()
+        output.save(buffer, 'WebP', quality=quality)
+        encoded.append((os.path.join(upload_dir, f"{spec.get('prefix', '')}{webp_filename}"), buffer.getvalue()))
+    
+    os.makedirs(upload_dir, exist_ok=True)
+    for path, data in encoded:
+        _write_atomic(path, data)
+    return [path for path, _ in encoded]
+
+def available_image_formats(formats=None):
+    """Return the configured rendition formats this Pillow build can encode"""
+    formats = formats or Config.PRODUCT_IMAGE_FORMATS
+    return tuple(fmt for fmt in formats if fmt in IMAGE_FORMAT_OPTIONS and features.check(fmt))
+
+def _save_params(fmt):
+    return dict(IMAGE_FORMAT_OPTIONS[fmt]['params'], quality=Config.IMAGE_QUALITY[fmt])
+
+def rendition_spec(widths=None, formats=None):
+    """Fingerprint of the ladder settings; renditions built with the same spec are up to date"""
+    widths = sorted(set(widths or Config.PRODUCT_IMAGE_WIDTHS))
+    formats = available_image_formats(formats)
+    settings = [widths, [[fmt, sorted(_save_params(fmt).items())] for fmt in formats]]
+    return hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()[:12]
+
+def ad_rendition_spec():
+    """Fingerprint of the ad banner settings (sizes and WebP quality)"""
+    settings = [sorted((name, tuple(size)) for name, size in Config.AD_IMAGE_SIZE.items()), Config.IMAGE_QUALITY['webp']]
+    return hashlib.sha256(repr(settings).encode('utf-8')).hexdigest()[:12]
+
+def render_rendition_ladder(source, upload_dir, url_dir, widths=None, formats=None):
+    """Decode an image (path or bytes) once and write the responsive rendition ladder.
+    
+    Every ladder step (longest edge in pixels) is encoded in each available
+    format and stored as ``<content hash>.<ext>``, so files never change
+    once written and can be cached immutably. Steps above the source size
+    collapse into one rendition at the source size.
+    
+    Returns the metadata stored in ``ProductImage.renditions``:
+    ``{'width', 'height', 'spec', '<format>': [[width, path], ...]}`` with
+    widths ascending and paths relative to the static folder.
+    """
+    widths = sorted(set(widths or Config.PRODUCT_IMAGE_WIDTHS), reverse=True)
+    formats = available_image_formats(formats)
+    bitmap = _decode(source, (widths[0], widths[0]))
+    
+    metadata = {'width': None, 'height': None, 'spec': rendition_spec(widths, formats)}
+    metadata.update({fmt: [] for fmt in formats})
+    files = {}
+    seen = set()
+    for _, resized in _cascade(bitmap, [(width, width) for width in widths]):
+        if resized.size in seen:
+            continue
+        seen.add(resized.size)
+        if metadata['width'] is None:
+            metadata['width'], metadata['height'] = resized.size
         
-        if convert_to_webp(original_path, webp_path):
-            # Remove original file
-            os.remove(original_path)
-            
-            # Generate thumbnail
-            thumb_filename = f"thumb_{webp_filename}"
-            thumb_path = os.path.join(upload_dir, thumb_filename)
-            generate_thumbnail(webp_path, thumb_path)
-            
-            # Return relative path for database storage
-            relative_path = '/'.join(['uploads', 'products', str(product_id), webp_filename])
-            return relative_path, None
+        for fmt in formats:
+            buffer = io.BytesIO()
+            resized.save(buffer, IMAGE_FORMAT_OPTIONS[fmt]['format'], **_save_params(fmt))
+            data = buffer.getvalue()
+            filename = f"{hashlib.sha256(data).hexdigest()[:20]}.{fmt}"
+            files[filename] = data
+            metadata[fmt].append([resized.width, f"{url_dir}/{filename}"])
+    
+    os.makedirs(upload_dir, exist_ok=True)
+    for filename, data in files.items():
+        path = os.path.join(upload_dir, filename)
+        # Same name means same bytes; refresh the mtime so `images gc` treats it as new
+        if os.path.exists(path):
+            os.utime(path)
         else:
-            # If WebP conversion failed, remove original and return error
-            os.remove(original_path)
-            return None, "Failed to process image"
+            _write_atomic(path, data)
+    
+    for fmt in formats:
+        metadata[fmt].sort()
+    return metadata
+
+def render_product_image(source, upload_dir, url_dir):
+    """Generate the rendition ladder from uploaded image bytes.
+    
+    Returns the rendition metadata, or None if the image could not be processed.
+    """
+    try:
+        return render_rendition_ladder(source, upload_dir, url_dir)
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None
+
+def render_ad_image(source, upload_dir, webp_filename, image_type='desktop'):
+    """Generate the sized WebP banner from uploaded image bytes"""
+    try:
+        target_size = Config.AD_IMAGE_SIZE.get(image_type, Config.PRODUCT_IMAGE_SIZE)
+        render_renditions(source, upload_dir, webp_filename, {image_type: {'size': target_size, 'pad': True}})
+        return True
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return False
+
+def process_product_image(file, product_id, is_primary=False, sort_order=0):
+    """Process and save product image; returns (rendition metadata, error)"""
+    if not allowed_file(file.filename):
+        return None, "Invalid file type"
+    
+    try:
+        upload_dir, _ = product_image_target(file.filename, product_id, sort_order)
+        renditions = render_product_image(read_upload(file), upload_dir, f"uploads/products/{product_id}")
+        if renditions:
+            return renditions, None
+        return None, "Failed to process image"
             
     except Exception as e:
         return None, f"Error processing image: {str(e)}"
@@ -109,76 +328,120 @@ def process_ad_image(file, ad_id, image_type='desktop'):
         return None, "Invalid file type"
     
     try:
-        # Create directory if it doesn't exist
-        upload_dir = os.path.join(Config.UPLOAD_FOLDER, 'ads', str(ad_id))
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Generate unique filename
-        filename = secure_filename(file.filename)
-        name, ext = os.path.splitext(filename)
-        unique_filename = f"{image_type}_{name}_{int(time.time())}{ext}"
-        
-        # Save original file
-        original_path = os.path.join(upload_dir, unique_filename)
-        file.save(original_path)
-        
-        # Convert to WebP
-        webp_filename = f"{image_type}_{name}_{int(time.time())}.webp"
-        webp_path = os.path.join(upload_dir, webp_filename)
-        
-        # Get target size based on image type
-        target_size = Config.AD_IMAGE_SIZE.get(image_type, Config.PRODUCT_IMAGE_SIZE)
-        
-        if resize_image(original_path, webp_path, target_size):
-            # Remove original file
-            os.remove(original_path)
-            
+        upload_dir, webp_filename = ad_image_target(file.filename, ad_id, image_type)
+        if render_ad_image(read_upload(file), upload_dir, webp_filename, image_type):
             # Return relative path for database storage
             relative_path = '/'.join(['uploads', 'ads', str(ad_id), webp_filename])
             return relative_path, None
-        else:
-            # If processing failed, remove original and return error
-            os.remove(original_path)
-            return None, "Failed to process image"
+        return None, "Failed to process image"
             
     except Exception as e:
         return None, f"Error processing image: {str(e)}"
 
 def delete_image(image_path):
-    """Delete image file and its thumbnail if exists"""
+    """Delete image file and its legacy derivatives if they exist"""
     try:
         if os.path.exists(image_path):
             os.remove(image_path)
             
-            # Try to delete thumbnail
+            # Try to delete thumbnails written before the rendition ladder
             dir_name = os.path.dirname(image_path)
             file_name = os.path.basename(image_path)
-            thumb_path = os.path.join(dir_name, f"thumb_{file_name}")
-            if os.path.exists(thumb_path):
-                os.remove(thumb_path)
+            for prefix in LEGACY_RENDITION_PREFIXES:
+                rendition_path = os.path.join(dir_name, f"{prefix}{file_name}")
+                if os.path.exists(rendition_path):
+                    os.remove(rendition_path)
                 
         return True
     except Exception as e:
         print(f"Error deleting image: {e}")
         return False
 
-def get_image_url(image_path, thumbnail=False):
-    """Get full URL for image"""
-    if not image_path:
+def _static_url(path):
+    return url_for('static', filename=path.replace(os.sep, '/'))
+
+def get_image_url(image, width=None):
+    """Get URL for an image path or the ProductImage rendition closest to width; never touches the filesystem"""
+    if not image:
         return None
     
-    if thumbnail:
-        # Try to get thumbnail version
-        dir_name = os.path.dirname(image_path)
-        file_name = os.path.basename(image_path)
-        thumb_path = os.path.join(dir_name, f"thumb_{file_name}")
-        
-        # Check if thumbnail exists
-        if os.path.exists(os.path.join('static', thumb_path)):
-            return f"/static/{thumb_path}"
+    if isinstance(image, str):
+        return _static_url(image)
+    return _static_url(image.get_rendition_path(width))
+
+def product_picture(image, alt='', sizes='100vw', width=None, **attrs):
+    """Render a <picture> with AVIF/WebP srcsets for a ProductImage.
+    
+    ``width`` picks the fallback ``src``; extra keyword arguments become
+    attributes of the ``<img>`` (e.g. ``class``, ``style``, ``loading``).
+    Images without renditions render as a plain ``<img>``.
+    """
+    if not image:
+        return Markup('')
+    
+    renditions = image.get_renditions()
+    img_attrs = {'src': get_image_url(image, width), 'alt': alt}
+    if renditions:
+        img_attrs['srcset'] = image_srcset(image, 'webp')
+        img_attrs['sizes'] = sizes
+        img_attrs['width'] = renditions.get('width')
+        img_attrs['height'] = renditions.get('height')
+    img_attrs.update(attrs)
+    
+    img = Markup('<img {}>').format(Markup(' ').join(
+        Markup('{}="{}"').format(name, value) for name, value in img_attrs.items() if value is not None
+    ))
+    if not renditions:
+        return img
+    
+    sources = [
+        Markup('<source type="{}" srcset="{}" sizes="{}">').format(
+            IMAGE_FORMAT_OPTIONS[fmt]['mime'], image_srcset(image, fmt), sizes
+        )
+        for fmt in IMAGE_FORMAT_OPTIONS
+        if fmt != 'webp' and renditions.get(fmt)
+    ]
+    return Markup('<picture>{}{}</picture>').format(Markup('').join(sources), img)
+
+def image_srcset(image, fmt='webp'):
+    """Build a srcset attribute value from stored rendition metadata"""
+    return ', '.join(
+        f"{_static_url(path)} {width}w" for width, path in image.get_renditions().get(fmt, ())
+    )
+
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory up to UPLOAD_MEMORY_LIMIT instead of a temp file"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        limit = current_app.config.get('UPLOAD_MEMORY_LIMIT') if has_app_context() else None
+        if not limit:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return tempfile.SpooledTemporaryFile(max_size=limit, mode='rb+')
+
+def init_image_helpers(app):
+    """Register image template helpers and far-future caching for content-hashed renditions"""
+    app.add_template_global(product_picture)
+    app.add_template_global(image_srcset)
+    app.add_template_global(get_image_url, 'image_url')
+    
+    uploads_prefix = f"{app.static_url_path}/uploads/"
+    originals_prefix = f"{uploads_prefix}{ORIGINALS_DIR}/"
+    
+    @app.before_request
+    def _hide_originals():
+        # Originals keep the uploader's metadata (e.g. EXIF location); only renditions are public
+        if request.path.startswith(originals_prefix):
+            abort(404)
     
-    # Return original image
-    return f"/static/{image_path.replace('\\', '/')}"
+    @app.after_request
+    def _cache_hashed_renditions(response):
+        if response.status_code == 200 and request.path.startswith(uploads_prefix) and \
+                HASHED_RENDITION_RE.match(request.path.rsplit('/', 1)[-1]):
+            response.cache_control.public = True
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
 
 # Import time for unique filename generation
 import time
@@ -0,0 +1,89 @@
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'
+
+
+class PasswordHasher:
+    """Hash and verify passwords under one configurable Werkzeug method.
+
+    Hashing runs on a bounded thread pool: hashlib releases the GIL while
+    deriving keys, so other request threads keep running during a login
+    burst, and at most `workers` hashes compete for the CPUs at once.
+    """
+
+    def __init__(self, method=DEFAULT_PASSWORD_HASH_METHOD, workers=None):
+        self.method = method
+        self.workers = workers or os.cpu_count() or 1
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._stored_prefix = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _run(self, func, *args):
+        return self._get_executor().submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash or password is None:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    @property
+    def stored_prefix(self):
+        """Method prefix of hashes made under this policy, with Werkzeug's defaults filled in"""
+        if self._stored_prefix is None:
+            # 'pbkdf2' is stored as 'pbkdf2:sha256:600000' etc.; let Werkzeug normalize it once
+            self._stored_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._stored_prefix
+
+    def needs_rehash(self, password_hash):
+        """True if a stored hash was made with another algorithm or cost (cheaper or dearer)"""
+        return not password_hash or password_hash.split('$', 1)[0] != self.stored_prefix
+
+
+def init_password_hasher(app):
+    """Create the password hashing policy for this app"""
+    hasher = PasswordHasher(
+        method=app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_PASSWORD_HASH_METHOD,
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+    )
+    app.extensions['password_hasher'] = hasher
+    atexit.register(hasher.shutdown)
+    return hasher
+
+
+_fallback_hasher = None
+
+
+def get_password_hasher():
+    global _fallback_hasher
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return current_app.extensions['password_hasher']
+    # Scripts that build models without an app still hash under the default policy
+    if _fallback_hasher is None:
+        _fallback_hasher = PasswordHasher()
+    return _fallback_hasher
+
+
+def hash_password(password):
+    return get_password_hasher().hash(password)
@@ -0,0 +1,166 @@
+import heapq
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List
+
+from flask import current_app, g, has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event
+
+from database import db
+
+
+@dataclass
+class QueryStats:
+    """SQL issued while handling one request"""
+    count: int = 0
+    total: float = 0.0  # seconds
+    slowest: List[tuple] = field(default_factory=list)  # min-heap of (duration, statement)
+
+    def add(self, duration, statement, keep):
+        self.count += 1
+        self.total += duration
+        if len(self.slowest) < keep:
+            heapq.heappush(self.slowest, (duration, statement))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, statement))
+
+    def server_timing(self):
+        return f'db;dur={self.total * 1000:.1f};desc="{self.count} queries"'
+
+
+def _template_origin(frame):
+    """'template.html:LINE' for the innermost Jinja template frame on the stack, if any"""
+    while frame is not None:
+        template = frame.f_globals.get('__jinja_template__')
+        if template is not None:
+            return f'{template.name or template.filename}:{template.get_corresponding_lineno(frame.f_lineno)}'
+        frame = frame.f_back
+    return None
+
+
+def _code_origin(frame, root):
+    """'path.py:LINE' for the innermost frame in the app's own code"""
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and 'site-packages' not in filename and filename != __file__:
+            return f'{os.path.relpath(filename, root)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryInstrumentation:
+    """Per-request SQL counters, a Server-Timing header and a slow-query log.
+
+    The cursor listeners are only attached to the engines while enabled,
+    so turning it off removes every per-query cost rather than testing
+    a flag on each statement. enable()/disable() only switch the process
+    they run in; use SQL_INSTRUMENTATION to switch every worker.
+
+    Counts stop at after_request: statements run later, such as the
+    server-side session store write in save_session, are not included.
+    """
+
+    def __init__(self, app, slow_threshold=0.1, keep_slowest=3):
+        self.app = app
+        self.slow_threshold = slow_threshold  # seconds
+        self.keep_slowest = keep_slowest
+        self.root = os.path.abspath(app.root_path) + os.sep
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._engines = []
+
+    def enable(self):
+        with self._lock:
+            if self.enabled:
+                return
+            with self.app.app_context():
+                self._engines = list(dict.fromkeys(db.engines.values()))
+            for engine in self._engines:
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            if not self.enabled:
+                return
+            for engine in self._engines:
+                event.remove(engine, 'before_cursor_execute', self._before_cursor_execute)
+                event.remove(engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._engines = []
+            self.enabled = False
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the statement's execution context, so a failed statement leaves nothing behind
+        if context is not None:
+            context._query_stats_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_stats_start', None)
+        if started is None:
+            # Enabled while this statement was already running
+            return
+        duration = time.perf_counter() - started
+
+        in_request = has_request_context()
+        if in_request:
+            # Created on first use, so the session load before routing is counted too
+            stats = g.get('query_stats')
+            if stats is None:
+                stats = g.query_stats = QueryStats()
+            stats.add(duration, statement, self.keep_slowest)
+        if duration >= self.slow_threshold:
+            self._log_slow(duration, statement, request.endpoint if in_request else None)
+
+    def _log_slow(self, duration, statement, endpoint):
+        # Only slow statements pay for walking the stack
+        frame = sys._getframe(2)
+        origin = _template_origin(frame) or _code_origin(frame, self.root) or '?'
+        self.app.logger.warning(
+            'Slow query (%.1f ms) in %s at %s: %s',
+            duration * 1000,
+            endpoint or '-',
+            origin,
+            ' '.join(statement.split()),
+        )
+
+    def after_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        # Query counts and timings describe the backend; only show them to staff
+        if self.app.debug or (current_user.is_authenticated and current_user.is_admin):
+            response.headers.add('Server-Timing', stats.server_timing())
+        self.app.logger.debug(
+            'SQL %s: %d queries, %.1f ms; slowest: %s',
+            request.endpoint,
+            stats.count,
+            stats.total * 1000,
+            '; '.join(
+                f"{duration * 1000:.1f} ms {' '.join(statement.split())[:200]}"
+                for duration, statement in sorted(stats.slowest, reverse=True)
+            ),
+        )
+        return response
+
+
+def init_query_instrumentation(app):
+    """Per-request SQL stats; on at startup when SQL_INSTRUMENTATION is set"""
+    instrumentation = QueryInstrumentation(
+        app,
+        slow_threshold=app.config.get('SQL_SLOW_QUERY_MS', 100) / 1000,
+        keep_slowest=app.config.get('SQL_SLOWEST_PER_REQUEST', 3),
+    )
+    app.after_request(instrumentation.after_request)
+    app.extensions['query_instrumentation'] = instrumentation
+    if app.config.get('SQL_INSTRUMENTATION'):
+        instrumentation.enable()
+    return instrumentation
+
+
+def get_query_instrumentation():
+    return current_app.extensions['query_instrumentation']
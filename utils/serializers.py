@@ -0,0 +1,193 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy.orm import load_only, selectinload
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+from config import Config
+from models import Category, Product
+from utils.image_utils import image_srcset
+
+
+# Dates and times go through default() so they keep Flask's HTTP-date format either way
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0
+
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """jsonify() without pretty-printing or key sorting, encoded by orjson when it is installed.
+
+    Output is the same with or without orjson; only the speed differs.
+    """
+
+    compact = True
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs.get('indent'):
+            return orjson.dumps(obj, default=self.default, option=_ORJSON_OPTIONS).decode('utf-8')
+        kwargs.setdefault('ensure_ascii', False)
+        return super().dumps(obj, **kwargs)
+
+
+def init_json(app):
+    """Install the compact JSON provider used by jsonify() and the API serializers"""
+    app.json = CompactJSONProvider(app)
+
+
+@dataclass(frozen=True)
+class Field:
+    """One output key: how to read it and which columns/relationships it needs"""
+    get: Callable[[Any], Any]
+    columns: Tuple[str, ...] = ()
+    options: Tuple[Callable[[], Any], ...] = ()  # loader options, e.g. selectinload of a relationship
+    prefetch: Optional[Callable[[list], None]] = None  # batch loader run once over all objects
+
+
+def attr(name):
+    return Field(lambda obj: getattr(obj, name), columns=(name,))
+
+
+def money(name):
+    """Decimal column as a JSON number (None stays null)"""
+    def get(obj):
+        value = getattr(obj, name)
+        return float(value) if value is not None else None
+    return Field(get, columns=(name,))
+
+
+class Serializer:
+    """Declarative model serializer with sparse fieldsets.
+
+    Subclasses set model and an ordered fields mapping; `?fields=a,b`
+    narrows the output, and load_options() loads only the columns and
+    relationships those fields read.
+    """
+
+    model = None
+    fields = {}
+    key_columns = ('id',)
+
+    def __init__(self, only=None):
+        if only:
+            unknown = [name for name in only if name not in self.fields]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+            self.selected = [name for name in self.fields if name in only]
+        else:
+            self.selected = list(self.fields)
+
+    @classmethod
+    def from_request(cls):
+        """Build a serializer for the fields named in ?fields= (all fields if absent); raises ValueError"""
+        raw = request.args.get('fields', '')
+        only = [name.strip() for name in raw.split(',') if name.strip()]
+        return cls(only or None)
+
+    def _selected_fields(self):
+        return [self.fields[name] for name in self.selected]
+
+    def load_options(self):
+        columns = dict.fromkeys(self.key_columns)
+        options = []
+        for field in self._selected_fields():
+            columns.update(dict.fromkeys(field.columns))
+            options.extend(option() for option in field.options)
+        return [load_only(*(getattr(self.model, column) for column in columns))] + options
+
+    def dump(self, obj):
+        return {name: self.fields[name].get(obj) for name in self.selected}
+
+    def dump_many(self, objects):
+        objects = list(objects)
+        for field in self._selected_fields():
+            if field.prefetch is not None and objects:
+                field.prefetch(objects)
+        return [self.dump(obj) for obj in objects]
+
+
+def _category_summary(product):
+    category = product.category
+    return {'id': category.id, 'name': category.name, 'slug': category.slug} if category else None
+
+
+def _category_option():
+    return selectinload(Product.category).load_only(Category.id, Category.name, Category.slug)
+
+
+def _primary_image_url(product):
+    image = product.get_primary_image()
+    return f"/static/{image.image_path}" if image else None
+
+
+def _image_data(image, thumbnail_width):
+    return {
+        'id': image.id,
+        'url': f"/static/{image.image_path}",
+        'thumbnail': f"/static/{image.get_rendition_path(thumbnail_width)}",
+        'srcset': image_srcset(image),
+        'is_primary': image.is_primary,
+        'alt_text': image.alt_text,
+    }
+
+
+def _product_images(product):
+    return [_image_data(image, Config.THUMBNAIL_SIZE[0]) for image in product.get_all_images()]
+
+
+_PRICE_COLUMNS = ('regular_price', 'sale_price')
+_STOCK_COLUMNS = ('manage_stock', 'stock_status', 'stock_quantity')
+
+
+class ProductListSerializer(Serializer):
+    """Products as listed by /api/products"""
+
+    model = Product
+    fields = {
+        'id': attr('id'),
+        'name': attr('name'),
+        'slug': attr('slug'),
+        'description': attr('short_description'),
+        'price': Field(lambda product: float(product.current_price), columns=_PRICE_COLUMNS),
+        'regular_price': money('regular_price'),
+        'sale_price': Field(lambda product: float(product.sale_price) if product.sale_price else None,
+                            columns=('sale_price',)),
+        'discount_percentage': Field(lambda product: product.discount_percentage, columns=_PRICE_COLUMNS),
+        'is_on_sale': Field(lambda product: product.is_on_sale, columns=_PRICE_COLUMNS),
+        'is_in_stock': Field(lambda product: product.is_in_stock, columns=_STOCK_COLUMNS),
+        'stock_quantity': attr('stock_quantity'),
+        'image': Field(_primary_image_url, prefetch=Product.prefetch_primary_images),
+        'category': Field(_category_summary, columns=('category_id',), options=(_category_option,)),
+    }
+
+
+class ProductDetailSerializer(ProductListSerializer):
+    """A single product as returned by /api/products/<id>"""
+
+    fields = {
+        'id': attr('id'),
+        'name': attr('name'),
+        'slug': attr('slug'),
+        'description': attr('description'),
+        'short_description': attr('short_description'),
+        'sku': attr('sku'),
+        'price': ProductListSerializer.fields['price'],
+        'regular_price': ProductListSerializer.fields['regular_price'],
+        'sale_price': ProductListSerializer.fields['sale_price'],
+        'discount_percentage': ProductListSerializer.fields['discount_percentage'],
+        'is_on_sale': ProductListSerializer.fields['is_on_sale'],
+        'is_in_stock': ProductListSerializer.fields['is_in_stock'],
+        'stock_quantity': attr('stock_quantity'),
+        'weight': Field(lambda product: float(product.weight) if product.weight else None, columns=('weight',)),
+        'dimensions': attr('dimensions'),
+        'color': attr('color'),
+        'size': attr('size'),
+        'material': attr('material'),
+        'images': Field(_product_images, prefetch=Product.prefetch_images),
+        'category': ProductListSerializer.fields['category'],
+    }
@@ -0,0 +1,232 @@
+import hashlib
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from database import db
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives in a SessionStore under an opaque id"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+        # Used to rotate the id when someone logs in or out
+        self.loaded_user_id = (initial or {}).get('_user_id')
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class MemorySessionStore:
+    """Process-local LRU of serialized sessions; for single-process deployments"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._items = OrderedDict()  # sid -> (data, expires_at)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            item = self._items.get(sid)
+            if item is None:
+                return None
+            if item[1] <= datetime.utcnow():
+                del self._items[sid]
+                return None
+            self._items.move_to_end(sid)
+            return item
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._items[sid] = (data, expires_at)
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._items.pop(sid, None)
+
+    def gc(self, batch_size=1000, now=None):
+        now = now or datetime.utcnow()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._items.items() if expires_at <= now]
+            for sid in expired:
+                del self._items[sid]
+        return len(expired)
+
+
+class SqlSessionStore:
+    """Sessions in the server_sessions table, shared by every app process.
+
+    Uses its own connections from the engine, never db.session, so saving
+    a session can't commit or roll back a view's unit of work.
+    """
+
+    def __init__(self):
+        from models.session import ServerSession
+        self.table = ServerSession.__table__
+
+    def load(self, sid):
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                db.select(self.table.c.data, self.table.c.expires_at).where(self.table.c.id == sid)
+            ).first()
+        if row is None or row.expires_at <= datetime.utcnow():
+            return None
+        return row.data, row.expires_at
+
+    def save(self, sid, data, expires_at):
+        with db.engine.begin() as connection:
+            updated = connection.execute(
+                self.table.update().where(self.table.c.id == sid).values(data=data, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                connection.execute(
+                    self.table.insert().values(
+                        id=sid, data=data, expires_at=expires_at, created_at=datetime.utcnow()
+                    )
+                )
+
+    def delete(self, sid):
+        with db.engine.begin() as connection:
+            connection.execute(self.table.delete().where(self.table.c.id == sid))
+
+    def gc(self, batch_size=1000, now=None):
+        """Delete expired sessions batch_size rows per transaction; returns the number removed"""
+        now = now or datetime.utcnow()
+        removed = 0
+        while True:
+            with db.engine.begin() as connection:
+                ids = connection.execute(
+                    db.select(self.table.c.id).where(self.table.c.expires_at <= now).limit(batch_size)
+                ).scalars().all()
+                if not ids:
+                    return removed
+                connection.execute(self.table.delete().where(self.table.c.id.in_(ids)))
+            removed += len(ids)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keep session data in a store; the cookie only carries a signed random id.
+
+    Stored sessions expire after PERMANENT_SESSION_LIFETIME. An unchanged
+    session is written back only once half of that lifetime has passed,
+    so ordinary page views cost one store read and no write.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session', key_derivation='hmac', digest_method=hashlib.sha256)
+
+    @staticmethod
+    def _new_sid():
+        return secrets.token_urlsafe(32)
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        if request.path.startswith((f'{app.static_url_path}/', '/assets/')):
+            # Static files never use the session; don't pay a store read for each one
+            return ServerSideSession(sid=self._new_sid(), new=True)
+
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('ascii')
+            except (BadSignature, UnicodeDecodeError):
+                sid = None
+            stored = self.store.load(sid) if sid else None
+            if stored is not None:
+                data, expires_at = stored
+                return ServerSideSession(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+
+        # Unknown or expired ids are never reused, so clients can't pick their own
+        return ServerSideSession(sid=self._new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+                response.vary.add('Cookie')
+            return
+
+        if not session.new and session.get('_user_id') != session.loaded_user_id:
+            # Logging in or out gets a fresh id (session fixation)
+            self.store.delete(session.sid)
+            session.sid = self._new_sid()
+            session.new = True
+
+        now = datetime.utcnow()
+        lifetime = app.permanent_session_lifetime
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.new or session.modified or stale):
+            return
+
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), now + lifetime)
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode('ascii'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add('Cookie')
+
+
+def init_sessions(app):
+    """Install the server-side session interface selected by SESSION_STORE (sql, memory or cookie)"""
+    kind = (app.config.get('SESSION_STORE') or 'sql').lower()
+    if kind == 'cookie':
+        # Flask's default signed-cookie sessions
+        return None
+    if kind == 'memory':
+        store = MemorySessionStore(max_entries=app.config.get('SESSION_MEMORY_MAX_ENTRIES', 10000))
+    elif kind == 'sql':
+        store = SqlSessionStore()
+    else:
+        raise ValueError(f'Unknown SESSION_STORE {kind!r}; expected sql, memory or cookie')
+
+    app.session_interface = ServerSideSessionInterface(store)
+    app.extensions['session_store'] = store
+    return store